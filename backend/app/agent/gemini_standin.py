@@ -0,0 +1,198 @@
+"""
+Stand-in locale dell'API Gemini per test di carico e di latenza senza rete.
+Risponde a generateContent e streamGenerateContent (SSE) come l'API reale, con:
+- latenza del primo token da una distribuzione log-normale (mediana e dispersione)
+- velocità di generazione in token al secondo (i frammenti in streaming sono distribuiti nel tempo)
+- iniezione di errori (percentuale e codici HTTP, es. 429 e 503)
+- cache implicita: un prefisso di sistema già visto, sopra il minimo di token, viene
+  riportato in cachedContentTokenCount
+Le risposte sono sintetiche ma nel formato atteso dall'agente: JSON conforme allo schema
+richiesto, "{}" per i prompt di estrazione, testo di lunghezza configurabile altrimenti.
+
+Avvio: python -m app.agent.gemini_standin (dalla cartella backend), poi nell'app
+LLM_PROVIDER=standin e LLM_STANDIN_URL=http://127.0.0.1:8090.
+La configurazione si legge da STANDIN_* e si può cambiare a caldo con POST /standin/config.
+"""
+import os
+import json
+import random
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+REPLY_WORDS = (
+    "Capisco, grazie per avermelo detto. Per darti un consiglio più preciso vorrei sapere "
+    "qualcosa in più sui tuoi interessi, su cosa ti piace studiare e su come immagini il tuo "
+    "futuro dopo il diploma, anche in termini di città e di tipo di percorso."
+).split()
+
+
+class StandInConfig(BaseModel):
+    """Parametri del comportamento simulato."""
+    latency_ms: float = float(os.getenv("STANDIN_LATENCY_MS", 300))  # Mediana del primo token
+    latency_sigma: float = float(os.getenv("STANDIN_LATENCY_SIGMA", 0.5))  # Dispersione log-normale
+    tokens_per_second: float = float(os.getenv("STANDIN_TOKENS_PER_SECOND", 80))
+    reply_tokens: int = int(os.getenv("STANDIN_REPLY_TOKENS", 40))
+    error_rate: float = float(os.getenv("STANDIN_ERROR_RATE", 0))
+    error_codes: List[int] = [int(code) for code in os.getenv("STANDIN_ERROR_CODES", "429,503").split(",")]
+    chunk_tokens: int = 8  # Token per frammento in streaming
+    cache_min_tokens: int = int(os.getenv("STANDIN_CACHE_MIN_TOKENS", 1024))  # Minimo per la cache implicita
+
+
+config = StandInConfig()
+rng = random.Random(os.getenv("STANDIN_SEED"))
+app = FastAPI(title="Gemini stand-in")
+stats: Dict[str, int] = {"requests": 0, "errors": 0, "streams": 0, "cache_hits": 0}
+# Cache implicita: prefissi di sistema già visti (modello, testo)
+prefixes: Set[Tuple[str, str]] = set()
+
+
+def _first_token_delay() -> float:
+    if config.latency_ms <= 0:
+        return 0.0
+    return rng.lognormvariate(0, config.latency_sigma) * config.latency_ms / 1000
+
+
+def _stub(schema: Dict[str, Any]) -> Any:
+    """Valore minimo conforme a uno schema Gemini/OpenAPI."""
+    if "enum" in schema:
+        return schema["enum"][0]
+    kind = str(schema.get("type", "object")).lower()
+    if kind == "object":
+        properties = schema.get("properties", {})
+        required = schema.get("required") or list(properties)
+        return {name: _stub(prop) for name, prop in properties.items() if name in required}
+    if kind == "array":
+        return []
+    if kind in ("integer", "number"):
+        return 0
+    if kind == "boolean":
+        return False
+    return " ".join(REPLY_WORDS[:config.reply_tokens])
+
+
+def _prompt_text(body: Dict[str, Any]) -> str:
+    contents = list(body.get("contents", []))
+    if body.get("systemInstruction"):
+        contents.insert(0, body["systemInstruction"])
+    return " ".join(part.get("text", "") for content in contents for part in content.get("parts", []))
+
+
+def _implicit_cache(model: str, body: Dict[str, Any]) -> int:
+    """Token del prefisso di sistema serviti dalla cache implicita (0 al primo uso o sotto il minimo)."""
+    system = _prompt_text({"systemInstruction": body.get("systemInstruction")})
+    tokens = len(system) // 4
+    if not system or tokens < config.cache_min_tokens:
+        return 0
+    key = (model, system)
+    if key not in prefixes:
+        prefixes.add(key)
+        return 0
+    stats["cache_hits"] += 1
+    return tokens
+
+
+def _api_error(code: int, status: str, message: str) -> JSONResponse:
+    return JSONResponse(status_code=code, content={"error": {"code": code, "message": message, "status": status}})
+
+
+def _reply_text(body: Dict[str, Any]) -> str:
+    generation = body.get("generationConfig", {})
+    schema = generation.get("responseSchema") or generation.get("responseJsonSchema")
+    if generation.get("responseMimeType") == "application/json":
+        return json.dumps(_stub(schema or {}), ensure_ascii=False)
+    if '"field_name"' in _prompt_text(body):
+        return "{}"  # Prompt di estrazione: nessuna informazione trovata
+    tokens = min(config.reply_tokens, generation.get("maxOutputTokens") or config.reply_tokens)
+    words = [REPLY_WORDS[i % len(REPLY_WORDS)] for i in range(tokens)]
+    return " ".join(words)
+
+
+def _payload(text: str, model: str, prompt_tokens: int, output_tokens: int, final: bool = True,
+             cached_tokens: int = 0) -> Dict[str, Any]:
+    candidate: Dict[str, Any] = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+    if final:
+        candidate["finishReason"] = "STOP"
+    usage = {
+        "promptTokenCount": prompt_tokens,
+        "candidatesTokenCount": output_tokens,
+        "totalTokenCount": prompt_tokens + output_tokens,
+    }
+    if cached_tokens:
+        usage["cachedContentTokenCount"] = cached_tokens
+    return {"candidates": [candidate], "usageMetadata": usage, "modelVersion": model}
+
+
+def _injected_error() -> Optional[JSONResponse]:
+    if config.error_rate <= 0 or rng.random() >= config.error_rate:
+        return None
+    code = rng.choice(config.error_codes)
+    stats["errors"] += 1
+    status = {429: "RESOURCE_EXHAUSTED", 500: "INTERNAL", 503: "UNAVAILABLE", 504: "DEADLINE_EXCEEDED"}
+    return _api_error(code, status.get(code, "UNKNOWN"), "errore simulato dallo stand-in")
+
+
+async def _stream(text: str, model: str, prompt_tokens: int, cached_tokens: int) -> AsyncIterator[str]:
+    """Frammenti SSE distribuiti secondo tokens_per_second."""
+    words = text.split(" ")
+    step = max(config.chunk_tokens, 1)
+    for start in range(0, len(words), step):
+        chunk = words[start:start + step]
+        if start:
+            await asyncio.sleep(len(chunk) / config.tokens_per_second)
+        piece = " ".join(chunk) + (" " if start + step < len(words) else "")
+        final = start + step >= len(words)
+        payload = _payload(piece, model, prompt_tokens, start + len(chunk), final, cached_tokens)
+        yield f"data: {json.dumps(payload)}\r\n\r\n"
+
+
+@app.post("/{api_version}/models/{target}")
+async def generate(api_version: str, target: str, request: Request):
+    """generateContent e streamGenerateContent (modello:azione nel percorso)."""
+    model, _, action = target.partition(":")
+    if action not in ("generateContent", "streamGenerateContent"):
+        raise HTTPException(status_code=404, detail=f"Azione non supportata: {action}")
+
+    stats["requests"] += 1
+    body = await request.json()
+    cached_tokens = _implicit_cache(model, body)
+
+    await asyncio.sleep(_first_token_delay())
+    error = _injected_error()
+    if error is not None:
+        return error
+
+    text = _reply_text(body)
+    prompt_tokens = max(len(_prompt_text(body)) // 4, 1)
+    if action == "streamGenerateContent":
+        stats["streams"] += 1
+        return StreamingResponse(_stream(text, model, prompt_tokens, cached_tokens), media_type="text/event-stream")
+
+    output_tokens = len(text.split())
+    if config.tokens_per_second > 0:
+        await asyncio.sleep(output_tokens / config.tokens_per_second)
+    return _payload(text, model, prompt_tokens, output_tokens, cached_tokens=cached_tokens)
+
+
+@app.get("/standin/config")
+async def get_config():
+    return {"config": config.model_dump(), "stats": stats}
+
+
+@app.post("/standin/config")
+async def update_config(changes: Dict[str, Any]):
+    """Aggiorna a caldo latenza, velocità ed errori (es. per simulare un disservizio)."""
+    global config
+    config = config.model_copy(update=changes)
+    return {"config": config.model_dump()}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    port = int(os.getenv("STANDIN_PORT", 8090))
+    print(f"🧪 Stand-in Gemini su http://127.0.0.1:{port}")
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
@@ -0,0 +1,200 @@
+"""
+Provider dei modelli per il gateway Gemini: da dove arrivano le risposte.
+- genai: API reale di Google (default)
+- standin: server locale che imita l'API (agent/gemini_standin.py), per test di carico offline
+- record / replay: cassetta su file JSON; "record" inoltra all'API reale e salva ogni
+  risposta, "replay" risponde solo dalla cassetta, senza rete né API key
+Il provider si sceglie con LLM_PROVIDER e agisce a livello di trasporto httpx, quindi
+il client google-genai, le chiamate in streaming e il gateway restano invariati.
+"""
+import os
+import json
+import hashlib
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), 'data')
+
+
+class CassetteMissError(Exception):
+    """Richiesta non presente nella cassetta in modalità replay."""
+
+
+class LLMProvider:
+    """Interfaccia: opzioni del client genai e trasporti httpx da usare."""
+
+    name = "genai"
+    requires_api_key = True
+
+    def http_options(self) -> Dict[str, Any]:
+        """Campi aggiuntivi di types.HttpOptions (es. base_url)."""
+        return {}
+
+    def transports(self, limits: httpx.Limits) -> Tuple[Optional[httpx.BaseTransport], Optional[httpx.AsyncBaseTransport]]:
+        """Trasporti sync e async; None per quelli di default di httpx."""
+        return None, None
+
+    def close(self) -> None:
+        pass
+
+
+class GenaiProvider(LLMProvider):
+    """API Gemini reale."""
+
+
+class StandInProvider(LLMProvider):
+    """Server locale compatibile con generateContent/streamGenerateContent."""
+
+    name = "standin"
+    requires_api_key = False
+
+    def __init__(self, url: Optional[str] = None):
+        self.url = url or os.getenv("LLM_STANDIN_URL", "http://127.0.0.1:8090")
+
+    def http_options(self) -> Dict[str, Any]:
+        return {"base_url": self.url}
+
+
+def _cassette_key(request: httpx.Request) -> str:
+    """Chiave stabile della richiesta: metodo, percorso, query senza chiave API e corpo."""
+    query = sorted((k, v) for k, v in request.url.params.multi_items() if k != "key")
+    digest = hashlib.sha256()
+    digest.update(f"{request.method} {request.url.path} {query}\n".encode("utf-8"))
+    body = request.content
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True).encode("utf-8")
+    except ValueError:
+        pass
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class Cassette:
+    """Risposte registrate, per chiave di richiesta, in un file JSON."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def response(self, request: httpx.Request) -> httpx.Response:
+        entry = self.entries.get(_cassette_key(request))
+        if entry is None:
+            raise CassetteMissError(f"{request.method} {request.url.path} non registrata in {self.path}")
+        return httpx.Response(
+            entry["status"], headers={"content-type": entry["content_type"]},
+            content=entry["body"].encode("utf-8"), request=request
+        )
+
+    def record(self, request: httpx.Request, response: httpx.Response, body: bytes) -> None:
+        with self._lock:
+            self.entries[_cassette_key(request)] = {
+                "request": f"{request.method} {request.url.path}",
+                "status": response.status_code,
+                "content_type": response.headers.get("content-type", "application/json"),
+                "body": body.decode("utf-8"),
+            }
+
+    def save(self) -> None:
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, ensure_ascii=False, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+class _ReplayTransport(httpx.BaseTransport):
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        return self.cassette.response(request)
+
+
+class _AsyncReplayTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        return self.cassette.response(request)
+
+
+# Il corpo registrato è già decodificato: queste intestazioni non valgono più per la copia
+_ENCODING_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+
+
+def _decoded_response(request: httpx.Request, response: httpx.Response, body: bytes) -> httpx.Response:
+    """Risposta per il client con il corpo decodificato e le intestazioni coerenti."""
+    headers = [(k, v) for k, v in response.headers.multi_items() if k.lower() not in _ENCODING_HEADERS]
+    return httpx.Response(response.status_code, headers=headers, content=body, request=request)
+
+
+class _RecordTransport(httpx.BaseTransport):
+    def __init__(self, cassette: Cassette, upstream: httpx.BaseTransport):
+        self.cassette = cassette
+        self.upstream = upstream
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        response = self.upstream.handle_request(request)
+        body = response.read()
+        self.cassette.record(request, response, body)
+        return _decoded_response(request, response, body)
+
+
+class _AsyncRecordTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette: Cassette, upstream: httpx.AsyncBaseTransport):
+        self.cassette = cassette
+        self.upstream = upstream
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        response = await self.upstream.handle_async_request(request)
+        body = await response.aread()
+        self.cassette.record(request, response, body)
+        return _decoded_response(request, response, body)
+
+
+class CassetteProvider(LLMProvider):
+    """Registrazione (mode="record") o riproduzione (mode="replay") delle risposte su file."""
+
+    def __init__(self, mode: str = "replay", path: Optional[str] = None,
+                 upstream: Optional[Tuple[httpx.BaseTransport, httpx.AsyncBaseTransport]] = None):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Modalità cassetta non valida: {mode}")
+        self.name = mode
+        self.requires_api_key = mode == "record"
+        self.upstream = upstream  # Trasporti verso l'API da registrare (default: rete)
+        self.cassette = Cassette(path or os.getenv("LLM_CASSETTE_PATH", os.path.join(DATA_DIR, 'cassettes', 'gemini.json')))
+
+    def transports(self, limits: httpx.Limits) -> Tuple[Optional[httpx.BaseTransport], Optional[httpx.AsyncBaseTransport]]:
+        if self.name == "replay":
+            return _ReplayTransport(self.cassette), _AsyncReplayTransport(self.cassette)
+        # In registrazione le risposte (anche quelle in streaming) arrivano al client tutte insieme
+        upstream, async_upstream = self.upstream or (
+            httpx.HTTPTransport(limits=limits), httpx.AsyncHTTPTransport(limits=limits)
+        )
+        return _RecordTransport(self.cassette, upstream), _AsyncRecordTransport(self.cassette, async_upstream)
+
+    def close(self) -> None:
+        if self.name == "record":
+            self.cassette.save()
+            print(f"📼 Cassetta salvata: {len(self.cassette.entries)} risposte in {self.cassette.path}")
+
+
+def provider_from_env() -> LLMProvider:
+    """Provider configurato da LLM_PROVIDER (genai | standin | record | replay)."""
+    name = os.getenv("LLM_PROVIDER", "genai").lower()
+    if name == "standin":
+        return StandInProvider()
+    if name in ("record", "replay"):
+        return CassetteProvider(name)
+    return GenaiProvider()
@@ -0,0 +1,106 @@
+"""
+Test di carico offline di agente + API contro lo stand-in Gemini (nessuna rete, nessuna API key).
+Avvia lo stand-in in un thread, poi simula conversazioni concorrenti su /api/chat
+(o /api/chat/stream) e stampa le percentili di latenza per turno.
+Uso (dalla cartella backend):
+    python -m app.benchmark_chat_load [sessioni] [turni] [concorrenza] [--stream]
+Latenza, velocità ed errori dello stand-in si regolano con STANDIN_* (vedi agent/gemini_standin.py).
+"""
+import os
+import sys
+import time
+import asyncio
+import threading
+
+STANDIN_PORT = int(os.getenv("STANDIN_PORT", 8090))
+os.environ["LLM_PROVIDER"] = "standin"
+os.environ.setdefault("LLM_STANDIN_URL", f"http://127.0.0.1:{STANDIN_PORT}")
+
+import httpx
+import uvicorn
+
+try:
+    from agent import gemini_standin
+    import main
+except ImportError:
+    from .agent import gemini_standin
+    from . import main
+
+MESSAGES = [
+    "Ciao! Abito a Bologna",
+    "Frequento il liceo scientifico",
+    "Mi piacciono matematica e fisica",
+    "Vorrei un lavoro ben pagato, preferisco il pubblico",
+    "Quali corsi mi consigli? Mi interessa anche l'informatica",
+    "Grazie, e per quanto riguarda gli ITS?",
+]
+
+
+def start_standin() -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(gemini_standin.app, host="127.0.0.1", port=STANDIN_PORT, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] if ordered else 0.0
+
+
+async def conversation(client: httpx.AsyncClient, turns: int, stream: bool, latencies, errors) -> None:
+    session_id = None
+    for turn in range(turns):
+        payload = {"message": MESSAGES[turn % len(MESSAGES)], "session_id": session_id}
+        start = time.perf_counter()
+        try:
+            if stream:
+                async with client.stream("POST", "/api/chat/stream", json=payload) as response:
+                    async for line in response.aiter_lines():
+                        if line.startswith("data:") and '"session_id"' in line and session_id is None:
+                            session_id = line.split('"session_id": "')[1].split('"')[0]
+            else:
+                response = await client.post("/api/chat", json=payload)
+                response.raise_for_status()
+                session_id = response.json()["session_id"]
+        except Exception as e:
+            errors.append(e)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(sessions: int, turns: int, concurrency: int, stream: bool) -> None:
+    latencies, errors = [], []
+    limit = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=main.app)
+
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            async def bounded():
+                async with limit:
+                    await conversation(client, turns, stream, latencies, errors)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(bounded() for _ in range(sessions)))
+            elapsed = time.perf_counter() - start
+
+    print("\n" + "=" * 50)
+    print(f"📊 {len(latencies)} turni in {elapsed:.1f}s ({len(latencies) / elapsed:.1f} turni/s), {len(errors)} errori")
+    for label, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+        print(f"   {label}: {percentile(latencies, fraction) * 1000:8.1f} ms")
+    print(f"   stand-in: {gemini_standin.stats}")
+    counters = main.metrics.snapshot()["counters"]
+    print(f"   gateway: { {name: value for name, value in counters.items() if name.startswith('llm_')} }")
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    sessions = int(args[0]) if len(args) > 0 else 50
+    turns = int(args[1]) if len(args) > 1 else 4
+    concurrency = int(args[2]) if len(args) > 2 else 20
+    stream = "--stream" in sys.argv
+
+    print(f"🚀 Carico: {sessions} sessioni x {turns} turni, concorrenza {concurrency}{' (streaming)' if stream else ''}")
+    start_standin()
+    asyncio.run(run(sessions, turns, concurrency, stream))
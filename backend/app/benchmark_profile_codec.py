@@ -0,0 +1,73 @@
+"""
+Micro-benchmark: codec versionato contro il percorso JSON di pydantic.
+Uso: python benchmark_profile_codec.py [iterazioni]
+"""
+import sys
+import json
+import timeit
+
+# Import assoluti
+try:
+    import profile_codec
+    from student_profile import StudentProfile
+except ImportError:
+    import os
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    import profile_codec
+    from student_profile import StudentProfile
+
+
+def build_profile(turns: int = 20) -> StudentProfile:
+    """Profilo tipico a fine profilazione."""
+    profile = StudentProfile()
+    profile.update_field("location", "Bologna")
+    profile.update_field("school_type", "Liceo Scientifico")
+    profile.update_field("favorite_subjects", ["matematica", "fisica", "informatica"])
+    profile.update_field("hobbies", ["videogiochi", "calcio"])
+    profile.update_field("primary_goal", "passione")
+    profile.update_field("institution_preference", "pubblico")
+    profile.update_field("willing_to_relocate", True)
+    for i in range(turns):
+        role = "user" if i % 2 == 0 else "agent"
+        profile.add_conversation_turn(role, f"Messaggio di prova numero {i} della conversazione di orientamento")
+    return profile
+
+
+def bench(label, encode, decode, iterations):
+    blob = encode()
+    encode_us = timeit.timeit(encode, number=iterations) / iterations * 1e6
+    decode_us = timeit.timeit(lambda: decode(blob), number=iterations) / iterations * 1e6
+    print(f"{label:<28} {encode_us:>9.1f} µs {decode_us:>9.1f} µs {len(blob):>8} B")
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    profile = build_profile()
+    backend = "orjson" if profile_codec.orjson is not None else "json"
+
+    print(f"📊 Serializzazione StudentProfile ({iterations} iterazioni, codec su {backend})")
+    print(f"{'percorso':<28} {'encode':>12} {'decode':>12} {'dimensione':>10}")
+    bench(
+        "json.dumps(model_dump)",
+        lambda: json.dumps(profile.model_dump(mode="json")),
+        lambda blob: StudentProfile(**json.loads(blob)),
+        iterations,
+    )
+    bench(
+        "model_dump_json/validate",
+        profile.model_dump_json,
+        StudentProfile.model_validate_json,
+        iterations,
+    )
+    bench(
+        "profile_codec (validato)",
+        lambda: profile_codec.encode(profile),
+        lambda blob: profile_codec.decode(blob, trusted=False),
+        iterations,
+    )
+    bench(
+        "profile_codec (fidato)",
+        lambda: profile_codec.encode(profile),
+        profile_codec.decode,
+        iterations,
+    )
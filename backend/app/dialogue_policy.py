@@ -0,0 +1,131 @@
+"""
+Politica di dialogo deterministica per la fase di profilazione.
+Sceglie il prossimo campo da chiedere in base a missing_info_priority e lo formula
+pescando da un insieme di domande già pronte, senza chiamare Gemini.
+"""
+import zlib
+from typing import Dict, List, Optional
+
+try:
+    from student_profile import StudentProfile
+except ImportError:
+    from .student_profile import StudentProfile
+
+
+# Formulazioni alternative per ogni informazione mancante
+QUESTION_BANK: Dict[str, List[str]] = {
+    "location": [
+        "Per darti consigli mirati, dove vivi attualmente?",
+        "In quale città o regione abiti?",
+        "Da dove mi scrivi? Dimmi la città o la zona in cui vivi.",
+        "Per cominciare, in che città abiti?",
+    ],
+    "school_type": [
+        "Che tipo di scuola superiore stai frequentando o hai frequentato?",
+        "Che scuola superiore frequenti? Liceo, istituto tecnico, professionale...?",
+        "Quale indirizzo di scuola superiore hai scelto?",
+        "Raccontami della tua scuola: che istituto frequenti o hai frequentato?",
+    ],
+    "favorite_subjects": [
+        "Quali materie ti piacciono di più a scuola?",
+        "Ci sono materie che ti appassionano particolarmente?",
+        "In quali materie ti senti più forte o ti diverti di più?",
+        "Quali sono le tue materie preferite?",
+    ],
+    "primary_goal": [
+        "Cosa ti aspetti dal percorso dopo il diploma: trovare lavoro presto, seguire una passione, altro?",
+        "Qual è la cosa più importante per te nella scelta dopo il diploma?",
+        "Pensando al futuro, punti soprattutto a trovare lavoro in fretta, a uno stipendio alto o a fare ciò che ti appassiona?",
+    ],
+    "institution_preference": [
+        "Preferisci un'università o un istituto pubblico, privato, o per te è indifferente?",
+        "Hai preferenze tra istituzioni pubbliche e private?",
+        "Ti interessa di più un ateneo pubblico o valuteresti anche quelli privati?",
+    ],
+    "willing_to_relocate": [
+        "Saresti disposto a trasferirti in un'altra città per studiare?",
+        "Ti sposteresti dalla tua città per il percorso giusto?",
+        "Preferisci restare vicino a casa o sei aperto a trasferirti?",
+    ],
+    "hobbies": [
+        "Cosa ti piace fare nel tempo libero?",
+        "Hai qualche hobby o passione fuori dalla scuola?",
+        "Come passi il tempo libero? Sport, musica, videogiochi, altro?",
+    ],
+    "learning_style": [
+        "Preferisci studiare la teoria o imparare facendo, con attività pratiche?",
+        "Ti trovi meglio con lo studio teorico o con laboratori e pratica?",
+        "Impari meglio sui libri o mettendo le mani in pasta?",
+    ],
+}
+
+# Brevi riconoscimenti per le informazioni appena raccolte
+ACKNOWLEDGEMENTS: Dict[str, List[str]] = {
+    "location": ["Perfetto, {value}!", "Ottimo, {value}.", "{value}, bene!"],
+    "school_type": ["{value}, ottima base!", "Bene, {value}.", "Perfetto, {value}."],
+    "favorite_subjects": ["{value}, interessante!", "Ottimo, {value}!", "Bene, prendo nota: {value}."],
+    "default": ["Perfetto, grazie!", "Ottimo, grazie.", "Bene, ne prendo nota."],
+}
+
+
+class DialoguePolicy:
+    """Sceglie e formula la prossima domanda di profilazione."""
+
+    def __init__(self, rewrite_min_words: int = 12):
+        # Oltre questa lunghezza il messaggio merita un riconoscimento contestuale (LLM)
+        self.rewrite_min_words = rewrite_min_words
+
+    def next_field(self, profile: StudentProfile) -> Optional[str]:
+        """Il campo mancante con priorità più alta, se ne esiste una domanda."""
+        for field in profile.missing_info_priority:
+            if field in QUESTION_BANK:
+                return field
+        return None
+
+    def _pick(self, options: List[str], profile: StudentProfile, salt: str) -> str:
+        """Scelta deterministica ma variata (per sessione e per turno)."""
+        key = f"{profile.session_id}:{salt}:{profile.history_total}"
+        return options[zlib.crc32(key.encode()) % len(options)]
+
+    def question_for(self, profile: StudentProfile) -> Optional[str]:
+        """Domanda per il prossimo campo mancante."""
+        field = self.next_field(profile)
+        if not field:
+            return None
+        return self._pick(QUESTION_BANK[field], profile, field)
+
+    def acknowledgement(self, profile: StudentProfile, updated_fields: List[str]) -> str:
+        """Riconoscimento per l'ultimo campo aggiornato."""
+        if not updated_fields:
+            return ""
+
+        field = updated_fields[-1]
+        value = getattr(profile, field, None)
+        if isinstance(value, list):
+            value = ", ".join(value[-2:])
+        if field not in ACKNOWLEDGEMENTS or not value:
+            field = "default"
+
+        return self._pick(ACKNOWLEDGEMENTS[field], profile, "ack").format(value=value)
+
+    def needs_rewrite(self, user_message: str, updated_fields: Optional[List[str]] = None) -> bool:
+        """
+        True se l'ultimo messaggio richiede un riconoscimento contestuale:
+        una domanda dello studente, un messaggio lungo o nessuna informazione estratta.
+        Con updated_fields=None valuta solo il testo del messaggio.
+        """
+        if "?" in user_message or len(user_message.split()) > self.rewrite_min_words:
+            return True
+        return updated_fields is not None and not updated_fields
+
+    def compose(self, profile: StudentProfile, updated_fields: List[str]) -> Optional[str]:
+        """Riconoscimento + domanda, interamente da template."""
+        question = self.question_for(profile)
+        if not question:
+            return None
+        ack = self.acknowledgement(profile, updated_fields)
+        return f"{ack} {question}" if ack else question
+
+
+# Istanza globale
+dialogue_policy = DialoguePolicy()
@@ -0,0 +1,292 @@
+"""
+Estrattore rapido basato su regole per le risposte più comuni durante la profilazione.
+Riconosce località, tipo di scuola e materie senza chiamare Gemini; quando non è
+sicuro lascia il messaggio all'estrattore LLM.
+"""
+import os
+import re
+import difflib
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+# Directory dati del progetto (per un eventuale elenco completo dei comuni)
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'data')
+COMUNI_FILE = os.getenv("COMUNI_FILE", os.path.join(DATA_DIR, 'fallback', 'comuni.txt'))
+
+REGIONS = [
+    "Abruzzo", "Basilicata", "Calabria", "Campania", "Emilia-Romagna",
+    "Friuli-Venezia Giulia", "Lazio", "Liguria", "Lombardia", "Marche",
+    "Molise", "Piemonte", "Puglia", "Sardegna", "Sicilia", "Toscana",
+    "Trentino-Alto Adige", "Umbria", "Valle d'Aosta", "Veneto",
+]
+
+# Capoluoghi di provincia e principali comuni
+CITIES = [
+    "Agrigento", "Alessandria", "Ancona", "Aosta", "Arezzo", "Ascoli Piceno", "Asti",
+    "Avellino", "Bari", "Barletta", "Andria", "Trani", "Belluno", "Benevento", "Bergamo",
+    "Biella", "Bologna", "Bolzano", "Brescia", "Brindisi", "Cagliari", "Caltanissetta",
+    "Campobasso", "Carbonia", "Caserta", "Catania", "Catanzaro", "Chieti", "Como",
+    "Cosenza", "Cremona", "Crotone", "Cuneo", "Enna", "Fermo", "Ferrara", "Firenze",
+    "Foggia", "Forlì", "Cesena", "Frosinone", "Genova", "Gorizia", "Grosseto", "Imperia",
+    "Isernia", "La Spezia", "L'Aquila", "Latina", "Lecce", "Lecco", "Livorno", "Lodi",
+    "Lucca", "Macerata", "Mantova", "Massa", "Carrara", "Matera", "Messina", "Milano",
+    "Modena", "Monza", "Napoli", "Novara", "Nuoro", "Oristano", "Padova", "Palermo",
+    "Parma", "Pavia", "Perugia", "Pesaro", "Urbino", "Pescara", "Piacenza", "Pisa",
+    "Pistoia", "Pordenone", "Potenza", "Prato", "Ragusa", "Ravenna", "Reggio Calabria",
+    "Reggio Emilia", "Rieti", "Rimini", "Roma", "Rovigo", "Salerno", "Sassari", "Savona",
+    "Siena", "Siracusa", "Sondrio", "Taranto", "Teramo", "Terni", "Torino", "Trapani",
+    "Trento", "Treviso", "Trieste", "Udine", "Varese", "Venezia", "Verbania", "Vercelli",
+    "Verona", "Vibo Valentia", "Vicenza", "Viterbo",
+    # Altri comuni popolosi
+    "Mestre", "Imola", "Faenza", "Carpi", "Sassuolo", "Rho", "Legnano", "Busto Arsizio",
+    "Gallarate", "Sesto San Giovanni", "Cinisello Balsamo", "Bassano del Grappa",
+    "Chioggia", "Rovereto", "Merano", "Bressanone", "Moncalieri", "Sanremo", "Viareggio",
+    "Empoli", "Civitavecchia", "Fiumicino", "Guidonia", "Pomezia", "Aversa", "Pozzuoli",
+    "Torre del Greco", "Castellammare di Stabia", "Altamura", "Molfetta", "Cerignola",
+    "Lamezia Terme", "Marsala", "Gela", "Bagheria", "Olbia", "Alghero",
+]
+
+# Tipi di scuola: forma (normalizzata) -> valore canonico
+SCHOOL_TYPES = {
+    "liceo scientifico": "Liceo Scientifico",
+    "scientifico": "Liceo Scientifico",
+    "liceo classico": "Liceo Classico",
+    "classico": "Liceo Classico",
+    "liceo linguistico": "Liceo Linguistico",
+    "linguistico": "Liceo Linguistico",
+    "liceo artistico": "Liceo Artistico",
+    "artistico": "Liceo Artistico",
+    "liceo delle scienze umane": "Liceo delle Scienze Umane",
+    "liceo scienze umane": "Liceo delle Scienze Umane",
+    "scienze umane": "Liceo delle Scienze Umane",
+    "liceo musicale": "Liceo Musicale",
+    "liceo sportivo": "Liceo Sportivo",
+    "liceo": "Liceo",
+    "itis": "ITIS",
+    "istituto tecnico industriale": "ITIS",
+    "tecnico industriale": "ITIS",
+    "iti": "ITIS",
+    "itc": "Istituto Tecnico Economico",
+    "ragioneria": "Istituto Tecnico Economico",
+    "istituto tecnico economico": "Istituto Tecnico Economico",
+    "tecnico economico": "Istituto Tecnico Economico",
+    "geometri": "Istituto Tecnico CAT (Geometri)",
+    "istituto tecnico": "Istituto Tecnico",
+    "tecnico": "Istituto Tecnico",
+    "istituto professionale": "Istituto Professionale",
+    "professionale": "Istituto Professionale",
+    "ipsia": "Istituto Professionale (IPSIA)",
+    "alberghiero": "Istituto Professionale Alberghiero",
+    "agrario": "Istituto Tecnico Agrario",
+}
+
+# Forme generiche accettate solo con un contesto scolastico ("frequento lo scientifico")
+SCHOOL_NEEDS_CONTEXT = {"scientifico", "classico", "linguistico", "artistico", "scienze umane",
+                        "tecnico", "professionale", "agrario"}
+
+# Indirizzi che possono seguire un tipo di scuola tecnica (es. "ITIS informatica")
+SCHOOL_SPECIALIZATIONS = {
+    "informatica", "elettronica", "elettrotecnica", "meccanica", "meccatronica",
+    "chimica", "automazione", "telecomunicazioni", "biotecnologie", "logistica",
+    "turismo", "grafica",
+}
+
+# Materie scolastiche: forma (normalizzata) -> valore canonico
+SUBJECTS = {
+    "matematica": "matematica", "mate": "matematica",
+    "fisica": "fisica",
+    "chimica": "chimica",
+    "informatica": "informatica", "programmazione": "informatica",
+    "biologia": "biologia",
+    "scienze": "scienze", "scienze naturali": "scienze",
+    "italiano": "italiano", "letteratura": "italiano",
+    "latino": "latino",
+    "greco": "greco",
+    "storia": "storia",
+    "storia dell arte": "storia dell'arte", "arte": "storia dell'arte",
+    "filosofia": "filosofia",
+    "geografia": "geografia",
+    "inglese": "inglese",
+    "francese": "francese",
+    "spagnolo": "spagnolo",
+    "tedesco": "tedesco",
+    "musica": "musica",
+    "educazione fisica": "educazione fisica", "ginnastica": "educazione fisica",
+    "economia": "economia", "economia aziendale": "economia",
+    "diritto": "diritto",
+    "elettronica": "elettronica",
+    "elettrotecnica": "elettrotecnica",
+    "meccanica": "meccanica",
+    "disegno": "disegno", "disegno tecnico": "disegno",
+    "psicologia": "psicologia",
+    "sociologia": "sociologia",
+}
+
+# Campi a valore singolo: due valori diversi nello stesso messaggio sono un conflitto
+SCALAR_FIELDS = {"location", "school_type"}
+
+LOCATION_TRIGGERS = {"abito", "vivo", "risiedo", "residente", "sto", "vengo", "provengo"}
+SCHOOL_TRIGGERS = {"frequento", "faccio", "fatto", "studio", "vado", "diplomato", "diplomata", "diploma", "scuola", "istituto"}
+LIKE_TRIGGERS = {"piace", "piacciono", "amo", "adoro", "preferisco", "preferita", "preferite",
+                 "interessa", "interessano", "appassiona", "appassionano", "bravo", "brava", "materia", "materie"}
+DISLIKE_TRIGGERS = {"odio", "detesto", "sopporto"}
+
+STOPWORDS = {
+    "a", "ad", "in", "di", "da", "dal", "il", "lo", "la", "i", "gli", "le", "l", "e", "ed",
+    "un", "una", "uno", "al", "allo", "alla", "ai", "agli", "alle", "del", "della", "dei",
+    "delle", "nel", "nella", "nei", "sono", "io", "mi", "ma", "anche", "molto", "tanto",
+    "tantissimo", "soprattutto", "poi", "ciao", "si", "ok", "grazie", "beh", "allora",
+    "comunque", "piu", "quindi", "vicino", "provincia", "citta", "zona", "ho", "non", "per",
+    "che", "come", "mia", "mio", "sia", "o", "oppure", "invece", "attualmente", "ora",
+    "adesso", "qui", "li", "tutte", "tutti", "cosi", "cose", "direi", "penso", "credo",
+}
+
+CLAUSE_SPLIT = re.compile(r"[,;.!?]|\b(?:ma|pero|mentre)\b")
+
+
+def fold(text: str) -> str:
+    """Normalizza il testo: minuscolo, senza accenti né apostrofi/trattini."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^a-z0-9,;.!?]+", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class FastProfileExtractor:
+    """Estrattore locale (gazetteer + lessici) per località, scuola e materie."""
+
+    def __init__(self, fuzzy_cutoff: float = 0.85, max_residual_tokens: int = 1):
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.max_residual_tokens = max_residual_tokens
+
+        places = {fold(name): name for name in REGIONS + CITIES}
+        places.update(self._load_comuni())
+        self.places = self._index(places)
+        self.schools = self._index(SCHOOL_TYPES)
+        self.subjects = self._index(SUBJECTS)
+
+    def _load_comuni(self) -> Dict[str, str]:
+        """Carica l'elenco completo dei comuni se presente (un nome per riga)."""
+        comuni = {}
+        if os.path.exists(COMUNI_FILE):
+            with open(COMUNI_FILE, encoding="utf-8") as f:
+                for line in f:
+                    name = line.strip()
+                    if name:
+                        comuni[fold(name)] = name
+        return comuni
+
+    def _index(self, lexicon: Dict[str, str]) -> Dict[int, Dict[Tuple[str, ...], str]]:
+        """Indicizza un lessico per numero di token (per la ricerca per n-grammi)."""
+        index: Dict[int, Dict[Tuple[str, ...], str]] = {}
+        for key, value in lexicon.items():
+            tokens = tuple(fold(key).split())
+            index.setdefault(len(tokens), {})[tokens] = value
+        return index
+
+    def _match(self, tokens: List[str], start: int, index: Dict[int, Dict[Tuple[str, ...], str]],
+               fuzzy: bool) -> Optional[Tuple[int, str, str]]:
+        """Cerca il match più lungo a partire da start. Restituisce (lunghezza, chiave, valore)."""
+        for size in sorted(index, reverse=True):
+            gram = tuple(tokens[start:start + size])
+            if len(gram) < size:
+                continue
+            if gram in index[size]:
+                return size, " ".join(gram), index[size][gram]
+            if fuzzy and len(" ".join(gram)) >= 5:
+                candidates = {" ".join(k): v for k, v in index[size].items()}
+                close = difflib.get_close_matches(" ".join(gram), candidates, n=1, cutoff=self.fuzzy_cutoff)
+                if close:
+                    return size, close[0], candidates[close[0]]
+        return None
+
+    def extract(self, message: str) -> Tuple[List[Dict[str, str]], bool]:
+        """
+        Estrae aggiornamenti nel formato dell'estrattore LLM
+        ({"field_name", "value", "confidence"}).
+        Restituisce (aggiornamenti, sicuro): sicuro è True solo se quasi tutte le
+        parole del messaggio sono state spiegate dalle regole, senza valori in conflitto.
+        """
+        updates: List[Dict[str, str]] = []
+        residual = 0
+        unresolved_place = False  # Luogo citato senza dire che è la residenza
+
+        for clause in CLAUSE_SPLIT.split(fold(message)):
+            tokens = (clause or "").split()
+            if not tokens:
+                continue
+
+            token_set = set(tokens)
+            has_location_trigger = bool(token_set & LOCATION_TRIGGERS) or tokens[:2] == ["sono", "di"]
+            has_school_trigger = bool(token_set & SCHOOL_TRIGGERS)
+            has_like_trigger = bool(token_set & (LIKE_TRIGGERS | DISLIKE_TRIGGERS))
+            negative = bool(token_set & DISLIKE_TRIGGERS) or ("non" in token_set and bool(token_set & LIKE_TRIGGERS))
+            triggers = LOCATION_TRIGGERS | SCHOOL_TRIGGERS | LIKE_TRIGGERS | DISLIKE_TRIGGERS
+
+            clause_updates = []
+            unexplained = []
+            i = 0
+            while i < len(tokens):
+                token = tokens[i]
+
+                school = self._match(tokens, i, self.schools, fuzzy=has_school_trigger)
+                if school and school[1] in SCHOOL_NEEDS_CONTEXT and not has_school_trigger and len(tokens) > school[0]:
+                    school = None
+                if school:
+                    size, _, value = school
+                    # Indirizzo di specializzazione (es. "ITIS informatica")
+                    if i + size < len(tokens) and tokens[i + size] in SCHOOL_SPECIALIZATIONS:
+                        value = f"{value} {tokens[i + size].capitalize()}"
+                        size += 1
+                    clause_updates.append({"field_name": "school_type", "value": value, "confidence": "alta"})
+                    i += size
+                    continue
+
+                subject = self._match(tokens, i, self.subjects, fuzzy=has_like_trigger)
+                if subject:
+                    size, _, value = subject
+                    field = "disliked_subjects" if negative else "favorite_subjects"
+                    clause_updates.append({"field_name": field, "value": value, "confidence": "alta"})
+                    i += size
+                    continue
+
+                place = self._match(tokens, i, self.places, fuzzy=has_location_trigger)
+                if place:
+                    size, _, value = place
+                    clause_updates.append({"field_name": "location", "value": value, "confidence": "alta"})
+                    i += size
+                    continue
+
+                if token not in STOPWORDS and token not in triggers:
+                    unexplained.append(token)
+                i += 1
+
+            # Località senza trigger di residenza: accettata solo se la frase è il solo nome
+            # del luogo ("studio a Padova", "vado a Roma" non dicono dove abita lo studente)
+            if not has_location_trigger and (unexplained or token_set & triggers):
+                unresolved_place = unresolved_place or any(u["field_name"] == "location" for u in clause_updates)
+                clause_updates = [u for u in clause_updates if u["field_name"] != "location"]
+
+            residual += len(unexplained)
+            updates.extend(clause_updates)
+
+        # Deduplica mantenendo l'ordine
+        unique = []
+        for update in updates:
+            if update not in unique:
+                unique.append(update)
+
+        # Valori diversi per lo stesso campo singolo ("abito a Bologna ma studio a Milano"): decide l'LLM
+        scalar_values: Dict[str, set] = {}
+        for update in unique:
+            if update["field_name"] in SCALAR_FIELDS:
+                scalar_values.setdefault(update["field_name"], set()).add(update["value"])
+        conflicting = any(len(values) > 1 for values in scalar_values.values())
+
+        confident = (bool(unique) and residual <= self.max_residual_tokens
+                     and not conflicting and not unresolved_place)
+        return unique, confident
+
+
+# Istanza globale
+fast_extractor = FastProfileExtractor()
@@ -3,8 +3,11 @@ Agente AI per l'orientamento basato sulla nuova libreria google-genai.
 """
 import os
 import json
-from typing import Dict, Any, Optional, Tuple, List
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple, List, AsyncIterator, Literal
 from google import genai
+from pydantic import BaseModel, ValidationError
 from .web_searcher import WebSearcher
 from google.genai import types
 from dotenv import load_dotenv
@@ -15,32 +18,103 @@ load_dotenv()
 # Import assoluti invece che relativi
 try:
     from student_profile import StudentProfile
+    from turn_log import Turn
     from state_manager import state_manager
+    from metrics import metrics
+    from fast_extractor import fast_extractor
+    from dialogue_policy import dialogue_policy
+    from llm_gateway import LLMGateway
+    from agent.llm_providers import provider_from_env
+    from token_budget import token_budget, truncate, FULL, COMPACT_PROFILE, SUMMARIZED
+    from prompt_cache import PromptParts
+    import agent_prompts
+    import profile_fields
 except ImportError:
     # Fallback per quando viene eseguito da directory diversa
     from .student_profile import StudentProfile
+    from .turn_log import Turn
     from .state_manager import state_manager
+    from .metrics import metrics
+    from .fast_extractor import fast_extractor
+    from .dialogue_policy import dialogue_policy
+    from .llm_gateway import LLMGateway
+    from .agent.llm_providers import provider_from_env
+    from .token_budget import token_budget, truncate, FULL, COMPACT_PROFILE, SUMMARIZED
+    from .prompt_cache import PromptParts
+    from . import agent_prompts
+    from . import profile_fields
+
+metrics.register_ratio("speculation_hit_rate", "agent_speculation_hits", "agent_speculation_total")
+metrics.register_ratio("fast_extraction_rate", "agent_fast_extraction_hits", "agent_extraction_turns")
+metrics.register_ratio("policy_question_rate", "agent_policy_questions", "agent_profile_questions")
+metrics.register_ratio("search_prefetch_hit_rate", "agent_search_prefetch_hits", "agent_recommendation_searches")
+
+# Campi del profilo che il modello può aggiornare in modalità "fused turn"
+ExtractableField = Literal[
+    "location", "willing_to_relocate", "school_type", "current_status",
+    "favorite_subjects", "disliked_subjects", "hobbies", "soft_skills",
+    "learning_style", "primary_goal", "institution_preference",
+    "budget_constraint", "time_constraint",
+]
+
+
+class FieldUpdate(BaseModel):
+    """Aggiornamento di un singolo campo del profilo."""
+    field_name: ExtractableField
+    value: str
+    confidence: Literal["alta", "media", "bassa"] = "media"
+
+
+class FusedTurnResult(BaseModel):
+    """Output strutturato di un turno "fused": aggiornamenti del profilo + risposta."""
+    updates: List[FieldUpdate]
+    reply: str
+
 
 class GeminiOrientationAgent:
     """Agente di orientamento che usa la nuova libreria google-genai."""
     
     def __init__(self):
-        # Configura il client CON l'API Key esplicita
+        # Configura il client CON l'API Key esplicita (non serve per stand-in e replay)
         api_key = os.getenv("GEMINI_API_KEY")
+        provider = provider_from_env()
         
-        if not api_key or api_key == "your_api_key_here":
+        if provider.requires_api_key and (not api_key or api_key == "your_api_key_here"):
             raise ValueError("⚠️  Configura GEMINI_API_KEY nel file .env")
         
         try:
-            # NUOVA SINTASSI: Passa api_key direttamente al client
-            self.client = genai.Client(api_key=api_key)
-            print(f"✅ Agente Gemini inizializzato")
+            # Gateway con pool di connessioni, retry e circuit breaker davanti al client genai
+            self.llm = LLMGateway(api_key=api_key, provider=provider)
+            self.client = self.llm.client
+            print(f"✅ Agente Gemini inizializzato (provider: {provider.name})")
         except Exception as e:
             raise ValueError(f"❌ Errore: {e}")
         
         # Configurazioni
         self.model_name = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-lite")
         self.temperature = float(os.getenv("AGENT_TEMPERATURE", 0.7))
+        # Fused turn: estrazione + domanda in una sola chiamata strutturata
+        self.fused_turn = os.getenv("AGENT_FUSED_TURN", "false").lower() == "true"
+        # Esecuzione speculativa: domanda generata in parallelo all'estrazione
+        self.speculative_turn = os.getenv("AGENT_SPECULATIVE_TURN", "true").lower() == "true"
+        # Estrattore a regole davanti all'estrattore LLM
+        self.fast_extraction = os.getenv("AGENT_FAST_EXTRACTOR", "true").lower() == "true"
+        # Domande di profilazione da template, LLM solo per riformulazioni contestuali
+        self.dialogue_policy = os.getenv("AGENT_DIALOGUE_POLICY", "true").lower() == "true"
+        # Prefetch della ricerca web appena località e materie sono note
+        self.search_prefetch = os.getenv("AGENT_SEARCH_PREFETCH", "true").lower() == "true"
+        self.prefetch_max_sessions = int(os.getenv("AGENT_PREFETCH_MAX_SESSIONS", 1000))
+        # Compattazione dei prompt oltre il budget: elementi delle liste e token del messaggio mantenuti
+        self.context_list_items = int(os.getenv("PROMPT_CONTEXT_LIST_ITEMS", 3))
+        self.context_message_tokens = int(os.getenv("PROMPT_CONTEXT_MESSAGE_TOKENS", 80))
+        # session_id -> (impronta dei dati di ricerca, task di ricerca)
+        self._search_prefetch: "OrderedDict[str, Tuple[tuple, asyncio.Task]]" = OrderedDict()
+        # Memoria della conversazione: riassunto in background ogni N turni (0 = disattivata),
+        # nei prompt insieme agli ultimi turni non riassunti
+        self.memory_every = int(os.getenv("AGENT_MEMORY_EVERY_TURNS", 6))
+        self.memory_recent_turns = int(os.getenv("AGENT_MEMORY_RECENT_TURNS", 4))
+        self.memory_max_tokens = int(os.getenv("AGENT_MEMORY_MAX_TOKENS", 250))
+        self._memory_tasks: Dict[str, asyncio.Task] = {}
     
     def process_message(self, session_id: str, user_message: str) -> Tuple[str, StudentProfile]:
         """
@@ -56,17 +130,39 @@ class GeminiOrientationAgent:
         # 2. Aggiungi il messaggio utente alla cronologia
         profile.add_conversation_turn("user", user_message)
         
-        # 3. FASE DI ESTRAZIONE: Analizza il messaggio per aggiornare il profilo
-        updated_fields = self._extract_profile_info(profile, user_message)
+        # 3. Estrazione rapida a regole: se è sicura, niente chiamata LLM di estrazione
+        fast_fields = self._fast_extract(profile, user_message)
         
-        if updated_fields:
-            print(f"📝 Info estratte: {updated_fields}")
+        # Fused turn (se abilitato): estrazione e domanda in una sola chiamata
+        fused = None
+        if fast_fields is None and self.fused_turn and not profile.is_sufficient_for_search():
+            fused = self._fused_turn(profile, user_message)
         
-        # 4. Determina l'azione basata sul profilo AGGIORNATO
-        if profile.is_sufficient_for_search():
-            response = self._generate_recommendation_response(profile, user_message)
+        if fast_fields is not None:
+            updated_fields = fast_fields
+            if profile.is_sufficient_for_search():
+                response = self._generate_recommendation_response(profile, user_message)
+            else:
+                response = self._generate_profile_question(profile, user_message, updated_fields)
+        elif fused:
+            updated_fields, response = fused
+            if updated_fields:
+                print(f"📝 Info estratte (fused): {updated_fields}")
+            # La domanda generata non serve più se ora possiamo raccomandare
+            if profile.is_sufficient_for_search():
+                response = self._generate_recommendation_response(profile, user_message)
         else:
-            response = self._generate_profile_question(profile, user_message)
+            # FASE DI ESTRAZIONE: Analizza il messaggio per aggiornare il profilo
+            updated_fields = self._extract_profile_info(profile, user_message)
+            
+            if updated_fields:
+                print(f"📝 Info estratte: {updated_fields}")
+            
+            # 4. Determina l'azione basata sul profilo AGGIORNATO
+            if profile.is_sufficient_for_search():
+                response = self._generate_recommendation_response(profile, user_message)
+            else:
+                response = self._generate_profile_question(profile, user_message, updated_fields)
         
         # 5. Aggiungi la risposta dell'agente alla cronologia
         profile.add_conversation_turn("agent", response)
@@ -76,100 +172,344 @@ class GeminiOrientationAgent:
         
         return response, profile
     
+    async def process_message_async(self, session_id: str, user_message: str) -> Tuple[str, StudentProfile]:
+        """
+        Versione asincrona di process_message: stessa logica, ma le chiamate a Gemini
+        e la ricerca web non bloccano l'event loop del worker uvicorn.
+        """
+        # 1. Recupera o crea il profilo
+        profile = state_manager.get_session(session_id)
+        if not profile:
+            profile = state_manager.create_session()
+            session_id = profile.session_id
+        
+        # 2. Aggiungi il messaggio utente alla cronologia
+        profile.add_conversation_turn("user", user_message)
+        
+        # 3. Estrazione rapida a regole, poi fused turn (se abilitato), altrimenti estrazione + risposta
+        fast_fields = self._fast_extract(profile, user_message)
+        
+        fused = None
+        if fast_fields is None and self.fused_turn and not profile.is_sufficient_for_search():
+            fused = await self._fused_turn_async(profile, user_message)
+        
+        if fast_fields is not None:
+            updated_fields = fast_fields
+            if profile.is_sufficient_for_search():
+                response = await self._generate_recommendation_response_async(profile, user_message)
+            else:
+                response = await self._generate_profile_question_async(profile, user_message, updated_fields)
+        elif fused:
+            updated_fields, response = fused
+            if updated_fields:
+                print(f"📝 Info estratte (fused): {updated_fields}")
+            if profile.is_sufficient_for_search():
+                response = await self._generate_recommendation_response_async(profile, user_message)
+        elif (self.speculative_turn and not profile.is_sufficient_for_search()
+              and self._question_needs_llm(user_message)):
+            updated_fields, response = await self._speculative_turn_async(profile, user_message)
+        else:
+            updated_fields = await self._extract_profile_info_async(profile, user_message)
+            
+            if updated_fields:
+                print(f"📝 Info estratte: {updated_fields}")
+            
+            # 4. Determina l'azione basata sul profilo AGGIORNATO
+            if profile.is_sufficient_for_search():
+                response = await self._generate_recommendation_response_async(profile, user_message)
+            else:
+                response = await self._generate_profile_question_async(profile, user_message, updated_fields)
+        
+        # 5. Aggiungi la risposta dell'agente alla cronologia
+        profile.add_conversation_turn("agent", response)
+        
+        # 6. Salva il profilo aggiornato
+        state_manager.update_session(session_id, profile)
+        
+        # 7. Se gli input della ricerca sono noti, avvia la ricerca in background
+        self._maybe_prefetch_search(profile)
+        self._maybe_refresh_memory(profile)
+        
+        return response, profile
+    
+    async def _speculative_turn_async(self, profile: StudentProfile, user_message: str) -> Tuple[List[str], str]:
+        """
+        Avvia in parallelo l'estrazione e una domanda speculativa basata sul profilo
+        pre-estrazione. La domanda viene tenuta se l'estrazione non ha toccato il campo
+        a cui era rivolta (il primo di missing_info_priority), altrimenti viene rigenerata.
+        """
+        target = profile.missing_info_priority[0] if profile.missing_info_priority else None
+        
+        # La domanda speculativa viene creata per prima, così costruisce il suo prompt
+        # prima che l'estrazione possa modificare il profilo
+        speculative = asyncio.create_task(self._generate_profile_question_async(profile, user_message, count=False))
+        extraction = asyncio.create_task(self._extract_profile_info_async(profile, user_message))
+        
+        try:
+            updated_fields = await extraction
+        except BaseException:
+            speculative.cancel()
+            raise
+        
+        if updated_fields:
+            print(f"📝 Info estratte: {updated_fields}")
+        
+        metrics.increment("agent_speculation_total")
+        
+        if profile.is_sufficient_for_search():
+            # Il profilo è diventato sufficiente: serve una raccomandazione, non una domanda
+            speculative.cancel()
+            metrics.increment("agent_speculation_misses")
+            return updated_fields, await self._generate_recommendation_response_async(profile, user_message)
+        
+        if target not in updated_fields:
+            metrics.increment("agent_speculation_hits")
+            metrics.increment("agent_profile_questions")  # Contata solo ora che viene servita
+            return updated_fields, await speculative
+        
+        speculative.cancel()
+        metrics.increment("agent_speculation_misses")
+        return updated_fields, await self._generate_profile_question_async(profile, user_message, updated_fields)
+    
+    async def process_message_stream(self, session_id: str, user_message: str) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Variante in streaming di process_message_async.
+        Produce coppie (evento, dati): "extracting", poi "thinking", poi una serie di
+        "chunk" con il testo parziale e infine "done" con risposta completa e profilo.
+        Se la generazione si interrompe dopo i primi chunk termina con "error" (il client
+        scarta il testo parziale), senza aggiungere la risposta alla cronologia.
+        """
+        profile = state_manager.get_session(session_id)
+        if not profile:
+            profile = state_manager.create_session()
+            session_id = profile.session_id
+        
+        profile.add_conversation_turn("user", user_message)
+        
+        # 1. Estrazione (segnalata subito al client)
+        yield "extracting", {"session_id": session_id}
+        updated_fields = self._fast_extract(profile, user_message)
+        if updated_fields is None:
+            updated_fields = await self._extract_profile_info_async(profile, user_message)
+        
+        if updated_fields:
+            print(f"📝 Info estratte: {updated_fields}")
+        
+        # 2. Generazione della risposta, inoltrata chunk per chunk
+        yield "thinking", {"updated_fields": updated_fields}
+        if profile.is_sufficient_for_search():
+            chunks = self._stream_recommendation_response(profile, user_message)
+        else:
+            chunks = self._stream_profile_question(profile, user_message, updated_fields)
+        
+        parts = []
+        try:
+            async for text in chunks:
+                parts.append(text)
+                yield "chunk", {"text": text}
+        except Exception as e:
+            print(f"❌ Streaming interrotto: {e}")
+            metrics.increment("agent_stream_errors")
+            yield "error", {"detail": "Risposta interrotta, riprova"}
+            return
+        
+        response = "".join(parts).strip()
+        profile.add_conversation_turn("agent", response)
+        state_manager.update_session(session_id, profile)
+        self._maybe_prefetch_search(profile)
+        self._maybe_refresh_memory(profile)
+        
+        yield "done", {"response": response, "profile": profile}
+    
+    def _generate(self, prompt: PromptParts, temperature: float, max_output_tokens: int,
+                  call_type: str = "other", **config: Any) -> str:
+        """Chiamata sincrona a Gemini (tramite il gateway), restituisce il testo della risposta."""
+        return self.llm.generate(
+            self.model_name, prompt, temperature, max_output_tokens, call_type=call_type, **config
+        )
+    
+    async def _generate_async(self, prompt: PromptParts, temperature: float, max_output_tokens: int,
+                              hedge: bool = False, call_type: str = "other", **config: Any) -> str:
+        """Chiamata asincrona a Gemini tramite il gateway; hedge per le chiamate brevi."""
+        return await self.llm.generate_async(
+            self.model_name, prompt, temperature, max_output_tokens, hedge=hedge, call_type=call_type, **config
+        )
+    
+    async def _generate_stream(self, prompt: PromptParts, temperature: float, max_output_tokens: int,
+                               call_type: str = "other") -> AsyncIterator[str]:
+        """Chiamata asincrona in streaming a Gemini, produce i frammenti di testo."""
+        async for text in self.llm.generate_stream(
+            self.model_name, prompt, temperature, max_output_tokens, call_type=call_type
+        ):
+            yield text
+    
+    def _fast_extract(self, profile: StudentProfile, user_message: str) -> Optional[List[str]]:
+        """
+        Estrazione locale a regole. Restituisce i campi aggiornati se l'estrattore è
+        sicuro del risultato, None se il messaggio va passato all'LLM.
+        """
+        metrics.increment("agent_extraction_turns")
+        if not self.fast_extraction:
+            return None
+        
+        updates, confident = fast_extractor.extract(user_message)
+        if not confident:
+            return None
+        
+        updated_fields = []
+        for update in updates:
+            if self._update_profile_field(profile, update) and update["field_name"] not in updated_fields:
+                updated_fields.append(update["field_name"])
+        
+        metrics.increment("agent_fast_extraction_hits")
+        if updated_fields:
+            print(f"⚡ Info estratte senza LLM: {updated_fields}")
+        return updated_fields
+    
+    def _fused_turn(self, profile: StudentProfile, user_message: str) -> Optional[Tuple[List[str], str]]:
+        """
+        Turno "fused": una sola richiesta con output strutturato (aggiornamenti + domanda).
+        Restituisce (campi aggiornati, risposta) oppure None se l'output non è valido,
+        nel qual caso il chiamante ripiega sul percorso a due chiamate.
+        """
+        prompt = self._build_fused_prompt(profile, user_message)
+        
+        try:
+            response_text = self._generate(
+                prompt, temperature=self.temperature, max_output_tokens=600, call_type="fused",
+                response_mime_type="application/json", response_schema=FusedTurnResult
+            )
+            result = FusedTurnResult.model_validate_json(response_text)
+        except (ValidationError, ValueError) as e:
+            print(f"⚠️  Output fused non valido, uso due chiamate: {e}")
+            return None
+        except Exception as e:
+            print(f"⚠️  Errore Gemini (fused): {e}")
+            return None
+        
+        return self._apply_fused_result(profile, result)
+    
+    async def _fused_turn_async(self, profile: StudentProfile, user_message: str) -> Optional[Tuple[List[str], str]]:
+        """Versione asincrona di _fused_turn."""
+        prompt = self._build_fused_prompt(profile, user_message)
+        
+        try:
+            response_text = await self._generate_async(
+                prompt, temperature=self.temperature, max_output_tokens=600, call_type="fused",
+                response_mime_type="application/json", response_schema=FusedTurnResult
+            )
+            result = FusedTurnResult.model_validate_json(response_text)
+        except (ValidationError, ValueError) as e:
+            print(f"⚠️  Output fused non valido, uso due chiamate: {e}")
+            return None
+        except Exception as e:
+            print(f"⚠️  Errore Gemini (fused): {e}")
+            return None
+        
+        return self._apply_fused_result(profile, result)
+    
+    def _apply_fused_result(self, profile: StudentProfile, result: FusedTurnResult) -> Optional[Tuple[List[str], str]]:
+        """Applica gli aggiornamenti validati al profilo."""
+        reply = result.reply.strip()
+        if not reply:
+            return None
+        
+        updated_fields = []
+        for update in result.updates:
+            if self._update_profile_field(profile, update.model_dump()):
+                updated_fields.append(update.field_name)
+        
+        return updated_fields, reply
+    
+    def _build_fused_prompt(self, profile: StudentProfile, user_message: str) -> PromptParts:
+        """Prompt unico per estrazione delle informazioni e prossima domanda, entro il budget."""
+        return token_budget.fit("fused", lambda level: self._render_fused_prompt(profile, user_message, level))
+    
+    def _render_fused_prompt(self, profile: StudentProfile, user_message: str, level: int) -> PromptParts:
+        context = self._build_profile_context(profile, user_message, level, conversation=True)
+        return PromptParts(agent_prompts.system_prompt("fused", level), context)
+    
     def _extract_profile_info(self, profile: StudentProfile, user_message: str) -> List[str]:
         """
         Analizza il messaggio dello studente ed estrae informazioni per aggiornare il profilo.
         Restituisce la lista dei campi aggiornati.
         """
-        # Costruisci il contesto attuale del profilo
-        context = self._build_profile_context(profile, user_message)
+        prompt = self._build_extraction_prompt(profile, user_message)
         
-        prompt = f"""Analizza il messaggio dello studente ed estrai SOLO le informazioni che corrispondono ai campi del profilo.
-
-PROFILO ATTUALMENTE:
-{context}
-
-MESSAGGIO STUDENTE: "{user_message}"
-
-INSTRUZIONI:
-1. Identifica se nel messaggio ci sono informazioni su:
-   - Località/residenza (es: "abito a Roma", "vivo a Milano")
-   - Tipo di scuola/diploma (es: "frequento il liceo", "ho fatto l'ITIS")
-   - Materie preferite (es: "mi piace matematica", "amo la fisica")
-   - Hobby/interessi (es: "mi piace programmare", "gioco a calcio")
-   - Obiettivi (es: "vorrei lavorare", "mi interessa l'università")
-   - Vincoli/preferenze (es: "non posso spostarmi", "preferisco pubblico")
-
-2. Per ogni informazione trovata, formatta come JSON:
-{{
-  "field_name": "nome_campo",
-  "value": "valore_estratto",
-  "confidence": "alta/media/bassa"
-}}
-
-3. Se non trovi informazioni rilevanti, rispondi solo con: {{}}
-
-Esempi:
-- Input: "Abito a Bologna" → {{"field_name": "location", "value": "Bologna", "confidence": "alta"}}
-- Input: "Studio al liceo scientifico" → {{"field_name": "school_type", "value": "Liceo Scientifico", "confidence": "alta"}}
-- Input: "Mi piace la matematica" → {{"field_name": "favorite_subjects", "value": "matematica", "confidence": "alta"}}
-
-Rispondi SOLO con il JSON, senza altro testo."""
+        try:
+            response_text = self._generate(  # Temperatura bassa per estrazione precisa
+                prompt, temperature=0.1, max_output_tokens=500, call_type="extraction"
+            )
+            return self._apply_extraction_response(profile, response_text)
+        except Exception as e:
+            print(f"⚠️  Errore nell'estrazione info: {e}")
+            return []
+    
+    async def _extract_profile_info_async(self, profile: StudentProfile, user_message: str) -> List[str]:
+        """Versione asincrona di _extract_profile_info."""
+        prompt = self._build_extraction_prompt(profile, user_message)
         
         try:
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    temperature=0.1,  # Bassa per estrazione precisa
-                    max_output_tokens=500
-                )
+            response_text = await self._generate_async(
+                prompt, temperature=0.1, max_output_tokens=500, hedge=True, call_type="extraction"
             )
-            
-            # Prova a parsare la risposta come JSON
-            response_text = response.text.strip()
-        
-            # PULIZIA con regex
-            import re
-            # 1. Rimuovi backticks semplici
-            response_text = response_text.replace("```json", "").replace("```", "").strip()
-            # 2. Regex per estrarre solo il JSON
-            json_pattern = r'(\[.*\]|\{.*\})'
-            match = re.search(json_pattern, response_text, re.DOTALL)
-            if match:
-                response_text = match.group(1).strip()
-            
-            # DEBUG (puoi rimuoverlo dopo)
-            print(f"🔍 JSON pulito: {response_text[:100]}...")
-            updated_fields = []
-            
-            if response_text and response_text != "{}":
-                try:
-                    # Gestisci sia oggetto singolo che lista
-                    if response_text.startswith("["):
-                        data = json.loads(response_text)
-                        if isinstance(data, list):
-                            for item in data:
-                                if self._update_profile_field(profile, item):
-                                    updated_fields.append(item.get("field_name", "unknown"))
-                        else:
-                            if self._update_profile_field(profile, data):
-                                updated_fields.append(data.get("field_name", "unknown"))
-                    else:
-                        data = json.loads(response_text)
-                        if self._update_profile_field(profile, data):
-                            updated_fields.append(data.get("field_name", "unknown"))
-                            
-                except json.JSONDecodeError as e:
-                    print(f"⚠️  JSON non valido da Gemini: {response_text}")
-                    print(f"   Errore: {e}")
-            
-            return updated_fields
-            
+            return self._apply_extraction_response(profile, response_text)
         except Exception as e:
             print(f"⚠️  Errore nell'estrazione info: {e}")
             return []
     
+    def _build_extraction_prompt(self, profile: StudentProfile, user_message: str) -> PromptParts:
+        """Costruisce il prompt di estrazione delle informazioni del profilo, entro il budget."""
+        return token_budget.fit(
+            "extraction", lambda level: self._render_extraction_prompt(profile, user_message, level)
+        )
+    
+    def _render_extraction_prompt(self, profile: StudentProfile, user_message: str, level: int) -> PromptParts:
+        # Il messaggio è già nel prompt: nel contesto compatto non viene ripetuto
+        context = self._build_profile_context(profile, user_message if level == FULL else "", level)
+        
+        user = f'PROFILO ATTUALMENTE:\n{context}\n\nMESSAGGIO STUDENTE: "{user_message}"'
+        return PromptParts(agent_prompts.system_prompt("extraction", level), user)
+    
+    def _apply_extraction_response(self, profile: StudentProfile, response_text: str) -> List[str]:
+        """Interpreta la risposta JSON dell'estrazione e aggiorna il profilo."""
+        # PULIZIA con regex
+        import re
+        # 1. Rimuovi backticks semplici
+        response_text = response_text.replace("```json", "").replace("```", "").strip()
+        # 2. Regex per estrarre solo il JSON
+        json_pattern = r'(\[.*\]|\{.*\})'
+        match = re.search(json_pattern, response_text, re.DOTALL)
+        if match:
+            response_text = match.group(1).strip()
+        
+        # DEBUG (puoi rimuoverlo dopo)
+        print(f"🔍 JSON pulito: {response_text[:100]}...")
+        updated_fields = []
+        
+        if response_text and response_text != "{}":
+            try:
+                # Gestisci sia oggetto singolo che lista
+                if response_text.startswith("["):
+                    data = json.loads(response_text)
+                    if isinstance(data, list):
+                        for item in data:
+                            if self._update_profile_field(profile, item):
+                                updated_fields.append(item.get("field_name", "unknown"))
+                    else:
+                        if self._update_profile_field(profile, data):
+                            updated_fields.append(data.get("field_name", "unknown"))
+                else:
+                    data = json.loads(response_text)
+                    if self._update_profile_field(profile, data):
+                        updated_fields.append(data.get("field_name", "unknown"))
+                        
+            except json.JSONDecodeError as e:
+                print(f"⚠️  JSON non valido da Gemini: {response_text}")
+                print(f"   Errore: {e}")
+        
+        return updated_fields
+    
     def _update_profile_field(self, profile: StudentProfile, data: Dict) -> bool:
         """Aggiorna un campo del profilo con i dati estratti."""
         if not data or "field_name" not in data or "value" not in data:
@@ -179,11 +519,17 @@ Rispondi SOLO con il JSON, senza altro testo."""
         value = data["value"]
         confidence = data.get("confidence", "media")
         
-        # Mappa i campi speciali (liste)
-        list_fields = ["favorite_subjects", "hobbies", "disliked_subjects", "soft_skills"]
+        # I campi sì/no arrivano come testo ("no" sarebbe una stringa vera)
+        field = profile_fields.REGISTRY.get(field_name)
+        if field is not None and field.is_flag:
+            value = profile_fields.parse_flag(value)
+            if value is None:
+                print(f"⚠️  Valore sì/no non riconosciuto per {field_name}: {data['value']}")
+                return False
         
         try:
-            if field_name in list_fields:
+            # Per i campi lista del registro il valore si aggiunge a quelli già noti
+            if field_name in profile_fields.LIST_FIELDS:
                 # Per campi lista, aggiungi il valore alla lista esistente
                 current_list = getattr(profile, field_name, [])
                 if value not in current_list:
@@ -205,48 +551,116 @@ Rispondi SOLO con il JSON, senza altro testo."""
         
         return False
     
-    def _generate_profile_question(self, profile: StudentProfile, user_message: str) -> str:
+    def _generate_profile_question(self, profile: StudentProfile, user_message: str,
+                                   updated_fields: Optional[List[str]] = None) -> str:
         """Genera una domanda per completare il profilo."""
-        context = self._build_profile_context(profile, user_message)
+        question = self._policy_question(profile, user_message, updated_fields)
+        if question:
+            return question
         
-        prompt = f"""Sei un orientatore universitario esperto e paziente.
-
-{context}
-
-Il profilo è completo al {profile.profile_completeness*100:.1f}%.
-
-BASATI SULL'ULTIMO MESSAGGIO DELLO STUDENTE E SUL PROFILO ATTUALE:
-1. Qual è l'informazione più importante che manca ancora?
-2. Formula UNA sola domanda naturale e amichevole per raccogliere quell'informazione.
-
-ESEMPI:
-- Se manca la località: "Per darti consigli mirati, dove vivi attualmente?"
-- Se manca il tipo di scuola: "Che scuola superiore stai frequentando?"
-- Se mancano interessi: "Quali materie ti piacciono di più a scuola?"
-
-La tua risposta deve essere SOLO la domanda, senza spiegazioni."""
+        prompt = self._build_question_prompt(profile, user_message)
         
         try:
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    temperature=self.temperature,
-                    max_output_tokens=200
-                )
+            return self._generate(
+                prompt, temperature=self.temperature, max_output_tokens=200, call_type="question"
             )
-            return response.text.strip()
         except Exception as e:
             print(f"❌ Errore Gemini (domanda): {e}")
-            # Fallback basato su cosa manca
-            if not profile.location:
-                return "Per darti consigli mirati, dove vivi attualmente?"
-            elif not profile.school_type:
-                return "Che tipo di scuola superiore stai frequentando o hai frequentato?"
-            elif not profile.favorite_subjects:
-                return "Quali materie ti piacciono di più a scuola o ti hanno interessato di più?"
-            else:
-                return "Dimmi di più sui tuoi obiettivi dopo il diploma."
+            return self._fallback_question(profile)
+    
+    async def _generate_profile_question_async(self, profile: StudentProfile, user_message: str,
+                                               updated_fields: Optional[List[str]] = None,
+                                               count: bool = True) -> str:
+        """Versione asincrona di _generate_profile_question."""
+        question = self._policy_question(profile, user_message, updated_fields, count)
+        if question:
+            return question
+        
+        prompt = self._build_question_prompt(profile, user_message)
+        
+        try:
+            return await self._generate_async(
+                prompt, temperature=self.temperature, max_output_tokens=200, call_type="question"
+            )
+        except Exception as e:
+            print(f"❌ Errore Gemini (domanda): {e}")
+            return self._fallback_question(profile)
+    
+    async def _stream_profile_question(self, profile: StudentProfile, user_message: str,
+                                       updated_fields: Optional[List[str]] = None) -> AsyncIterator[str]:
+        """Versione in streaming di _generate_profile_question."""
+        question = self._policy_question(profile, user_message, updated_fields)
+        if question:
+            yield question
+            return
+        
+        prompt = self._build_question_prompt(profile, user_message)
+        
+        streamed = False
+        try:
+            async for text in self._generate_stream(
+                prompt, temperature=self.temperature, max_output_tokens=200, call_type="question"
+            ):
+                streamed = True
+                yield text
+        except Exception as e:
+            print(f"❌ Errore Gemini (domanda): {e}")
+            if streamed:
+                raise  # Testo parziale già inviato: il fallback non si può accodare
+            yield self._fallback_question(profile)
+    
+    def _question_needs_llm(self, user_message: str, updated_fields: Optional[List[str]] = None) -> bool:
+        """True se la prossima domanda richiede una chiamata a Gemini."""
+        if not self.dialogue_policy:
+            return True
+        return dialogue_policy.needs_rewrite(user_message, updated_fields)
+    
+    def _policy_question(self, profile: StudentProfile, user_message: str,
+                         updated_fields: Optional[List[str]], count: bool = True) -> Optional[str]:
+        """
+        Domanda servita dalla politica di dialogo senza LLM, oppure None se serve
+        un riconoscimento contestuale (o la politica è disabilitata).
+        Con count=False (domanda speculativa) le metriche si aggiornano solo se viene servita.
+        """
+        if count:
+            metrics.increment("agent_profile_questions")
+        if self._question_needs_llm(user_message, updated_fields):
+            return None
+        
+        question = dialogue_policy.compose(profile, updated_fields or [])
+        if question and count:
+            metrics.increment("agent_policy_questions")
+        return question
+    
+    def _build_question_prompt(self, profile: StudentProfile, user_message: str) -> PromptParts:
+        """Costruisce il prompt per la prossima domanda di profilazione."""
+        question = dialogue_policy.question_for(profile) if self.dialogue_policy else None
+        if question:
+            # Riformulazione economica della domanda scelta dalla politica di dialogo
+            user = f'ULTIMO MESSAGGIO STUDENTE: "{user_message}"\n\nDOMANDA DA PORRE: "{question}"'
+            return PromptParts(agent_prompts.REPHRASE, user)
+        
+        return token_budget.fit(
+            "question", lambda level: self._render_question_prompt(profile, user_message, level)
+        )
+    
+    def _render_question_prompt(self, profile: StudentProfile, user_message: str, level: int) -> PromptParts:
+        context = self._build_profile_context(profile, user_message, level, conversation=True)
+        return PromptParts(agent_prompts.system_prompt("question", level), context)
+    
+    def _fallback_question(self, profile: StudentProfile) -> str:
+        """Domanda di fallback basata su cosa manca."""
+        question = dialogue_policy.question_for(profile)
+        if question:
+            return question
+        if not profile.location:
+            return "Per darti consigli mirati, dove vivi attualmente?"
+        elif not profile.school_type:
+            return "Che tipo di scuola superiore stai frequentando o hai frequentato?"
+        elif not profile.favorite_subjects:
+            return "Quali materie ti piacciono di più a scuola o ti hanno interessato di più?"
+        else:
+            return "Dimmi di più sui tuoi obiettivi dopo il diploma."
     
     def _generate_recommendation_response(self, profile: StudentProfile, user_message: str) -> str:
         """Genera una risposta con raccomandazioni BASATE SU RICERCA WEB."""
@@ -255,112 +669,292 @@ La tua risposta deve essere SOLO la domanda, senza spiegazioni."""
             self.web_searcher = WebSearcher()
         
         # 2. Cerca informazioni reali sul web
-        profile_data = {
-            "favorite_subjects": profile.favorite_subjects,
-            "location": profile.location,
-            "school_type": profile.school_type,
-            "primary_goal": profile.primary_goal,
-            "institution_preference": profile.institution_preference
-        }
+        profile_data = self._search_profile_data(profile)
         
         print(f"🔍 Avvio ricerca web per: {profile_data["favorite_subjects"]} a {profile_data["location"]}")
         
         try:
             search_results = self.web_searcher.search_for_student_profile(profile_data)
-            has_web_results = (search_results["university_courses"]["university_results"] > 0 or 
-                              search_results["its_courses"]["its_results"] > 0)
         except Exception as e:
             print(f"⚠️  Errore ricerca web: {e}")
             search_results = {}
-            has_web_results = False
         
-        # 3. Costruisci il contesto
-        context = self._build_profile_context(profile, user_message)
+        # 3. Costruisci il prompt
+        prompt = self._build_recommendation_prompt(profile, user_message, search_results)
         
-        # 4. Prompt diverso se abbiamo risultati web
-        if has_web_results:
-            prompt = f"""Sei un orientatore universitario ESPERTO. Hai informazioni AGGIORNATE dal web.
-
-PROFILO STUDENTE:
+        try:
+            return self._generate(
+                prompt, temperature=self.temperature, max_output_tokens=1000, call_type="recommendation"
+            )
+        except Exception as e:
+            print(f"❌ Errore Gemini (raccomandazioni): {e}")
+            return self._fallback_recommendation()
+    
+    async def _generate_recommendation_response_async(self, profile: StudentProfile, user_message: str) -> str:
+        """Versione asincrona di _generate_recommendation_response."""
+        if not hasattr(self, 'web_searcher'):
+            self.web_searcher = WebSearcher()
+        
+        profile_data = self._search_profile_data(profile)
+        
+        print(f"🔍 Avvio ricerca web per: {profile_data["favorite_subjects"]} a {profile_data["location"]}")
+        
+        try:
+            search_results = await self._search_for_profile_async(profile, profile_data)
+        except Exception as e:
+            print(f"⚠️  Errore ricerca web: {e}")
+            search_results = {}
+        
+        prompt = self._build_recommendation_prompt(profile, user_message, search_results)
+        
+        try:
+            return await self._generate_async(
+                prompt, temperature=self.temperature, max_output_tokens=1000, call_type="recommendation"
+            )
+        except Exception as e:
+            print(f"❌ Errore Gemini (raccomandazioni): {e}")
+            return self._fallback_recommendation()
+    
+    async def _stream_recommendation_response(self, profile: StudentProfile, user_message: str) -> AsyncIterator[str]:
+        """Versione in streaming di _generate_recommendation_response."""
+        if not hasattr(self, 'web_searcher'):
+            self.web_searcher = WebSearcher()
+        
+        profile_data = self._search_profile_data(profile)
+        
+        print(f"🔍 Avvio ricerca web per: {profile_data["favorite_subjects"]} a {profile_data["location"]}")
+        
+        try:
+            search_results = await self._search_for_profile_async(profile, profile_data)
+        except Exception as e:
+            print(f"⚠️  Errore ricerca web: {e}")
+            search_results = {}
+        
+        prompt = self._build_recommendation_prompt(profile, user_message, search_results)
+        
+        streamed = False
+        try:
+            async for text in self._generate_stream(
+                prompt, temperature=self.temperature, max_output_tokens=1000, call_type="recommendation"
+            ):
+                streamed = True
+                yield text
+        except Exception as e:
+            print(f"❌ Errore Gemini (raccomandazioni): {e}")
+            if streamed:
+                raise
+            yield self._fallback_recommendation()
+    
+    def _search_profile_data(self, profile: StudentProfile) -> Dict[str, Any]:
+        """Dati del profilo usati per la ricerca web."""
+        return profile.search_data()
+    
+    def _maybe_prefetch_search(self, profile: StudentProfile) -> None:
+        """
+        Avvia in background la ricerca web per la sessione quando materie e località
+        sono note ma il profilo non è ancora sufficiente: il turno di raccomandazione
+        troverà i risultati pronti e pagherà solo la generazione.
+        """
+        if not self.search_prefetch or profile.is_sufficient_for_search():
+            return
+        if not profile.favorite_subjects or not profile.location:
+            return
+        
+        if not hasattr(self, 'web_searcher'):
+            self.web_searcher = WebSearcher()
+        
+        fingerprint = profile.search_fingerprint(self.web_searcher.search_fingerprint)
+        
+        slot = self._search_prefetch.get(profile.session_id)
+        if slot and slot[0] == fingerprint:
+            return
+        if slot:
+            slot[1].cancel()
+        
+        print(f"🔮 Prefetch ricerca web per la sessione {profile.session_id[:8]}...")
+        task = asyncio.create_task(self.web_searcher.search_for_student_profile_async(profile.search_data()))
+        self._search_prefetch[profile.session_id] = (fingerprint, task)
+        self._search_prefetch.move_to_end(profile.session_id)
+        metrics.increment("agent_search_prefetch_started")
+        
+        while len(self._search_prefetch) > self.prefetch_max_sessions:
+            _, (_, old_task) = self._search_prefetch.popitem(last=False)
+            old_task.cancel()
+    
+    async def _search_for_profile_async(self, profile: StudentProfile, profile_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Usa i risultati del prefetch se ancora validi, altrimenti cerca ora."""
+        metrics.increment("agent_recommendation_searches")
+        slot = self._search_prefetch.pop(profile.session_id, None)
+        
+        if slot:
+            fingerprint, task = slot
+            if fingerprint == profile.search_fingerprint(self.web_searcher.search_fingerprint):
+                try:
+                    results = await task
+                    metrics.increment("agent_search_prefetch_hits")
+                    return results
+                except Exception as e:
+                    print(f"⚠️  Prefetch ricerca fallito, nuova ricerca: {e}")
+            else:
+                task.cancel()
+        
+        return await self.web_searcher.search_for_student_profile_async(profile_data)
+    
+    def _build_recommendation_prompt(self, profile: StudentProfile, user_message: str,
+                                     search_results: Dict[str, Any]) -> PromptParts:
+        """Costruisce il prompt delle raccomandazioni, con o senza risultati web, entro il budget."""
+        return token_budget.fit(
+            "recommendation",
+            lambda level: self._render_recommendation_prompt(profile, user_message, search_results, level)
+        )
+    
+    def _render_recommendation_prompt(self, profile: StudentProfile, user_message: str,
+                                      search_results: Dict[str, Any], level: int) -> PromptParts:
+        # Le sezioni possono mancare se la ricerca è parziale (deadline scaduta)
+        has_web_results = (search_results.get("university_courses", {}).get("university_results", 0) > 0 or 
+                          search_results.get("its_courses", {}).get("its_results", 0) > 0)
+        
+        # Costruisci il contesto
+        context = self._build_profile_context(profile, user_message, level, conversation=True)
+        
+        # Prompt diverso se abbiamo risultati web
+        if not has_web_results:
+            # Fallback: prompt senza risultati web
+            return PromptParts(agent_prompts.system_prompt("recommendation_offline", level), context)
+        
+        prompt = f"""PROFILO STUDENTE:
 {context}
 
 RISULTATI RICERCA WEB:"""
-            
-            # Aggiungi risultati università
-            uni_courses = search_results.get("university_courses", {}).get("courses", [])
-            if uni_courses:
-                prompt += "\n📚 CORSI UNIVERSITARI TROVATI:\n"
-                for i, course in enumerate(uni_courses[:2], 1):
-                    prompt += f"{i}. {course["name"]} - {course.get("university", "università")}\n"
-                    if course.get("snippet"):
-                        prompt += f"   Info: {course["snippet"]}\n"
-            
-            # Aggiungi risultati ITS
-            its_courses = search_results.get("its_courses", {}).get("courses", [])
-            if its_courses:
-                prompt += "\n🔧 CORSI ITS TROVATI:\n"
-                for i, course in enumerate(its_courses[:2], 1):
-                    prompt += f"{i}. {course["name"][:80]}...\n"
-                    if course.get("duration"):
-                        prompt += f"   Durata: {course["duration"]}\n"
-            
-            prompt += """
-
-BASANDOTI SUL PROFILO DELLO STUDENTE E SUI RISULTATI REALI TROVATI:
-1. Fornisci un riepilogo PERSONALIZZATO
-2. Suggerisci 2-3 percorsi CONCRETI
-3. Includi CONSIGLI PRATICI
-
-Sii INCORAGGIANTE, PROFESSIONALE e BASATO SUI DATI REALI."""
         
+        # Aggiungi risultati università
+        uni_courses = search_results.get("university_courses", {}).get("courses", [])
+        if uni_courses:
+            prompt += "\n📚 CORSI UNIVERSITARI TROVATI:\n"
+            for i, course in enumerate(uni_courses[:2], 1):
+                prompt += f"{i}. {course["name"]} - {course.get("university", "università")}\n"
+                if course.get("snippet"):
+                    snippet = course["snippet"] if level < SUMMARIZED else truncate(course["snippet"], 30)
+                    prompt += f"   Info: {snippet}\n"
+        
+        # Aggiungi risultati ITS
+        its_courses = search_results.get("its_courses", {}).get("courses", [])
+        if its_courses:
+            prompt += "\n🔧 CORSI ITS TROVATI:\n"
+            for i, course in enumerate(its_courses[:2], 1):
+                prompt += f"{i}. {course["name"][:80]}...\n"
+                if course.get("duration") and level < SUMMARIZED:
+                    prompt += f"   Durata: {course["duration"]}\n"
+        
+        return PromptParts(agent_prompts.system_prompt("recommendation", level), prompt.rstrip())
+    
+    def _fallback_recommendation(self) -> str:
+        """Risposta di fallback quando Gemini non è disponibile."""
+        return "Grazie per le informazioni! Ho analizzato il tuo profilo. Considera di consultare i siti ufficiali delle università per informazioni aggiornate sui corsi."
+    
+    def _build_profile_context(self, profile: StudentProfile, last_message: str = "", level: int = FULL,
+                               conversation: bool = False) -> str:
+        """
+        Costruisce il contesto del profilo per Gemini (blocco del profilo memorizzato per revisione).
+        Ai livelli di compattazione più alti omette i campi vuoti, accorcia le liste e il messaggio.
+        Con conversation=True aggiunge la memoria della conversazione e gli ultimi turni.
+        """
+        context = profile.profile_context(
+            compact=level >= COMPACT_PROFILE,
+            list_limit=self.context_list_items if level >= SUMMARIZED else None,
+        )
+        if conversation:
+            context += self._build_conversation_context(profile, level)
+        if last_message and level >= SUMMARIZED:
+            last_message = truncate(last_message, self.context_message_tokens)
+        if last_message:
+            context += f"\n\n=== ULTIMO MESSAGGIO STUDENTE ===\n{last_message}"
+        return context
+    
+    def _build_conversation_context(self, profile: StudentProfile, level: int) -> str:
+        """
+        Memoria della conversazione più gli ultimi turni non ancora riassunti, escluso
+        il messaggio in corso (già nel prompt): dimensione limitata a qualsiasi turno.
+        """
+        blocks = []
+        if profile.conversation_memory:
+            blocks.append(f"=== MEMORIA CONVERSAZIONE ===\n{profile.conversation_memory}")
+        
+        turns = profile.recent_turns(self.memory_recent_turns + 1)[:-1] if self.memory_recent_turns else []
+        if turns:
+            lines = []
+            for turn in turns:
+                message = turn.message if level < SUMMARIZED else truncate(turn.message, 40)
+                lines.append(f"{'Studente' if turn.role == 'user' else 'Orientatore'}: {message}")
+            blocks.append("=== ULTIMI TURNI ===\n" + "\n".join(lines))
+        
+        return "".join(f"\n\n{block}" for block in blocks)
+    
+    def _maybe_refresh_memory(self, profile: StudentProfile) -> None:
+        """
+        Avvia in background il riassunto dei turni più vecchi quando ce ne sono almeno
+        AGENT_MEMORY_EVERY_TURNS oltre agli ultimi tenuti in chiaro (uno per sessione alla volta).
+        """
+        if not self.memory_every or profile.session_id in self._memory_tasks:
+            return
+        if profile.history_total - profile.memory_turns < self.memory_every + self.memory_recent_turns:
+            return
+        
+        session_id = profile.session_id
+        task = asyncio.create_task(self._refresh_memory(session_id))
+        self._memory_tasks[session_id] = task
+        task.add_done_callback(lambda _: self._memory_tasks.pop(session_id, None))
+        metrics.increment("agent_memory_refreshes_started")
+    
+    async def _refresh_memory(self, session_id: str) -> None:
+        """Riassume i turni tra memory_turns e gli ultimi AGENT_MEMORY_RECENT_TURNS in conversation_memory."""
+        profile = state_manager.get_session(session_id)
+        if not profile:
+            return
+        start = profile.memory_turns
+        end = profile.history_total - self.memory_recent_turns
+        if end <= start:
+            return
+        
+        first_seq = profile.history_total - len(profile.history_tail)
+        if start >= first_seq:
+            turns = profile.history_tail[start - first_seq:end - first_seq]
         else:
-            # Fallback: prompt senza risultati web
-            prompt = f"""Sei un orientatore universitario.
-
-{context}
-
-Il profilo è completo al {profile.profile_completeness*100:.1f}%.
-
-FORNISCI:
-1. Un breve riepilogo del profilo
-2. 2-3 possibili aree di studio
-3. Consigli per i prossimi passi
-
-Sii incoraggiante e professionale."""
+            # Turni già spostati nell'archivio su disco
+            turns = (await asyncio.to_thread(state_manager.get_full_history, session_id))[start:end]
         
         try:
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    temperature=self.temperature,
-                    max_output_tokens=1000
-                )
+            memory = await self._generate_async(
+                self._build_memory_prompt(profile.conversation_memory, turns),
+                temperature=0.2, max_output_tokens=self.memory_max_tokens, call_type="memory"
             )
-            return response.text.strip()
         except Exception as e:
-            print(f"❌ Errore Gemini (raccomandazioni): {e}")
-            return "Grazie per le informazioni! Ho analizzato il tuo profilo. Considera di consultare i siti ufficiali delle università per informazioni aggiornate sui corsi."
-    def _build_profile_context(self, profile: StudentProfile, last_message: str = "") -> str:
-        """Costruisce il contesto del profilo per Gemini."""
-        context_lines = [
-            "=== PROFILO STUDENTE ===",
-            f"Completamento: {profile.profile_completeness*100:.1f}%",
-            f"Località: {profile.location or 'Non specificata'}",
-            f"Tipo scuola: {profile.school_type or 'Non specificato'}",
-            f"Materie preferite: {', '.join(profile.favorite_subjects) or 'Nessuna'}",
-            f"Hobby: {', '.join(profile.hobbies) or 'Nessuno'}",
-            f"Obiettivo principale: {profile.primary_goal or 'Non specificato'}",
-            f"Preferenza istituzione: {profile.institution_preference or 'Non specificata'}",
-            f"Disponibile a trasferirsi: {'Sì' if profile.willing_to_relocate else 'No' if profile.willing_to_relocate is not None else 'Non specificato'}",
-        ]
+            print(f"⚠️  Memoria della conversazione non aggiornata: {e}")
+            metrics.increment("agent_memory_refresh_failures")
+            return
         
-        if last_message:
-            context_lines.append("")
-            context_lines.append(f"=== ULTIMO MESSAGGIO STUDENTE ===")
-            context_lines.append(last_message)
+        if not memory:
+            return
+        # Compare-and-set fuori dalla coda dei turni (non occupa posti in attesa): il profilo
+        # viene riletto a ogni tentativo, e un turno in corso unirà la memoria al suo salvataggio
+        for _ in range(state_manager.cas_max_retries + 1):
+            profile = state_manager.get_session(session_id)
+            if not profile or profile.memory_turns != start:
+                return  # Sessione scaduta o memoria già aggiornata altrove
+            profile.conversation_memory = memory
+            profile.memory_turns = end
+            if state_manager.compare_and_set(session_id, profile):
+                metrics.increment("agent_memory_refreshes")
+                return
         
-        return "\n".join(context_lines)
+        print(f"⚠️  Memoria della conversazione non salvata: sessione {session_id[:8]} aggiornata in concorrenza")
+        metrics.increment("agent_memory_refresh_failures")
+    
+    def _build_memory_prompt(self, memory: str, turns: List[Turn]) -> PromptParts:
+        """Prompt del riassunto incrementale: memoria attuale più i nuovi turni."""
+        lines = [f"{'Studente' if turn.role == 'user' else 'Orientatore'}: {turn.message}" for turn in turns]
+        user = f"MEMORIA ATTUALE:\n{memory or '(vuota)'}\n\nNUOVI TURNI:\n" + "\n".join(lines)
+        return PromptParts(agent_prompts.MEMORY, user)
     
     def start_new_conversation(self) -> Tuple[str, StudentProfile]:
         """Inizia una nuova conversazione."""
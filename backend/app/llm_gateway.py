@@ -0,0 +1,373 @@
+"""
+Gateway verso Gemini: un solo client google-genai con pool di connessioni httpx condiviso,
+scadenza per chiamata, tentativi ripetuti con jitter sugli errori transitori (429, 5xx,
+timeout di rete) e circuit breaker che, durante un disservizio, fa fallire subito le
+chiamate così che l'agente passi alle risposte di ripiego.
+Per le chiamate brevi (estrazione) può inviare una richiesta "hedged": se la prima non
+risponde entro LLM_HEDGE_AFTER_MS ne parte una seconda e vince la più veloce.
+I prompt divisi in PromptParts mandano il prefisso statico come system_instruction.
+"""
+import os
+import time
+import random
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Awaitable, Dict, Optional, Tuple
+
+import httpx
+from google import genai
+from google.genai import errors, types
+
+try:
+    from metrics import metrics
+    from token_budget import token_budget
+    from prompt_cache import PromptParts, split
+    from agent.llm_providers import LLMProvider, provider_from_env
+except ImportError:
+    from .metrics import metrics
+    from .token_budget import token_budget
+    from .prompt_cache import PromptParts, split
+    from .agent.llm_providers import LLMProvider, provider_from_env
+
+# Codici HTTP per cui ha senso ritentare
+RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+metrics.register_ratio("llm_retry_rate", "llm_retries", "llm_calls")
+metrics.register_ratio("llm_hedge_win_rate", "llm_hedge_wins", "llm_hedged_calls")
+
+
+class LLMUnavailableError(Exception):
+    """Gemini non raggiungibile: circuito aperto o tentativi esauriti."""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """Il circuit breaker è aperto: la chiamata non viene nemmeno tentata."""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """True per gli errori transitori: rate limit, errori del server, timeout e rete."""
+    if isinstance(error, errors.APIError):
+        return error.code in RETRYABLE_STATUS
+    return isinstance(error, (asyncio.TimeoutError, TimeoutError, httpx.TimeoutException, httpx.TransportError))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker a tre stati. Dopo failure_threshold errori transitori consecutivi
+    si apre e rifiuta le chiamate per reset_seconds; poi lascia passare una sola
+    chiamata di prova (half-open) che lo richiude o lo riapre.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Tuple[bool, bool]:
+        """(la chiamata può partire, è la chiamata di prova)."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True, False
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN  # una sola chiamata di prova
+                return True, True
+            return False, False
+
+    def allow(self) -> bool:
+        """True se la chiamata può partire."""
+        return self.acquire()[0]
+
+    def settle_probe(self) -> None:
+        """
+        Chiude la chiamata di prova: se non ha registrato né un successo né un errore
+        (annullata o fallita senza risposta) il circuito si riapre per reset_seconds.
+        """
+        with self._lock:
+            if self.state != self.HALF_OPEN:
+                return
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != self.CLOSED:
+                print("✅ Circuito Gemini richiuso")
+            self.state = self.CLOSED
+            self.failures = 0
+        metrics.set_gauge("llm_circuit_open", 0)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"🔌 Circuito Gemini aperto dopo {self.failures} errori, riprovo tra {self.reset_seconds:.0f}s")
+                    metrics.increment("llm_circuit_trips")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+        if self.state == self.OPEN:
+            metrics.set_gauge("llm_circuit_open", 1)
+
+
+class LLMGateway:
+    """Chiamate a Gemini con pool di connessioni, scadenze, retry, circuit breaker e hedging."""
+
+    def __init__(self, api_key: Optional[str] = None, client: Optional[genai.Client] = None,
+                 provider: Optional[LLMProvider] = None):
+        self.timeout = float(os.getenv("LLM_TIMEOUT_SECONDS", 20))
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", 2))
+        self.retry_base = float(os.getenv("LLM_RETRY_BASE_MS", 250)) / 1000
+        self.retry_max = float(os.getenv("LLM_RETRY_MAX_MS", 4000)) / 1000
+        self.hedge_after = float(os.getenv("LLM_HEDGE_AFTER_MS", 0)) / 1000  # 0 = hedging disattivato
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", 5)),
+            reset_seconds=float(os.getenv("LLM_BREAKER_RESET_SECONDS", 30)),
+        )
+
+        # Provider (API reale, stand-in locale o cassetta): decide trasporti e indirizzo
+        self.provider = provider or (provider_from_env() if client is None else LLMProvider())
+        self._http = None
+        self._async_http = None
+        if client is None:
+            # Client httpx espliciti: il pool è condiviso da tutte le chiamate (anche con aiohttp installato)
+            limits = httpx.Limits(
+                max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", 20)),
+                max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE", 10)),
+                keepalive_expiry=30,
+            )
+            transport, async_transport = self.provider.transports(limits)
+            self._http = httpx.Client(limits=limits, transport=transport)
+            self._async_http = httpx.AsyncClient(limits=limits, transport=async_transport)
+            client = genai.Client(api_key=api_key or self.provider.name, http_options=types.HttpOptions(
+                httpx_client=self._http, httpx_async_client=self._async_http, **self.provider.http_options()
+            ))
+        self.client = client
+
+    def _backoff(self, attempt: int) -> float:
+        """Attesa prima del tentativo successivo: esponenziale con full jitter."""
+        return random.uniform(0, min(self.retry_max, self.retry_base * (2 ** attempt)))
+
+    def _config(self, temperature: float, max_output_tokens: int, timeout: float,
+                **config: Any) -> types.GenerateContentConfig:
+        return types.GenerateContentConfig(
+            temperature=temperature,
+            max_output_tokens=max_output_tokens,
+            http_options=types.HttpOptions(timeout=max(int(timeout * 1000), 1)),
+            **config
+        )
+
+    def _check_circuit(self) -> bool:
+        """Solleva CircuitOpenError se il circuito è aperto; True per la chiamata di prova."""
+        allowed, probe = self.breaker.acquire()
+        if not allowed:
+            metrics.increment("llm_circuit_rejections")
+            raise CircuitOpenError("circuito Gemini aperto")
+        return probe
+
+    @staticmethod
+    def _prepare(prompt: Any, config: Dict[str, Any]) -> Tuple[Any, Dict[str, Any]]:
+        """Contenuto e configurazione: il prefisso di PromptParts va in system_instruction."""
+        if not isinstance(prompt, PromptParts):
+            return prompt, config
+        contents, prefix_config = split(prompt)
+        return contents, {**config, **prefix_config}
+
+    def _record_error(self, error: BaseException) -> bool:
+        """Registra l'errore; True se va ritentato."""
+        if isinstance(error, errors.APIError) and not is_retryable(error):
+            # Gemini ha risposto (400, 404, ...): il servizio è raggiungibile
+            self.breaker.record_success()
+        if not is_retryable(error):
+            return False
+        self.breaker.record_failure()
+        metrics.increment("llm_transient_errors")
+        return True
+
+    def generate(self, model: str, prompt: Any, temperature: float, max_output_tokens: int,
+                 deadline: Optional[float] = None, call_type: str = "other", **config: Any) -> str:
+        """
+        Chiamata sincrona con retry; deadline (secondi) vale per tutti i tentativi insieme.
+        call_type identifica la chiamata nella contabilità dei token.
+        """
+        metrics.increment("llm_calls")
+        start = time.monotonic()
+        expires = start + (deadline or self.timeout)
+
+        for attempt in range(self.max_retries + 1):
+            probe = self._check_circuit()
+            remaining = expires - time.monotonic()
+            contents, call_config = self._prepare(prompt, config)
+            try:
+                response = self.client.models.generate_content(
+                    model=model, contents=contents,
+                    config=self._config(temperature, max_output_tokens, remaining, **call_config)
+                )
+            except Exception as e:
+                if not self._record_error(e) or attempt == self.max_retries:
+                    metrics.increment("llm_failures")
+                    raise
+                pause = self._backoff(attempt)
+                if time.monotonic() + pause >= expires:
+                    metrics.increment("llm_failures")
+                    raise
+                metrics.increment("llm_retries")
+                time.sleep(pause)
+                continue
+            else:
+                self.breaker.record_success()
+            finally:
+                if probe:
+                    self.breaker.settle_probe()
+
+            metrics.observe("llm_call_seconds", time.monotonic() - start)
+            text = response.text.strip()
+            token_budget.record(call_type, prompt, text, response.usage_metadata)
+            return text
+
+    async def _attempt_async(self, model: str, contents: Any, config: types.GenerateContentConfig,
+                             timeout: float, hedge: bool) -> Any:
+        """Un tentativo con scadenza; con hedge, seconda richiesta se la prima tarda."""
+        def call() -> Awaitable[Any]:
+            return self.client.aio.models.generate_content(model=model, contents=contents, config=config)
+
+        if not hedge or not self.hedge_after or self.hedge_after >= timeout:
+            return await asyncio.wait_for(call(), timeout)
+
+        first = asyncio.ensure_future(call())
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+        if done:
+            return first.result()
+
+        metrics.increment("llm_hedged_calls")
+        second = asyncio.ensure_future(call())
+        pending = {first, second}
+        try:
+            loop_deadline = asyncio.get_running_loop().time() + timeout - self.hedge_after
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=loop_deadline - asyncio.get_running_loop().time(),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            metrics.increment("llm_hedge_wins")
+                        return task.result()
+            # Entrambe fallite: propaga l'errore della prima
+            return first.result()
+        finally:
+            for task in (first, second):
+                task.cancel()
+
+    async def generate_async(self, model: str, prompt: Any, temperature: float, max_output_tokens: int,
+                             deadline: Optional[float] = None, hedge: bool = False,
+                             call_type: str = "other", **config: Any) -> str:
+        """Versione asincrona di generate; hedge=True solo per chiamate brevi e idempotenti."""
+        metrics.increment("llm_calls")
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        expires = start + (deadline or self.timeout)
+
+        for attempt in range(self.max_retries + 1):
+            probe = self._check_circuit()
+            remaining = expires - loop.time()
+            contents, call_config = self._prepare(prompt, config)
+            config_obj = self._config(temperature, max_output_tokens, remaining, **call_config)
+            try:
+                response = await self._attempt_async(model, contents, config_obj, remaining, hedge)
+            except Exception as e:
+                if not self._record_error(e) or attempt == self.max_retries:
+                    metrics.increment("llm_failures")
+                    raise
+                pause = self._backoff(attempt)
+                if loop.time() + pause >= expires:
+                    metrics.increment("llm_failures")
+                    raise
+                metrics.increment("llm_retries")
+                await asyncio.sleep(pause)
+                continue
+            else:
+                self.breaker.record_success()
+            finally:
+                # Anche se annullata (CancelledError non è un Exception) la prova non resta in sospeso
+                if probe:
+                    self.breaker.settle_probe()
+
+            metrics.observe("llm_call_seconds", loop.time() - start)
+            text = response.text.strip()
+            token_budget.record(call_type, prompt, text, response.usage_metadata)
+            return text
+
+    async def generate_stream(self, model: str, prompt: Any, temperature: float, max_output_tokens: int,
+                              deadline: Optional[float] = None, call_type: str = "other",
+                              **config: Any) -> AsyncIterator[str]:
+        """
+        Streaming con retry solo prima del primo frammento (dopo, il testo è già stato
+        inviato al client). deadline limita l'attesa complessiva del primo frammento,
+        retry compresi, e quella di ciascun frammento successivo.
+        """
+        metrics.increment("llm_calls")
+        timeout = deadline or self.timeout
+        loop = asyncio.get_running_loop()
+        expires = loop.time() + timeout
+
+        for attempt in range(self.max_retries + 1):
+            probe = self._check_circuit()
+            remaining = expires - loop.time()
+            contents, call_config = self._prepare(prompt, config)
+            config_obj = self._config(temperature, max_output_tokens, remaining, **call_config)
+            try:
+                stream = await asyncio.wait_for(
+                    self.client.aio.models.generate_content_stream(model=model, contents=contents, config=config_obj),
+                    remaining
+                )
+                iterator = stream.__aiter__()
+                first = await asyncio.wait_for(iterator.__anext__(), expires - loop.time())
+            except StopAsyncIteration:
+                self.breaker.record_success()
+                return
+            except Exception as e:
+                if not self._record_error(e) or attempt == self.max_retries:
+                    metrics.increment("llm_failures")
+                    raise
+                pause = self._backoff(attempt)
+                if loop.time() + pause >= expires:
+                    metrics.increment("llm_failures")
+                    raise
+                metrics.increment("llm_retries")
+                await asyncio.sleep(pause)
+                continue
+            else:
+                self.breaker.record_success()
+                break
+            finally:
+                if probe:
+                    self.breaker.settle_probe()
+
+        chunk = first
+        streamed = []
+        while True:
+            if chunk.text:
+                streamed.append(chunk.text)
+                yield chunk.text
+            try:
+                chunk = await asyncio.wait_for(iterator.__anext__(), timeout)
+            except StopAsyncIteration:
+                # L'ultimo frammento porta i conteggi dell'intera risposta
+                token_budget.record(call_type, prompt, "".join(streamed), chunk.usage_metadata)
+                return
+
+    async def aclose(self) -> None:
+        """Chiude i pool di connessioni e salva l'eventuale cassetta."""
+        if self._async_http is not None:
+            await self._async_http.aclose()
+        if self._http is not None:
+            self._http.close()
+        self.provider.close()
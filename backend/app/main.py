@@ -1,16 +1,21 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 from datetime import datetime
+from contextlib import asynccontextmanager
 import uuid
+import json
+import asyncio
 import logging
 
 # Importa il nostro NUOVO agente Gemini
 try:
     from .gemini_agent import GeminiOrientationAgent, orientation_agent
-    from .state_manager import state_manager
+    from .state_manager import state_manager, SessionBusyError, SessionTurnTimeout
     from .student_profile import StudentProfile
+    from .metrics import metrics
     AGENT_AVAILABLE = orientation_agent is not None
 except ImportError as e:
     print(f"⚠️  Errore import agente avanzato: {e}")
@@ -46,11 +51,28 @@ class RecommendationRequest(BaseModel):
     location: Optional[str] = None
     budget: Optional[float] = None
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Avvio e spegnimento dell'app: snapshot delle sessioni, sweeper, salvataggio finale e pool Gemini."""
+    managed = AGENT_AVAILABLE and hasattr(orientation_agent, 'process_message_async')
+    sweeper = None
+    if managed:
+        state_manager.load_snapshot()
+        sweeper = asyncio.create_task(state_manager.run_sweeper())
+    yield
+    if sweeper:
+        sweeper.cancel()
+    if managed:
+        await state_manager.shutdown()
+    if hasattr(orientation_agent, 'llm'):
+        await orientation_agent.llm.aclose()
+
 # Crea l'app FastAPI
 app = FastAPI(
     title="Career Guidance Agent API",
     description="API per l'agente AI avanzato di orientamento universitario",
     version="2.0.0",
+    lifespan=lifespan,
 )
 
 # Configura CORS (stesse origini per compatibilità)
@@ -76,7 +98,7 @@ async def root():
         "agent_available": AGENT_AVAILABLE,
         "agent_type": "GeminiOrientationAgent" if AGENT_AVAILABLE and hasattr(orientation_agent, 'process_message') else "SimpleCareerAgent",
         "version": "2.0.0",
-        "endpoints": ["/health", "/api/chat", "/api/recommendations", "/docs", "/api/profile/{session_id}"]
+        "endpoints": ["/health", "/api/chat", "/api/chat/stream", "/api/recommendations", "/docs", "/api/profile/{session_id}"]
     }
 
 @app.get("/health")
@@ -89,6 +111,35 @@ async def health_check():
         "timestamp": datetime.now().isoformat()
     }
 
+def _build_recommendations(profile: Optional["StudentProfile"]) -> List[dict]:
+    """Raccomandazioni sintetiche da restituire al frontend se il profilo è completo."""
+    recommendations = []
+    if profile and profile.is_sufficient_for_search():
+        recommendations = [
+            {
+                "type": "university",
+                "name": f"Corsi in {', '.join(profile.favorite_subjects[:2]) if profile.favorite_subjects else 'tua zona'}",
+                "match_score": 0.9,
+                "reason": f"Basato sui tuoi interessi in {', '.join(profile.favorite_subjects[:2]) if profile.favorite_subjects else 'materie scientifiche'}"
+            }
+        ]
+    return recommendations
+
+def _build_conversation_history(profile: "StudentProfile") -> List[dict]:
+    """Cronologia nel formato atteso dal frontend (ultimi 10 messaggi)."""
+    conversation_history = []
+    for turn in profile.history_tail[-10:]:  # Ultimi 10 messaggi
+        conversation_history.append({
+            "user": turn.message if turn.role == "user" else "",
+            "agent": turn.message if turn.role == "agent" else "",
+            "timestamp": datetime.fromtimestamp(turn.ts).isoformat()
+        })
+    return conversation_history
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Formatta un evento Server-Sent Events."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat_endpoint(request: ChatRequest):
     """Endpoint per la chat con l'agente AI avanzato"""
@@ -121,30 +172,20 @@ async def chat_endpoint(request: ChatRequest):
         
         # Processa il messaggio
         if hasattr(orientation_agent, 'process_message'):
-            # Nuovo agente Gemini
-            response, profile = orientation_agent.process_message(session_id, request.message)
+            # Nuovo agente Gemini (percorso asincrono, non blocca l'event loop);
+            # i turni della stessa sessione vengono eseguiti uno alla volta
+            if hasattr(orientation_agent, 'process_message_async'):
+                async with state_manager.session_turn(session_id):
+                    response, profile = await orientation_agent.process_message_async(session_id, request.message)
+            else:
+                response, profile = orientation_agent.process_message(session_id, request.message)
             
             # Prepara raccomandazioni se il profilo è completo
-            recommendations = []
-            if profile and profile.is_sufficient_for_search():
-                recommendations = [
-                    {
-                        "type": "university",
-                        "name": f"Corsi in {', '.join(profile.favorite_subjects[:2]) if profile.favorite_subjects else 'tua zona'}",
-                        "match_score": 0.9,
-                        "reason": f"Basato sui tuoi interessi in {', '.join(profile.favorite_subjects[:2]) if profile.favorite_subjects else 'materie scientifiche'}"
-                    }
-                ]
+            recommendations = _build_recommendations(profile)
             
             # Prepara cronologia conversazione
-            conversation_history = []
-            if profile and hasattr(profile, 'conversation_history'):
-                for turn in profile.conversation_history[-10:]:  # Ultimi 10 messaggi
-                    conversation_history.append({
-                        "user": turn["message"] if turn["role"] == "user" else "",
-                        "agent": turn["message"] if turn["role"] == "agent" else "",
-                        "timestamp": turn.get("timestamp", datetime.now().isoformat())
-                    })
+            if profile and hasattr(profile, 'history_tail'):
+                conversation_history = _build_conversation_history(profile)
             else:
                 conversation_history = [{
                     "user": request.message,
@@ -168,10 +209,58 @@ async def chat_endpoint(request: ChatRequest):
             conversation_history=conversation_history[-5:]  # Ultimi 5 messaggi
         )
         
+    except HTTPException:
+        raise
+    except SessionBusyError:
+        raise HTTPException(status_code=429, detail="Troppi messaggi in attesa per questa sessione, riprova tra poco")
+    except SessionTurnTimeout:
+        raise HTTPException(status_code=409, detail="Il messaggio precedente è ancora in elaborazione")
     except Exception as e:
         logger.error(f"Errore in chat endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """Endpoint di chat in streaming (Server-Sent Events)"""
+    if not AGENT_AVAILABLE or not hasattr(orientation_agent, 'process_message_stream'):
+        raise HTTPException(status_code=503, detail="Streaming non disponibile")
+    
+    session_id = request.session_id
+    if not session_id:
+        _, profile = orientation_agent.start_new_conversation()
+        session_id = profile.session_id
+    elif state_manager.turn_queue_full(session_id):
+        raise HTTPException(status_code=429, detail="Troppi messaggi in attesa per questa sessione, riprova tra poco")
+    
+    async def event_stream():
+        try:
+            async with state_manager.session_turn(session_id):
+                async for event, data in orientation_agent.process_message_stream(session_id, request.message):
+                    if event == "done":
+                        profile = data["profile"]
+                        yield _sse_event("done", {
+                            "response": data["response"],
+                            "session_id": profile.session_id,
+                            "recommendations": _build_recommendations(profile),
+                            "conversation_history": _build_conversation_history(profile)[-5:],
+                            "profile": profile.progress_summary()
+                        })
+                    else:
+                        yield _sse_event(event, data)
+        except SessionBusyError:
+            yield _sse_event("error", {"status": 429, "detail": "Troppi messaggi in attesa per questa sessione"})
+        except SessionTurnTimeout:
+            yield _sse_event("error", {"status": 409, "detail": "Il messaggio precedente è ancora in elaborazione"})
+        except Exception as e:
+            logger.error(f"Errore in chat stream endpoint: {e}")
+            yield _sse_event("error", {"detail": str(e)})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/api/recommendations")
 async def get_recommendations(request: RecommendationRequest):
     """Endpoint per raccomandazioni basate su profilo"""
@@ -252,9 +341,7 @@ async def get_profile_info(session_id: str):
             "school_type": profile.school_type,
             "favorite_subjects": profile.favorite_subjects,
             "primary_goal": profile.primary_goal,
-            "completeness": profile.profile_completeness,
-            "ready_for_search": profile.is_sufficient_for_search(),
-            "missing_info": profile.missing_info_priority[:3]
+            **profile.progress_summary()
         }
         
     except HTTPException:
@@ -263,6 +350,14 @@ async def get_profile_info(session_id: str):
         logger.error(f"Errore in profile endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """Endpoint con le metriche di runtime (contatori, tempi, hit rate)"""
+    try:
+        return metrics.snapshot()
+    except NameError:
+        raise HTTPException(status_code=501, detail="Metriche non disponibili")
+
 @app.get("/api/test")
 async def test_endpoint():
     """Endpoint di test"""
@@ -271,7 +366,7 @@ async def test_endpoint():
         "agent_available": AGENT_AVAILABLE,
         "agent_type": "advanced" if hasattr(orientation_agent, 'process_message') else "simple",
         "timestamp": datetime.now().isoformat(),
-        "endpoints_available": ["/", "/health", "/api/chat", "/api/recommendations", "/api/profile/{id}", "/docs"]
+        "endpoints_available": ["/", "/health", "/api/chat", "/api/chat/stream", "/api/recommendations", "/api/profile/{id}", "/docs"]
     }
 
 if __name__ == "__main__":
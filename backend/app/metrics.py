@@ -0,0 +1,64 @@
+"""
+Metriche di runtime del backend (contatori, gauge e tempi).
+Esposte in forma aggregata dall'endpoint /api/metrics.
+"""
+import threading
+from typing import Dict, Any, Tuple
+
+
+class Metrics:
+    """Registro in-process di metriche semplici e thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {}
+        self.gauges: Dict[str, float] = {}
+        self.timings: Dict[str, Dict[str, float]] = {}
+        # Rapporti derivati: nome -> (contatore numeratore, contatore denominatore)
+        self.ratios: Dict[str, Tuple[str, str]] = {}
+
+    def increment(self, name: str, value: int = 1) -> None:
+        """Incrementa un contatore."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        """Imposta il valore corrente di una gauge."""
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        """Registra una misura (es. una latenza in secondi)."""
+        with self._lock:
+            timing = self.timings.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+            timing["count"] += 1
+            timing["total"] += value
+            timing["max"] = max(timing["max"], value)
+
+    def register_ratio(self, name: str, numerator: str, denominator: str) -> None:
+        """Dichiara un rapporto tra due contatori (es. hit rate)."""
+        with self._lock:
+            self.ratios[name] = (numerator, denominator)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Restituisce una copia di tutte le metriche."""
+        with self._lock:
+            timings = {
+                name: {**timing, "avg": timing["total"] / timing["count"] if timing["count"] else 0.0}
+                for name, timing in self.timings.items()
+            }
+            ratios = {}
+            for name, (numerator, denominator) in self.ratios.items():
+                total = self.counters.get(denominator, 0)
+                ratios[name] = self.counters.get(numerator, 0) / total if total else None
+
+            return {
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "timings": timings,
+                "ratios": ratios,
+            }
+
+
+# Istanza globale
+metrics = Metrics()
@@ -0,0 +1,130 @@
+"""
+Codec binario versionato per StudentProfile.
+Formato: un byte con la versione dello schema seguito dal JSON compatto del profilo
+(orjson se installato), senza i campi vuoti. I dati scritti da noi vengono ricaricati
+con model_construct, saltando la validazione pydantic; le versioni precedenti passano
+per le migrazioni registrate in MIGRATIONS.
+"""
+import sys
+import json
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from student_profile import StudentProfile
+    from turn_log import Turn
+except ImportError:
+    from .student_profile import StudentProfile
+    from .turn_log import Turn
+
+# Versione corrente dello schema: incrementarla quando cambiano i campi del profilo
+SCHEMA_VERSION = 1
+
+# Migrazioni dalla versione N alla N+1, applicate in sequenza al dict decodificato.
+# Esempio per un nuovo campo con default non banale:
+#   MIGRATIONS[1] = lambda data: {**data, "nuovo_campo": "valore"}
+MIGRATIONS: Dict[int, Callable[[Dict[str, Any]], Dict[str, Any]]] = {}
+
+DATETIME_FIELDS = tuple(
+    name for name, field in StudentProfile.model_fields.items() if field.annotation is datetime
+)
+EMPTY_VALUES = (None, [], "")
+
+# Default calcolati una volta: model_construct ispeziona le default_factory a ogni chiamata
+FIELD_FACTORIES = {
+    name: field.default_factory for name, field in StudentProfile.model_fields.items() if field.default_factory
+}
+FIELD_DEFAULTS = {
+    name: field.default for name, field in StudentProfile.model_fields.items() if not field.default_factory
+}
+
+
+def _dumps(data: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def _loads(data: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _profile_data(profile: StudentProfile, exclude: Iterable[str] = ()) -> Dict[str, Any]:
+    """Campi non vuoti del profilo, con datetime in ISO e turni come liste."""
+    data = {}
+    for name, value in profile.__dict__.items():
+        if name in exclude or value in EMPTY_VALUES:
+            continue
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif name == "history_tail":
+            value = [tuple(turn) for turn in value]
+        data[name] = value
+    return data
+
+
+def _migrate(data: Dict[str, Any], version: int) -> Dict[str, Any]:
+    if version > SCHEMA_VERSION:
+        raise ValueError(f"Versione profilo {version} più recente del codec ({SCHEMA_VERSION})")
+    while version < SCHEMA_VERSION:
+        migration = MIGRATIONS.get(version)
+        if migration:
+            data = migration(data)
+        version += 1
+    return data
+
+
+def _construct(data: Dict[str, Any]) -> StudentProfile:
+    """Ricostruisce il profilo senza validazione: solo per dati scritti da questo codec."""
+    for name in DATETIME_FIELDS:
+        if isinstance(data.get(name), str):
+            data[name] = datetime.fromisoformat(data[name])
+    if "history_tail" in data:
+        make, intern = Turn._make, sys.intern
+        data["history_tail"] = [make((intern(role), message, ts)) for role, message, ts in data["history_tail"]]
+    for name, factory in FIELD_FACTORIES.items():
+        if name not in data:
+            data[name] = factory()
+    for name, default in FIELD_DEFAULTS.items():
+        data.setdefault(name, default)
+    return StudentProfile.model_construct(**data)
+
+
+def encode(profile: StudentProfile) -> bytes:
+    """Serializza il profilo: byte di versione + JSON compatto."""
+    return bytes((SCHEMA_VERSION,)) + _dumps(_profile_data(profile))
+
+
+def decode(blob: bytes, trusted: bool = True) -> StudentProfile:
+    """
+    Deserializza un profilo. Con trusted=True usa model_construct (nessuna validazione);
+    i vecchi snapshot JSON senza byte di versione passano dalla validazione pydantic.
+    """
+    if isinstance(blob, str):
+        blob = blob.encode("utf-8")
+    if blob[:1] == b"{":
+        return StudentProfile.model_validate_json(blob)
+
+    data = _migrate(_loads(blob[1:]), blob[0])
+    return _construct(data) if trusted else StudentProfile.model_validate(data)
+
+
+def encode_fields(profile: StudentProfile, exclude: Iterable[str] = ()) -> Dict[str, str]:
+    """Un valore JSON per campo (per archivi a chiave/valore come gli hash Redis)."""
+    return {name: _dumps(value).decode("utf-8") for name, value in _profile_data(profile, exclude).items()}
+
+
+def decode_fields(fields: Dict[str, str], version: int = SCHEMA_VERSION,
+                  extra: Optional[Dict[str, Any]] = None) -> StudentProfile:
+    """Ricostruisce un profilo da encode_fields (percorso fidato)."""
+    data = {name: _loads(value) for name, value in fields.items()}
+    if extra:
+        data.update(extra)
+    return _construct(_migrate(data, version))
@@ -0,0 +1,79 @@
+"""
+Registro dichiarativo dei campi del profilo studente.
+Da qui derivano completezza, ordine delle informazioni mancanti, blocco di contesto
+per i prompt e dati della ricerca web: per aggiungere un campo basta registrarlo.
+"""
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+
+class ProfileField(NamedTuple):
+    """Metadati di un campo del profilo usati dallo stato derivato."""
+    name: str
+    label: Optional[str] = None  # Etichetta nel contesto del prompt (None = non mostrato)
+    empty_label: str = "Non specificato"  # Testo mostrato quando il campo manca
+    critical: bool = False  # Conta per profile_completeness
+    priority: Optional[int] = None  # Posizione in missing_info_priority (None = non richiesto)
+    is_list: bool = False  # I valori estratti si aggiungono alla lista
+    is_flag: bool = False  # Sì/No: False è comunque un'informazione
+    search: bool = False  # Alimenta la ricerca web
+
+
+# Ordine di dichiarazione = ordine delle righe nel contesto del prompt
+FIELDS: Tuple[ProfileField, ...] = (
+    ProfileField("location", "Località", "Non specificata", critical=True, priority=1, search=True),
+    ProfileField("school_type", "Tipo scuola", critical=True, priority=2, search=True),
+    ProfileField("favorite_subjects", "Materie preferite", "Nessuna", critical=True, priority=3,
+                 is_list=True, search=True),
+    ProfileField("hobbies", "Hobby", "Nessuno", priority=7, is_list=True),
+    ProfileField("primary_goal", "Obiettivo principale", critical=True, priority=4, search=True),
+    ProfileField("institution_preference", "Preferenza istituzione", "Non specificata", critical=True,
+                 priority=5, search=True),
+    ProfileField("willing_to_relocate", "Disponibile a trasferirsi", priority=6, is_flag=True),
+    ProfileField("learning_style", priority=8),
+    ProfileField("disliked_subjects", is_list=True),
+    ProfileField("soft_skills", is_list=True),
+)
+
+REGISTRY: Dict[str, ProfileField] = {field.name: field for field in FIELDS}
+CRITICAL_FIELDS = tuple(field.name for field in FIELDS if field.critical)
+MISSING_PRIORITY = tuple(
+    field.name for field in sorted((f for f in FIELDS if f.priority is not None), key=lambda f: f.priority)
+)
+CONTEXT_FIELDS = tuple(field for field in FIELDS if field.label)
+SEARCH_FIELDS = tuple(field.name for field in FIELDS if field.search)
+LIST_FIELDS = frozenset(field.name for field in FIELDS if field.is_list)
+
+
+def is_filled(name: str, value: Any) -> bool:
+    """True se il campo contiene un'informazione utile."""
+    if REGISTRY[name].is_flag:
+        return value is not None
+    return value not in (None, [], "")
+
+
+# Risposte sì/no riconosciute per i campi is_flag (l'estrazione LLM restituisce testo)
+TRUE_WORDS = frozenset({"sì", "si", "yes", "true", "vero", "disponibile"})
+FALSE_WORDS = frozenset({"no", "false", "falso", "non disponibile"})
+
+
+def parse_flag(value: Any) -> Optional[bool]:
+    """Valore sì/no come booleano, None se non riconosciuto."""
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower().rstrip(".!")
+    if text in TRUE_WORDS:
+        return True
+    if text in FALSE_WORDS or text.startswith(("no ", "no,", "non ")):
+        return False
+    return None
+
+
+def format_value(field: ProfileField, value: Any, list_limit: Optional[int] = None) -> str:
+    """Valore del campo come testo per il contesto del prompt (list_limit: solo gli ultimi elementi)."""
+    if field.is_flag:
+        return field.empty_label if value is None else ("Sì" if value else "No")
+    if field.is_list:
+        if list_limit and len(value) > list_limit:
+            return f"{', '.join(value[-list_limit:])} (+{len(value) - list_limit} altri)"
+        return ", ".join(value) or field.empty_label
+    return value or field.empty_label
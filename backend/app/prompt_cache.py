@@ -0,0 +1,22 @@
+"""
+Prompt divisi in prefisso statico e suffisso dinamico, per la cache implicita di Gemini.
+Ogni prompt dell'agente ha un prefisso di sistema (istruzioni ed esempi, uguali per tutti
+gli studenti) e un suffisso con profilo, messaggio e risultati. Il prefisso viaggia per
+primo come system_instruction: quando supera il minimo del modello l'API lo riusa da sola
+tra una richiesta e l'altra (cache implicita) e riporta i token risparmiati in
+usage_metadata.cached_content_token_count, registrati da token_budget.record.
+La cache esplicita (client.caches) non si usa: i prefissi dell'agente, al più circa 450
+token, sono sotto il minimo di 1024 token richiesto dall'API per crearla.
+"""
+from typing import Any, Dict, NamedTuple, Tuple
+
+
+class PromptParts(NamedTuple):
+    """Prompt diviso in prefisso statico (cacheable) e suffisso dinamico."""
+    system: str  # Istruzioni di sistema, identiche per tutti gli studenti
+    user: str  # Profilo, messaggio e dati del turno
+
+
+def split(parts: PromptParts) -> Tuple[str, Dict[str, Any]]:
+    """Contenuto e opzioni di configurazione della chiamata: il prefisso va in system_instruction."""
+    return parts.user, {"system_instruction": parts.system}
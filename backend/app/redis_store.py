@@ -0,0 +1,355 @@
+"""
+Backend Redis per le sessioni: client con pool di connessioni, profilo salvato come hash
+(un campo JSON per attributo) e cronologia completa in una lista separata.
+Ogni salvataggio scrive solo i campi cambiati e i nuovi turni con uno script Lua
+(EVALSHA, un solo round-trip) che prima confronta la versione del profilo.
+Ogni worker tiene una near-cache dei profili usati di recente (chiave: sessione + versione),
+invalidata via pub/sub quando un altro worker scrive la stessa sessione.
+"""
+import os
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from student_profile import StudentProfile, ProfileVersionConflict
+    from metrics import metrics
+    from turn_log import Turn, HISTORY_HOT_TURNS
+    import profile_codec
+except ImportError:
+    from .student_profile import StudentProfile, ProfileVersionConflict
+    from .metrics import metrics
+    from .turn_log import Turn, HISTORY_HOT_TURNS
+    from . import profile_codec
+
+# Redis è opzionale, solo se installato
+try:
+    import redis
+except ImportError:
+    redis = None
+
+HISTORY_FIELD = "history_tail"
+SCHEMA_FIELD = "_schema"
+VERSION_FIELD = "_version"
+CONFLICT = -1  # Risposta dello script di salvataggio se la versione in Redis è cambiata
+
+# Salvataggio atomico con compare-and-set sulla versione.
+# KEYS: hash del profilo, lista dei turni.
+# ARGV: campo versione, versione attesa, modalità (full|delta), primo seq della coda, TTL,
+# canale e messaggio di invalidazione ("" = nessuno), numero di campi cambiati e rimossi,
+# poi le coppie campo/valore, i campi rimossi e i turni. In modalità full l'hash viene
+# riscritto (versione esclusa) e si saltano i turni che la lista ha già.
+SAVE_SCRIPT = """
+local unpack = unpack or table.unpack  -- Lua 5.1 in Redis, 5.4 in fakeredis
+local version = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+if version ~= tonumber(ARGV[2]) then
+    return -1
+end
+local skip = 0
+if ARGV[3] == 'full' then
+    local total = tonumber(redis.call('HGET', KEYS[1], 'history_total') or '0') or 0
+    redis.call('DEL', KEYS[1])
+    if version > 0 then
+        redis.call('HSET', KEYS[1], ARGV[1], version)
+    end
+    if tonumber(ARGV[4]) == 0 then
+        redis.call('DEL', KEYS[2])
+    else
+        skip = math.max(total - tonumber(ARGV[4]), 0)
+    end
+end
+local i = 10
+local changed = tonumber(ARGV[8])
+if changed > 0 then
+    redis.call('HSET', KEYS[1], unpack(ARGV, i, i + 2 * changed - 1))
+end
+i = i + 2 * changed
+local removed = tonumber(ARGV[9])
+if removed > 0 then
+    redis.call('HDEL', KEYS[1], unpack(ARGV, i, i + removed - 1))
+end
+i = i + removed + skip
+if i <= #ARGV then
+    redis.call('RPUSH', KEYS[2], unpack(ARGV, i, #ARGV))
+end
+local new_version = redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+if ARGV[6] ~= '' then
+    redis.call('PUBLISH', ARGV[6], ARGV[7])
+end
+return new_version
+"""
+
+
+class RedisSessionStore:
+    """Profili come hash Redis + cronologia come lista, con scritture differenziali."""
+
+    # La lista Redis contiene tutti i turni: il profilo tiene solo la coda recente
+    keeps_full_history = True
+
+    def __init__(self, client=None, ttl_seconds: Optional[int] = None, key_prefix: str = "session:",
+                 delta_cache_sessions: Optional[int] = None, near_cache_size: Optional[int] = None,
+                 near_cache_ttl: Optional[float] = None):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("Pacchetto redis non installato")
+            client = redis.Redis(connection_pool=self._build_pool())
+        self.client = client
+        self._save_script = client.register_script(SAVE_SCRIPT)
+        self.ttl_seconds = ttl_seconds or int(os.getenv("SESSION_TTL_SECONDS", 3600))
+        self.key_prefix = key_prefix
+        self.delta_cache_sessions = delta_cache_sessions or int(os.getenv("REDIS_DELTA_CACHE_SESSIONS", 10000))
+
+        # Ultimo stato scritto/letto per sessione: campi codificati e turni totali in Redis
+        self._written: "OrderedDict[str, Tuple[Dict[str, str], int]]" = OrderedDict()
+
+        # Near-cache: session_id -> (versione, profilo, istante di verifica, scadenza della chiave).
+        # Oltre near_cache_ttl la voce viene riverificata con una sola HGET della versione;
+        # alla scadenza della chiave in Redis viene scartata (la sessione è scaduta).
+        self.near_cache_size = near_cache_size if near_cache_size is not None else \
+            int(os.getenv("REDIS_NEAR_CACHE_SIZE", 1000))
+        self.near_cache_ttl = near_cache_ttl if near_cache_ttl is not None else \
+            float(os.getenv("REDIS_NEAR_CACHE_TTL_SECONDS", 30))
+        self.invalidation_channel = f"{key_prefix}invalidate"
+        self.worker_id = uuid.uuid4().hex
+        self._near: "OrderedDict[str, Tuple[int, StudentProfile, float, float]]" = OrderedDict()
+        self._near_lock = threading.Lock()
+        self._generation = 0
+        self._invalidated: "OrderedDict[str, int]" = OrderedDict()  # session_id -> generazione
+        self._listener = None
+        if self.near_cache_size:
+            self._start_listener()
+
+    @staticmethod
+    def _build_pool():
+        """Pool di connessioni condiviso, configurato da REDIS_URL o REDIS_HOST/PORT/DB."""
+        max_connections = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+        options = {
+            "max_connections": max_connections,
+            "decode_responses": True,
+            "socket_timeout": float(os.getenv("REDIS_SOCKET_TIMEOUT", 2)),
+            "socket_connect_timeout": float(os.getenv("REDIS_SOCKET_TIMEOUT", 2)),
+            "health_check_interval": 30,
+        }
+        url = os.getenv("REDIS_URL")
+        if url:
+            return redis.ConnectionPool.from_url(url, **options)
+        return redis.ConnectionPool(
+            host=os.getenv("REDIS_HOST", "localhost"),
+            port=int(os.getenv("REDIS_PORT", 6379)),
+            db=int(os.getenv("REDIS_DB", 0)),
+            **options
+        )
+
+    def _start_listener(self) -> None:
+        """Sottoscrive il canale di invalidazione; senza pub/sub la near-cache resta spenta."""
+        try:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.invalidation_channel: self._on_invalidate})
+            self._listener = pubsub.run_in_thread(sleep_time=0.01, daemon=True)
+        except Exception as e:
+            print(f"⚠️  Pub/sub Redis non disponibile, near-cache disattivata: {e}")
+            self.near_cache_size = 0
+
+    def _on_invalidate(self, message: Dict[str, str]) -> None:
+        """Messaggio 'session_id|worker_id': scarta la voce se l'ha scritta un altro worker."""
+        session_id, _, worker_id = message["data"].partition("|")
+        if worker_id == self.worker_id:
+            return
+        with self._near_lock:
+            self._near.pop(session_id, None)
+            self._written.pop(session_id, None)
+            self._generation += 1
+            self._invalidated[session_id] = self._generation
+            self._invalidated.move_to_end(session_id)
+            while len(self._invalidated) > self.near_cache_size:
+                self._invalidated.popitem(last=False)
+        metrics.increment("redis_near_cache_invalidations")
+
+    def _cache_profile(self, session_id: str, version: int, profile: StudentProfile, expires_at: float,
+                       generation: Optional[int] = None) -> None:
+        """
+        Memorizza nella near-cache fino a expires_at (monotonic, scadenza della chiave in Redis),
+        a meno che la sessione sia stata invalidata dopo `generation`.
+        """
+        if not self.near_cache_size:
+            return
+        with self._near_lock:
+            if generation is not None and self._invalidated.get(session_id, 0) > generation:
+                return
+            self._near[session_id] = (version, profile, time.monotonic(), expires_at)
+            self._near.move_to_end(session_id)
+            while len(self._near) > self.near_cache_size:
+                self._near.popitem(last=False)
+
+    def _cached_profile(self, session_id: str) -> Optional[StudentProfile]:
+        """Profilo dalla near-cache; le voci vecchie sono riverificate sulla versione."""
+        if not self.near_cache_size:
+            return None
+        with self._near_lock:
+            entry = self._near.get(session_id)
+        metrics.increment("redis_near_cache_lookups")
+        if not entry:
+            return None
+
+        version, profile, checked_at, expires_at = entry
+        now = time.monotonic()
+        if now >= expires_at:
+            # Chiave già scaduta in Redis: la sessione non va riportata in vita
+            with self._near_lock:
+                self._near.pop(session_id, None)
+            return None
+        if now - checked_at > self.near_cache_ttl:
+            remote = self.client.hget(self._profile_key(session_id), VERSION_FIELD)
+            if remote is None or int(remote) != version:
+                with self._near_lock:
+                    self._near.pop(session_id, None)
+                return None
+            self._cache_profile(session_id, version, profile, expires_at)
+
+        metrics.increment("redis_near_cache_hits")
+        return profile
+
+    def _profile_key(self, session_id: str) -> str:
+        return f"{self.key_prefix}{session_id}"
+
+    def _history_key(self, session_id: str) -> str:
+        return f"{self.key_prefix}{session_id}:history"
+
+    @staticmethod
+    def _encode_fields(profile: StudentProfile) -> Dict[str, str]:
+        """Un valore JSON per ogni campo non vuoto del profilo, cronologia e versione escluse."""
+        fields = profile_codec.encode_fields(profile, exclude={HISTORY_FIELD, "version"})
+        fields[SCHEMA_FIELD] = str(profile_codec.SCHEMA_VERSION)
+        return fields
+
+    def _remember(self, session_id: str, fields: Dict[str, str], history_total: int) -> None:
+        with self._near_lock:
+            self._written[session_id] = (fields, history_total)
+            self._written.move_to_end(session_id)
+            while len(self._written) > self.delta_cache_sessions:
+                self._written.popitem(last=False)
+
+    def save(self, profile: StudentProfile) -> None:
+        """
+        Compare-and-set: scrive i campi cambiati e i nuovi turni solo se la versione in Redis
+        è ancora quella del profilo, altrimenti solleva ProfileVersionConflict con il profilo
+        corrente. Un solo round-trip: controllo e scritture nello stesso script Lua.
+        """
+        session_id = profile.session_id
+        fields = self._encode_fields(profile)
+        tail = profile.history_tail
+        first_seq = profile.history_total - len(tail)
+        known = self._written.get(session_id)
+
+        if known is None:
+            # Stato remoto sconosciuto: hash riscritto, lo script salta i turni che Redis ha già
+            mode = "full"
+            changed = fields
+            removed = []
+            new_turns = tail
+        else:
+            mode = "delta"
+            written_fields, written_total = known
+            changed = {name: value for name, value in fields.items() if written_fields.get(name) != value}
+            removed = [name for name in written_fields if name not in fields]
+            new_turns = tail[max(written_total - first_seq, 0):]
+
+        channel = self.invalidation_channel if self.near_cache_size else ""
+        args = [VERSION_FIELD, profile.version, mode, first_seq, self.ttl_seconds,
+                channel, f"{session_id}|{self.worker_id}", len(changed), len(removed)]
+        for name, value in changed.items():
+            args += [name, value]
+        args += removed
+        args += [json.dumps(turn, ensure_ascii=False) for turn in new_turns]
+
+        saved_at = time.monotonic()  # Lo script rinnova la scadenza della chiave a ttl_seconds
+        version = int(self._save_script(
+            keys=[self._profile_key(session_id), self._history_key(session_id)], args=args
+        ))
+        if version == CONFLICT:
+            self._conflict(session_id)
+
+        profile.version = version
+        self._remember(session_id, fields, profile.history_total)
+        self._cache_profile(session_id, profile.version, profile, saved_at + self.ttl_seconds)
+        metrics.increment("redis_session_writes")
+        metrics.observe("redis_fields_written", len(changed) + len(removed))
+
+    def _conflict(self, session_id: str) -> None:
+        """Scarta lo stato locale della sessione e solleva il conflitto con il profilo corrente."""
+        with self._near_lock:
+            self._near.pop(session_id, None)
+            self._written.pop(session_id, None)
+        raise ProfileVersionConflict(session_id, self._read(session_id))
+
+    def load(self, session_id: str) -> Optional[StudentProfile]:
+        """Near-cache, altrimenti hash e turni recenti in un solo round-trip."""
+        profile = self._cached_profile(session_id)
+        if profile is not None:
+            return profile
+        return self._read(session_id)
+
+    def _read(self, session_id: str) -> Optional[StudentProfile]:
+        """Legge il profilo da Redis (senza near-cache) e lo memorizza localmente."""
+        generation = self._generation
+        read_at = time.monotonic()
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hgetall(self._profile_key(session_id))
+        pipe.lrange(self._history_key(session_id), -HISTORY_HOT_TURNS, -1)
+        pipe.pttl(self._profile_key(session_id))
+        raw_fields, raw_tail, ttl_ms = pipe.execute()
+        if not raw_fields:
+            return None
+
+        tail = [json.loads(turn) for turn in raw_tail]
+        fields = dict(raw_fields)
+        profile_version = int(fields.pop(VERSION_FIELD, 0))
+        written_fields = dict(fields)
+        version = fields.pop(SCHEMA_FIELD, None)
+        if version is None:
+            # Hash scritto prima del codec versionato: validazione completa
+            data = {name: json.loads(value) for name, value in fields.items()}
+            data[HISTORY_FIELD] = tail
+            data["version"] = profile_version
+            profile = StudentProfile(**data)
+        else:
+            profile = profile_codec.decode_fields(
+                fields, int(version), extra={HISTORY_FIELD: tail, "version": profile_version}
+            )
+
+        self._remember(session_id, written_fields, profile.history_total)
+        # Senza scadenza (PTTL -1) la voce vale al più il TTL delle sessioni
+        expires_at = read_at + (ttl_ms / 1000 if ttl_ms and ttl_ms > 0 else self.ttl_seconds)
+        self._cache_profile(session_id, profile_version, profile, expires_at, generation)
+        return profile
+
+    def read_history(self, session_id: str, count: int) -> List[Turn]:
+        """I primi count turni della conversazione."""
+        raw = self.client.lrange(self._history_key(session_id), 0, count - 1)
+        return [Turn.create(*json.loads(turn)) for turn in raw]
+
+    def exists(self, session_id: str) -> bool:
+        if self._cached_profile(session_id) is not None:
+            return True
+        return self.client.exists(self._profile_key(session_id)) == 1
+
+    def delete(self, session_id: str) -> None:
+        with self._near_lock:
+            self._written.pop(session_id, None)
+            self._near.pop(session_id, None)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(self._profile_key(session_id), self._history_key(session_id))
+        if self.near_cache_size:
+            pipe.publish(self.invalidation_channel, f"{session_id}|{self.worker_id}")
+        pipe.execute()
+
+    def close(self) -> None:
+        """Ferma il thread di ascolto delle invalidazioni."""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
@@ -0,0 +1,166 @@
+"""
+Cache a due livelli per le ricerche web: LRU in memoria + SQLite su disco (data/cache).
+Le chiavi sono la query normalizzata, la regione e il numero di risultati; le voci
+scadono dopo un TTL configurabile e sopravvivono ai riavvii del backend.
+Il database viene aperto al primo utilizzo, non all'import del modulo.
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from metrics import metrics
+except ImportError:
+    from .metrics import metrics
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'data')
+
+metrics.register_ratio("search_cache_hit_rate", "search_cache_hits", "search_cache_lookups")
+
+
+class SearchCache:
+    """Cache LRU in-process davanti a una tabella SQLite con scadenza."""
+
+    def __init__(self, db_path: Optional[str] = None, ttl_seconds: Optional[float] = None,
+                 memory_items: Optional[int] = None, max_rows: Optional[int] = None):
+        cache_dir = os.getenv("CACHE_DIR", os.path.join(DATA_DIR, 'cache'))
+        self.db_path = db_path or os.path.join(cache_dir, 'search_cache.sqlite3')
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else \
+            float(os.getenv("CACHE_DURATION_HOURS", 24)) * 3600
+        # memory_items=0 disattiva il livello in memoria
+        self.memory_items = memory_items if memory_items is not None else \
+            int(os.getenv("SEARCH_CACHE_MEMORY_ITEMS", 512))
+        self.max_rows = max_rows or int(os.getenv("SEARCH_CACHE_MAX_ROWS", 50000))
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Tuple[float, List[Dict[str, str]]]]" = OrderedDict()
+        self._writes_since_prune = 0
+        self._db: Optional[sqlite3.Connection] = None
+        self._opened = False
+
+    def _database(self) -> Optional[sqlite3.Connection]:
+        """Apre il database al primo utilizzo (da chiamare col lock); None se non disponibile."""
+        if self._opened:
+            return self._db
+        self._opened = True
+        try:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache ("
+                " key TEXT PRIMARY KEY, query TEXT, results TEXT, expires_at REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_search_cache_expires ON search_cache(expires_at)")
+            self._db.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️  Cache ricerche su disco non disponibile, uso solo memoria: {e}")
+            self._db = None
+        return self._db
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """Normalizza la query: minuscolo e spazi compattati."""
+        return re.sub(r"\s+", " ", query.strip().lower())
+
+    def make_key(self, query: str, region: str, max_results: int) -> str:
+        """Chiave di cache per (query normalizzata, regione, max_results)."""
+        raw = f"{self.normalize_query(query)}|{region}|{max_results}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, query: str, region: str, max_results: int) -> Optional[List[Dict[str, str]]]:
+        """Restituisce i risultati in cache, o None se assenti o scaduti."""
+        key = self.make_key(query, region, max_results)
+        now = time.time()
+        metrics.increment("search_cache_lookups")
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry:
+                expires_at, results = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    metrics.increment("search_cache_hits")
+                    metrics.increment("search_cache_memory_hits")
+                    return results
+                del self._memory[key]
+
+            if self._database() is None:
+                return None
+
+            try:
+                row = self._db.execute(
+                    "SELECT results, expires_at FROM search_cache WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                print(f"⚠️  Errore lettura cache ricerche: {e}")
+                return None
+
+            if not row or row[1] <= now:
+                return None
+
+            results = json.loads(row[0])
+            self._remember(key, row[1], results)
+            metrics.increment("search_cache_hits")
+            metrics.increment("search_cache_disk_hits")
+            return results
+
+    def set(self, query: str, region: str, max_results: int, results: List[Dict[str, str]]) -> None:
+        """Salva i risultati nei due livelli di cache."""
+        key = self.make_key(query, region, max_results)
+        expires_at = time.time() + self.ttl_seconds
+
+        with self._lock:
+            self._remember(key, expires_at, results)
+
+            if self._database() is None:
+                return
+
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO search_cache (key, query, results, expires_at) VALUES (?, ?, ?, ?)",
+                    (key, self.normalize_query(query), json.dumps(results, ensure_ascii=False), expires_at)
+                )
+                self._db.commit()
+                self._writes_since_prune += 1
+                if self._writes_since_prune >= 100:
+                    self._prune()
+            except sqlite3.Error as e:
+                print(f"⚠️  Errore scrittura cache ricerche: {e}")
+
+    def _remember(self, key: str, expires_at: float, results: List[Dict[str, str]]) -> None:
+        """Inserisce nel livello in memoria rispettando la dimensione massima."""
+        self._memory[key] = (expires_at, results)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _prune(self) -> None:
+        """Rimuove le voci scadute e le più vecchie oltre max_rows (da chiamare col lock)."""
+        self._writes_since_prune = 0
+        self._db.execute("DELETE FROM search_cache WHERE expires_at <= ?", (time.time(),))
+        self._db.execute(
+            "DELETE FROM search_cache WHERE key IN ("
+            " SELECT key FROM search_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_rows,)
+        )
+        self._db.commit()
+
+    def clear(self) -> None:
+        """Svuota entrambi i livelli."""
+        with self._lock:
+            self._memory.clear()
+            if self._database() is not None:
+                self._db.execute("DELETE FROM search_cache")
+                self._db.commit()
+
+
+# Istanza globale
+search_cache = SearchCache()
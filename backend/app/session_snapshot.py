@@ -0,0 +1,146 @@
+"""
+Snapshot su file delle sessioni in memoria, per riprendere le conversazioni dopo un riavvio.
+Il file contiene i profili codificati (profile_codec) uno dopo l'altro, seguiti da un indice
+ordinato a larghezza fissa (session_id, offset, lunghezza, last_updated) e da un footer.
+All'avvio il file viene solo mappato in memoria: ogni profilo è decodificato quando la sua
+sessione viene richiesta, con una ricerca binaria sull'indice.
+"""
+import os
+import mmap
+import struct
+from typing import Iterable, Iterator, Optional, Set, Tuple
+
+try:
+    from student_profile import StudentProfile
+    import profile_codec
+except ImportError:
+    from .student_profile import StudentProfile
+    from . import profile_codec
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'data')
+
+MAGIC = b"SSNP"
+FORMAT_VERSION = 1
+SID_SIZE = 36  # UUID testuale
+HEADER = struct.Struct("<4sHH")  # magic, versione formato, riservato
+INDEX_ENTRY = struct.Struct(f"<{SID_SIZE}sQId")  # session_id, offset, lunghezza, last_updated
+FOOTER = struct.Struct("<QI4s")  # offset dell'indice, numero di voci, magic
+
+# Record da scrivere: (session_id, last_updated epoch, profilo codificato)
+SnapshotRecord = Tuple[str, float, bytes]
+
+
+def write_snapshot(path: str, records: Iterable[SnapshotRecord]) -> int:
+    """Scrive lo snapshot in modo atomico (file temporaneo + rename); restituisce le sessioni scritte."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    entries = []
+
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0))
+        offset = HEADER.size
+        for session_id, last_updated, blob in records:
+            key = session_id.encode("ascii", errors="ignore")
+            if len(key) != len(session_id) or len(key) > SID_SIZE:
+                continue  # non indicizzabile a larghezza fissa
+            f.write(blob)
+            entries.append((key.ljust(SID_SIZE, b"\0"), offset, len(blob), last_updated))
+            offset += len(blob)
+
+        entries.sort()
+        for entry in entries:
+            f.write(INDEX_ENTRY.pack(*entry))
+        f.write(FOOTER.pack(offset, len(entries), MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+    return len(entries)
+
+
+class SessionSnapshot:
+    """Snapshot mappato in memoria con ricerca binaria; ogni sessione si ripristina una volta sola."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError("snapshot vuoto")
+
+        magic, version, _ = HEADER.unpack_from(self._mm, 0)
+        self.index_offset, self.count, footer_magic = FOOTER.unpack_from(self._mm, len(self._mm) - FOOTER.size)
+        if magic != MAGIC or footer_magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError("formato snapshot non riconosciuto")
+        if self.index_offset + self.count * INDEX_ENTRY.size + FOOTER.size != len(self._mm):
+            self.close()
+            raise ValueError("snapshot troncato")
+
+        self._consumed: Set[str] = set()
+
+    @classmethod
+    def open(cls, path: str) -> Optional["SessionSnapshot"]:
+        """Apre lo snapshot se esiste ed è valido, altrimenti None."""
+        if not os.path.exists(path):
+            return None
+        try:
+            return cls(path)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"⚠️  Snapshot sessioni ignorato ({path}): {e}")
+            return None
+
+    def _entry(self, position: int) -> Tuple[bytes, int, int, float]:
+        return INDEX_ENTRY.unpack_from(self._mm, self.index_offset + position * INDEX_ENTRY.size)
+
+    def _find(self, session_id: str) -> Optional[Tuple[int, int, float]]:
+        """Ricerca binaria sull'indice: (offset, lunghezza, last_updated) o None."""
+        if session_id in self._consumed:
+            return None
+        key = session_id.encode("ascii", errors="ignore").ljust(SID_SIZE, b"\0")
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            start = self.index_offset + middle * INDEX_ENTRY.size
+            current = self._mm[start:start + SID_SIZE]
+            if current < key:
+                low = middle + 1
+            elif current > key:
+                high = middle
+            else:
+                _, offset, length, last_updated = self._entry(middle)
+                return offset, length, last_updated
+        return None
+
+    def __contains__(self, session_id: str) -> bool:
+        return self._find(session_id) is not None
+
+    def last_updated(self, session_id: str) -> Optional[float]:
+        found = self._find(session_id)
+        return found[2] if found else None
+
+    def take(self, session_id: str) -> Optional[StudentProfile]:
+        """Decodifica la sessione e la segna come ripristinata."""
+        found = self._find(session_id)
+        if not found:
+            return None
+        offset, length, _ = found
+        self._consumed.add(session_id)
+        return profile_codec.decode(self._mm[offset:offset + length])
+
+    def discard(self, session_id: str) -> None:
+        self._consumed.add(session_id)
+
+    def remaining(self) -> Iterator[SnapshotRecord]:
+        """Sessioni non ancora ripristinate, nel formato di write_snapshot."""
+        for position in range(self.count):
+            key, offset, length, last_updated = self._entry(position)
+            session_id = key.rstrip(b"\0").decode("ascii")
+            if session_id not in self._consumed:
+                yield session_id, last_updated, self._mm[offset:offset + length]
+
+    def close(self) -> None:
+        self._mm.close()
+        self._file.close()
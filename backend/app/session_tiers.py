@@ -0,0 +1,150 @@
+"""
+Livelli di memoria per le sessioni inattive.
+warm: profilo codificato (profile_codec) e compresso con zlib, in RAM entro un budget in byte;
+cold: stesso formato in una tabella SQLite di appoggio (data/sqlite), oltre il budget.
+Il livello hot (oggetti StudentProfile) resta in StateManager.sessions.
+"""
+import os
+import zlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Iterator, Optional, Tuple
+
+try:
+    from student_profile import StudentProfile
+    from metrics import metrics
+    import profile_codec
+except ImportError:
+    from .student_profile import StudentProfile
+    from .metrics import metrics
+    from . import profile_codec
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'data')
+
+
+class SessionTiers:
+    """Sessioni ibernate: LRU compresso in memoria con travaso su disco."""
+
+    def __init__(self, db_path: Optional[str] = None, warm_max_bytes: Optional[int] = None,
+                 compression_level: int = 6):
+        self.db_path = db_path or os.getenv("HIBERNATE_DB_PATH", os.path.join(DATA_DIR, 'sqlite', 'hibernated.sqlite3'))
+        self.warm_max_bytes = warm_max_bytes or int(float(os.getenv("SESSION_WARM_MAX_MB", 64)) * 1024 * 1024)
+        self.compression_level = compression_level
+
+        self._warm: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self.warm_bytes = 0
+        self.cold_count = 0
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Apre la tabella di appoggio alla prima ibernazione su disco. Il contenuto
+        precedente viene scartato: allo spegnimento le sessioni finiscono nello snapshot.
+        """
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=OFF")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS hibernated ("
+                " session_id TEXT PRIMARY KEY, last_updated REAL NOT NULL, data BLOB NOT NULL) WITHOUT ROWID"
+            )
+            self._db.execute("DELETE FROM hibernated")
+            self._db.commit()
+        return self._db
+
+    def __len__(self) -> int:
+        return len(self._warm) + self.cold_count
+
+    def _update_gauges(self) -> None:
+        metrics.set_gauge("sessions_warm", len(self._warm))
+        metrics.set_gauge("sessions_warm_bytes", self.warm_bytes)
+        metrics.set_gauge("sessions_cold", self.cold_count)
+
+    def put(self, profile: StudentProfile) -> None:
+        """Iberna un profilo nel livello warm, spostando su disco i più vecchi oltre il budget."""
+        blob = zlib.compress(profile_codec.encode(profile), self.compression_level)
+        with self._lock:
+            previous = self._warm.pop(profile.session_id, None)
+            if previous:
+                self.warm_bytes -= len(previous[1])
+            self._warm[profile.session_id] = (profile.last_updated.timestamp(), blob)
+            self.warm_bytes += len(blob)
+
+            overflow = []
+            while self.warm_bytes > self.warm_max_bytes and len(self._warm) > 1:
+                session_id, (last_updated, old_blob) = self._warm.popitem(last=False)
+                self.warm_bytes -= len(old_blob)
+                overflow.append((session_id, last_updated, old_blob))
+
+            if overflow:
+                db = self._connect()
+                with db:
+                    db.executemany(
+                        "INSERT OR REPLACE INTO hibernated (session_id, last_updated, data) VALUES (?, ?, ?)",
+                        overflow
+                    )
+                self.cold_count += len(overflow)
+                metrics.increment("sessions_demoted_cold", len(overflow))
+            self._update_gauges()
+        metrics.increment("sessions_demoted_warm")
+
+    def _pop(self, session_id: str) -> Optional[Tuple[str, bytes]]:
+        """Rimuove la sessione da warm o cold: (livello, blob compresso) o None (col lock)."""
+        entry = self._warm.pop(session_id, None)
+        if entry:
+            self.warm_bytes -= len(entry[1])
+            return "warm", entry[1]
+        if not self.cold_count:
+            return None
+
+        db = self._connect()
+        row = db.execute("SELECT data FROM hibernated WHERE session_id = ?", (session_id,)).fetchone()
+        if not row:
+            return None
+        with db:
+            db.execute("DELETE FROM hibernated WHERE session_id = ?", (session_id,))
+        self.cold_count -= 1
+        return "cold", row[0]
+
+    def take(self, session_id: str) -> Optional[Tuple[StudentProfile, str]]:
+        """Risveglia una sessione ibernata: (profilo, livello di provenienza) o None."""
+        with self._lock:
+            found = self._pop(session_id)
+            self._update_gauges()
+        if not found:
+            return None
+        tier, blob = found
+        return profile_codec.decode(zlib.decompress(blob)), tier
+
+    def discard(self, session_id: str) -> bool:
+        """Elimina la sessione ibernata; True se era presente."""
+        with self._lock:
+            found = self._pop(session_id)
+            self._update_gauges()
+        return found is not None
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            if session_id in self._warm:
+                return True
+            if not self.cold_count:
+                return False
+            return self._connect().execute(
+                "SELECT 1 FROM hibernated WHERE session_id = ?", (session_id,)
+            ).fetchone() is not None
+
+    def records(self) -> Iterator[Tuple[str, float, bytes]]:
+        """Tutte le sessioni ibernate come (session_id, last_updated, profilo codificato)."""
+        with self._lock:
+            warm = list(self._warm.items())
+        for session_id, (last_updated, blob) in warm:
+            yield session_id, last_updated, zlib.decompress(blob)
+        if self.cold_count:
+            with self._lock:
+                rows = self._connect().execute("SELECT session_id, last_updated, data FROM hibernated").fetchall()
+            for session_id, last_updated, blob in rows:
+                yield session_id, last_updated, zlib.decompress(blob)
@@ -0,0 +1,219 @@
+"""
+Backend SQLite per le sessioni (data/sqlite), in modalità WAL con scrittura differita.
+I salvataggi finiscono in una coda di profili "sporchi" che un thread in background
+scrive su disco a lotti ogni N millisecondi: il percorso della chat non attende mai l'fsync.
+Le letture sono servite da un working set in memoria di dimensione limitata, che fa anche
+da riferimento per il compare-and-set sulla versione del profilo (solo nel processo).
+Le sessioni inattive da SESSION_TTL_SECONDS (colonna last_updated, indicizzata) vengono
+eliminate a ogni flush, al più SESSION_SWEEP_SLICE alla volta, con i turni archiviati.
+"""
+import os
+import time
+import atexit
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+try:
+    from student_profile import StudentProfile, ProfileVersionConflict
+    from metrics import metrics
+    from turn_log import TurnArchive, turn_archive
+    import profile_codec
+except ImportError:
+    from .student_profile import StudentProfile, ProfileVersionConflict
+    from .metrics import metrics
+    from .turn_log import TurnArchive, turn_archive
+    from . import profile_codec
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'data')
+
+
+class SQLiteSessionStore:
+    """Profili serializzati in una tabella SQLite, con coda write-behind e working set LRU."""
+
+    def __init__(self, db_path: Optional[str] = None, flush_interval_ms: Optional[int] = None,
+                 working_set_size: Optional[int] = None, ttl_seconds: Optional[int] = None,
+                 archive: Optional[TurnArchive] = None):
+        self.db_path = db_path or os.getenv("SESSION_DB_PATH", os.path.join(DATA_DIR, 'sqlite', 'sessions.sqlite3'))
+        self.flush_interval = (flush_interval_ms or int(os.getenv("SESSION_FLUSH_INTERVAL_MS", 200))) / 1000
+        self.working_set_size = working_set_size or int(os.getenv("SESSION_WORKING_SET_SIZE", 2000))
+        self.ttl_seconds = ttl_seconds or int(os.getenv("SESSION_TTL_SECONDS", 3600))
+        self.expire_slice = int(os.getenv("SESSION_SWEEP_SLICE", 200))
+        self.archive = archive or turn_archive  # Turni vecchi delle sessioni, eliminati alla scadenza
+
+        self._lock = threading.Lock()
+        self._working_set: "OrderedDict[str, StudentProfile]" = OrderedDict()
+        # session_id -> (snapshot profile_codec, last_updated epoch) da scrivere
+        self._dirty: Dict[str, Tuple[bytes, float]] = {}
+        self._deleted: Set[str] = set()
+
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db_lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY, data BLOB NOT NULL, last_updated REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_last_updated ON sessions (last_updated)")
+        self._db.commit()
+
+        self._stop = threading.Event()
+        self._writer = threading.Thread(target=self._flush_loop, name="session-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _cache(self, profile: StudentProfile) -> None:
+        """Inserisce nel working set rispettando la dimensione massima (da chiamare col lock)."""
+        self._working_set[profile.session_id] = profile
+        self._working_set.move_to_end(profile.session_id)
+        while len(self._working_set) > self.working_set_size:
+            self._working_set.popitem(last=False)
+
+    def check_version(self, profile: StudentProfile) -> None:
+        """Solleva ProfileVersionConflict se il working set ha una versione diversa del profilo."""
+        with self._lock:
+            current = self._working_set.get(profile.session_id)
+        if current is not None and current.version != profile.version:
+            raise ProfileVersionConflict(profile.session_id, current)
+
+    def save(self, profile: StudentProfile) -> None:
+        """Compare-and-set sul working set, poi accoda uno snapshot per la scrittura differita."""
+        with self._lock:
+            current = self._working_set.get(profile.session_id)
+            if current is not None and current.version != profile.version:
+                raise ProfileVersionConflict(profile.session_id, current)
+            profile.version += 1
+        snapshot = profile_codec.encode(profile)
+        with self._lock:
+            self._cache(profile)
+            self._dirty[profile.session_id] = (snapshot, profile.last_updated.timestamp())
+            self._deleted.discard(profile.session_id)
+        metrics.set_gauge("sqlite_dirty_sessions", len(self._dirty))
+
+    def load(self, session_id: str) -> Optional[StudentProfile]:
+        """Working set, poi snapshot non ancora scritti, poi disco."""
+        with self._lock:
+            if session_id in self._deleted:
+                return None
+            profile = self._working_set.get(session_id)
+            if profile is not None:
+                self._working_set.move_to_end(session_id)
+                metrics.increment("sqlite_working_set_hits")
+                return profile
+            pending = self._dirty.get(session_id)
+        snapshot = pending[0] if pending else None
+
+        if snapshot is None:
+            with self._db_lock:
+                row = self._db.execute("SELECT data FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if not row:
+                return None
+            snapshot = row[0]
+            metrics.increment("sqlite_disk_reads")
+
+        profile = profile_codec.decode(snapshot)
+        with self._lock:
+            self._cache(profile)
+        return profile
+
+    def exists(self, session_id: str) -> bool:
+        with self._lock:
+            if session_id in self._deleted:
+                return False
+            if session_id in self._working_set or session_id in self._dirty:
+                return True
+        with self._db_lock:
+            return self._db.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone() is not None
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._working_set.pop(session_id, None)
+            self._dirty.pop(session_id, None)
+            self._deleted.add(session_id)
+
+    def flush(self) -> int:
+        """
+        Scrive in un'unica transazione tutti gli snapshot e le cancellazioni in coda,
+        poi elimina un blocco di sessioni scadute. Restituisce le righe scritte o cancellate.
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            deleted, self._deleted = self._deleted, set()
+        metrics.set_gauge("sqlite_dirty_sessions", 0)
+        if not dirty and not deleted:
+            self.expire()
+            return 0
+
+        start = time.perf_counter()
+        try:
+            with self._db_lock, self._db:
+                if dirty:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO sessions (session_id, data, last_updated) VALUES (?, ?, ?)",
+                        [(session_id, snapshot, ts) for session_id, (snapshot, ts) in dirty.items()]
+                    )
+                if deleted:
+                    self._db.executemany("DELETE FROM sessions WHERE session_id = ?", [(sid,) for sid in deleted])
+        except sqlite3.Error as e:
+            print(f"⚠️  Errore scrittura sessioni su SQLite, riprovo al prossimo giro: {e}")
+            with self._lock:
+                # Rimette in coda senza sovrascrivere snapshot più recenti
+                for session_id, entry in dirty.items():
+                    if session_id not in self._deleted:
+                        self._dirty.setdefault(session_id, entry)
+                self._deleted |= {sid for sid in deleted if sid not in self._dirty}
+            return 0
+
+        metrics.increment("sqlite_flushes")
+        metrics.observe("sqlite_flush_batch_size", len(dirty) + len(deleted))
+        metrics.observe("sqlite_flush_seconds", time.perf_counter() - start)
+        self.expire()
+        return len(dirty) + len(deleted)
+
+    def expire(self) -> List[str]:
+        """
+        Elimina al più expire_slice sessioni non aggiornate da ttl_seconds, con i loro
+        turni archiviati. Le sessioni con uno snapshot ancora in coda vengono risparmiate.
+        """
+        cutoff = time.time() - self.ttl_seconds
+        try:
+            with self._db_lock:
+                rows = self._db.execute(
+                    "SELECT session_id FROM sessions WHERE last_updated < ? ORDER BY last_updated LIMIT ?",
+                    (cutoff, self.expire_slice)
+                ).fetchall()
+            if not rows:
+                return []
+            with self._lock:
+                expired = [sid for (sid,) in rows if sid not in self._dirty]
+                for session_id in expired:
+                    self._working_set.pop(session_id, None)
+            with self._db_lock, self._db:
+                self._db.executemany(
+                    "DELETE FROM sessions WHERE session_id = ? AND last_updated < ?",
+                    [(sid, cutoff) for sid in expired]
+                )
+            for session_id in expired:
+                self.archive.delete(session_id)
+        except sqlite3.Error as e:
+            print(f"⚠️  Errore eliminazione sessioni scadute su SQLite: {e}")
+            return []
+
+        if expired:
+            metrics.increment("sessions_expired", len(expired))
+        return expired
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self) -> None:
+        """Ferma il thread di scrittura e svuota la coda (idempotente)."""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._writer.join(timeout=5)
+        self.flush()
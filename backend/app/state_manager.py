@@ -2,38 +2,134 @@
 Gestore dello stato delle sessioni degli studenti.
 Mantiene i profili attivi in memoria o in cache.
 """
-from typing import Dict, Optional
-import json
-from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple, AsyncIterator
+from collections import OrderedDict
+from itertools import islice
+from contextlib import asynccontextmanager
+import asyncio
+import heapq
+import sqlite3
+import time
 import os
 
 try:
-    from student_profile import StudentProfile
+    from student_profile import StudentProfile, ProfileVersionConflict
+    from metrics import metrics
+    from turn_log import Turn, turn_archive, HISTORY_HOT_TURNS, HISTORY_SPILL_BATCH
+    from session_snapshot import SessionSnapshot, write_snapshot, DATA_DIR
+    from session_tiers import SessionTiers
+    import profile_codec
 except ImportError:
-    from .student_profile import StudentProfile
+    from .student_profile import StudentProfile, ProfileVersionConflict
+    from .metrics import metrics
+    from .turn_log import Turn, turn_archive, HISTORY_HOT_TURNS, HISTORY_SPILL_BATCH
+    from .session_snapshot import SessionSnapshot, write_snapshot, DATA_DIR
+    from .session_tiers import SessionTiers
+    from . import profile_codec
+
+
+class SessionBusyError(Exception):
+    """Troppi turni in coda per la stessa sessione."""
+
+
+class SessionTurnTimeout(Exception):
+    """Il turno precedente della sessione non si è concluso entro il tempo massimo."""
 
 
 class StateManager:
     """Gestisce lo stato delle sessioni degli studenti."""
     
-    def __init__(self, use_redis: bool = False):
-        self.use_redis = use_redis
-        self.sessions: Dict[str, StudentProfile] = {}
+    def __init__(self, use_redis: bool = False, backend: Optional[str] = None):
+        self.backend = backend or ("redis" if use_redis else "memory")
+        # Sessioni attive (livello hot) in ordine LRU (le più recenti in fondo).
+        # Quelle inattive da SESSION_IDLE_MINUTES, o oltre SESSION_MAX_ACTIVE, vengono
+        # ibernate compresse (warm in RAM, cold su disco) e risvegliate alla richiesta.
+        self.sessions: "OrderedDict[str, StudentProfile]" = OrderedDict()
+        self.tiers = SessionTiers()
+        self.idle_seconds = float(os.getenv("SESSION_IDLE_MINUTES", 10)) * 60
+        
+        # Scadenza per inattività (last_updated + ttl) e limite di sessioni in memoria.
+        # Il min-heap ha di norma una voce per sessione: se la scadenza è stata posticipata
+        # la voce viene reinserita quando arriva in cima (cancellazione pigra).
+        self.session_ttl = float(os.getenv("SESSION_TTL_SECONDS", 3600))
+        self.max_sessions = int(os.getenv("SESSION_MAX_ACTIVE", 10000))
+        self.sweep_interval = float(os.getenv("SESSION_SWEEP_INTERVAL_SECONDS", 5))
+        self.sweep_slice = int(os.getenv("SESSION_SWEEP_SLICE", 200))
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._deadlines: Dict[str, float] = {}
         
-        if use_redis:
+        # Snapshot delle sessioni in memoria per il riavvio (caricato in modo pigro)
+        self.snapshot_path = os.getenv("SESSION_SNAPSHOT_PATH", os.path.join(DATA_DIR, 'snapshots', 'sessions.snap'))
+        self.drain_timeout = float(os.getenv("SESSION_DRAIN_TIMEOUT_SECONDS", 10))
+        self.snapshot: Optional[SessionSnapshot] = None
+        
+        # Serializzazione dei turni per sessione (solo sessioni con turni in corso)
+        self.max_pending_turns = int(os.getenv("SESSION_MAX_PENDING_TURNS", 2))
+        self.turn_timeout = float(os.getenv("SESSION_TURN_TIMEOUT_SECONDS", 30))
+        self._turn_locks: Dict[str, asyncio.Lock] = {}
+        self._turn_pending: Dict[str, int] = {}
+        
+        # Compare-and-set sulla versione del profilo: tentativi di unione dopo un conflitto
+        self.cas_max_retries = int(os.getenv("SESSION_CAS_MAX_RETRIES", 3))
+        
+        # Archivio persistente opzionale (Redis o SQLite), con fallback in memoria
+        self.store = None
+        if self.backend == "redis":
             # Redis è opzionale, solo se installato
             try:
-                import redis
-                redis_host = os.getenv("REDIS_HOST", "localhost")
-                redis_port = int(os.getenv("REDIS_PORT", 6379))
-                self.redis_client = redis.Redis(host=redis_host, port=redis_port, decode_responses=True)
+                try:
+                    from redis_store import RedisSessionStore
+                except ImportError:
+                    from .redis_store import RedisSessionStore
+                self.store = RedisSessionStore()
                 print("✅ Redis abilitato per la gestione delle sessioni")
-            except ImportError:
+            except RuntimeError:
                 print("⚠️  Redis non installato, uso memoria in-RAM")
-                self.use_redis = False
-                self.redis_client = None
-        else:
-            self.redis_client = None
+                self.backend = "memory"
+        elif self.backend == "sqlite":
+            try:
+                try:
+                    from sqlite_store import SQLiteSessionStore
+                except ImportError:
+                    from .sqlite_store import SQLiteSessionStore
+                self.store = SQLiteSessionStore()
+                print(f"✅ SQLite abilitato per la gestione delle sessioni ({self.store.db_path})")
+            except Exception as e:
+                print(f"⚠️  SQLite non disponibile ({e}), uso memoria in-RAM")
+                self.backend = "memory"
+        self.use_redis = self.backend == "redis"
+    
+    def turn_queue_full(self, session_id: str) -> bool:
+        """True se oltre al turno in corso ci sono già max_pending_turns turni in attesa."""
+        return self._turn_pending.get(session_id, 0) > self.max_pending_turns
+    
+    @asynccontextmanager
+    async def session_turn(self, session_id: str) -> AsyncIterator[None]:
+        """
+        Esegue un turno in mutua esclusione con gli altri turni della stessa sessione,
+        nell'ordine di arrivo. Le sessioni diverse non si bloccano a vicenda.
+        Solleva SessionBusyError se la coda è piena e SessionTurnTimeout se l'attesa
+        supera turn_timeout.
+        """
+        if self.turn_queue_full(session_id):
+            raise SessionBusyError(session_id)
+        
+        lock = self._turn_locks.setdefault(session_id, asyncio.Lock())
+        self._turn_pending[session_id] = self._turn_pending.get(session_id, 0) + 1
+        try:
+            try:
+                await asyncio.wait_for(lock.acquire(), timeout=self.turn_timeout)
+            except asyncio.TimeoutError:
+                raise SessionTurnTimeout(session_id)
+            try:
+                yield
+            finally:
+                lock.release()
+        finally:
+            self._turn_pending[session_id] -= 1
+            if self._turn_pending[session_id] == 0:
+                del self._turn_pending[session_id]
+                del self._turn_locks[session_id]
     
     def create_session(self) -> StudentProfile:
         """Crea una nuova sessione con profilo studente vuoto."""
@@ -43,85 +139,384 @@ class StateManager:
     
     def get_session(self, session_id: str) -> Optional[StudentProfile]:
         """Recupera una sessione per ID."""
-        if self.use_redis and self.redis_client:
+        if self.store:
             try:
-                profile_data = self.redis_client.get(f"session:{session_id}")
-                if profile_data:
-                    return StudentProfile(**json.loads(profile_data))
-            except Exception:
+                profile = self.store.load(session_id)
+                if profile:
+                    return profile
+            except Exception as e:
                 # Fallback a memoria se Redis fallisce
-                pass
+                print(f"⚠️  Errore lettura sessione ({self.backend}): {e}")
         
         # Fallback a memoria
-        return self.sessions.get(session_id)
+        profile = self.sessions.get(session_id)
+        if profile is not None:
+            self.sessions.move_to_end(session_id)
+            return profile
+        return self._rehydrate(session_id) or self._restore_from_snapshot(session_id)
     
     def update_session(self, session_id: str, profile: StudentProfile) -> bool:
-        """Aggiorna una sessione esistente."""
+        """
+        Aggiorna una sessione esistente con compare-and-set sulla versione del profilo.
+        Se un altro worker l'ha salvata nel frattempo, le sue modifiche vengono unite
+        a quelle locali (merge_concurrent) e il salvataggio viene ritentato.
+        """
+        for _ in range(self.cas_max_retries + 1):
+            try:
+                self._store_session(session_id, profile)
+            except ProfileVersionConflict as conflict:
+                metrics.increment("session_version_conflicts")
+                if conflict.latest is None:
+                    profile.version = 0  # Sessione scaduta nell'archivio: viene riscritta
+                else:
+                    profile.merge_concurrent(conflict.latest)
+                    metrics.increment("session_conflict_merges")
+                continue
+            except Exception:
+                return False
+            profile.mark_clean()
+            return True
+        
+        metrics.increment("session_conflict_failures")
+        print(f"⚠️  Sessione {session_id[:8]} aggiornata in concorrenza, salvataggio rinunciato")
+        return False
+    
+    def compare_and_set(self, session_id: str, profile: StudentProfile) -> bool:
+        """
+        Salva il profilo solo se nessuno ha scritto la sessione dopo la sua lettura, senza
+        unione né nuovi tentativi: False in caso di conflitto (il chiamante rilegge e decide).
+        """
         try:
             self._store_session(session_id, profile)
-            return True
+        except ProfileVersionConflict:
+            metrics.increment("session_version_conflicts")
+            return False
         except Exception:
             return False
+        profile.mark_clean()
+        return True
     
     def _store_session(self, session_id: str, profile: StudentProfile) -> None:
         """Archivia il profilo nella memoria appropriata."""
-        if self.use_redis and self.redis_client:
+        if self.store:
             try:
-                profile_data = json.dumps(profile.model_dump())
-                self.redis_client.setex(
-                    f"session:{session_id}", 
-                    timedelta(hours=1), 
-                    profile_data
-                )
+                if getattr(self.store, "keeps_full_history", False):
+                    # L'archivio conserva già tutta la cronologia: basta accorciare la coda
+                    self.store.save(profile)
+                    self._spill_history(profile, archive=False)
+                else:
+                    if hasattr(self.store, "check_version"):
+                        # Prima di archiviare i turni vecchi, che dipendono dalla versione
+                        self.store.check_version(profile)
+                    self._spill_history(profile)
+                    self.store.save(profile)
                 return
-            except Exception:
+            except ProfileVersionConflict:
+                raise
+            except Exception as e:
                 # Fallback a memoria
-                pass
+                print(f"⚠️  Errore scrittura sessione ({self.backend}): {e}")
         
-        # Salva in memoria (default)
+        # Salva in memoria (default), con lo stesso controllo di versione
+        # (inserimenti da ibernazione o snapshot non cambiano la versione)
+        stored = self.sessions.get(session_id)
+        if stored is not None:
+            if stored.version != profile.version:
+                raise ProfileVersionConflict(session_id, stored)
+            profile.version += 1
+        else:
+            # Il profilo torna hot: un'eventuale copia ibernata è ormai superata
+            self.tiers.discard(session_id)
+        self._spill_history(profile)
         self.sessions[session_id] = profile
+        self.sessions.move_to_end(session_id)
+        self._schedule_expiry(session_id, profile)
+        
+        # Limite di dimensione: le sessioni usate meno di recente vengono ibernate,
+        # tranne quelle con un turno in corso (riprovate al prossimo salvataggio)
+        while len(self.sessions) > self.max_sessions:
+            oldest_id = next((sid for sid in self.sessions if sid not in self._turn_pending), None)
+            if oldest_id is None:
+                break
+            self._hibernate(oldest_id)
+            metrics.increment("sessions_evicted_lru")
+        metrics.set_gauge("sessions_hot", len(self.sessions))
+    
+    def _hibernate(self, session_id: str) -> None:
+        """Sposta una sessione dal livello hot a quello compresso."""
+        profile = self.sessions.pop(session_id)
+        self.tiers.put(profile)
+    
+    def hibernate_idle(self, max_items: Optional[int] = None) -> int:
+        """
+        Iberna al più max_items sessioni inattive da idle_seconds, partendo dalle
+        usate meno di recente. Restituisce il numero di sessioni spostate.
+        """
+        max_items = max_items or self.sweep_slice
+        cutoff = time.time() - self.idle_seconds
+        hibernated = 0
+        
+        for session_id, profile in list(islice(self.sessions.items(), max_items)):
+            if profile.last_updated.timestamp() > cutoff:
+                break
+            if session_id in self._turn_pending:
+                continue
+            self._hibernate(session_id)
+            hibernated += 1
+        
+        metrics.set_gauge("sessions_hot", len(self.sessions))
+        return hibernated
     
-    def cleanup_old_sessions(self, max_age_hours: int = 24) -> None:
-        """Pulizia delle sessioni vecchie (solo per memoria in-RAM)."""
-        if not self.use_redis:
-            current_time = datetime.now()
-            expired_sessions = []
+    def _rehydrate(self, session_id: str) -> Optional[StudentProfile]:
+        """Risveglia una sessione ibernata riportandola nel livello hot."""
+        start = time.perf_counter()
+        found = self.tiers.take(session_id)
+        if not found:
+            return None
+        profile, tier = found
+        self._store_session(session_id, profile)
+        metrics.observe(f"session_rehydrate_{tier}_seconds", time.perf_counter() - start)
+        return profile
+    
+    def _spill_history(self, profile: StudentProfile, archive: bool = True) -> None:
+        """
+        Sposta su disco i turni più vecchi quando la coda in memoria supera
+        HISTORY_HOT_TURNS + HISTORY_SPILL_BATCH (a blocchi, non a ogni turno).
+        """
+        tail = profile.history_tail
+        if len(tail) <= HISTORY_HOT_TURNS + HISTORY_SPILL_BATCH:
+            return
+        
+        overflow = len(tail) - HISTORY_HOT_TURNS
+        if archive:
+            try:
+                first_seq = profile.history_total - len(tail)
+                turn_archive.append(profile.session_id, first_seq, tail[:overflow])
+            except sqlite3.Error as e:
+                print(f"⚠️  Archivio cronologia non disponibile, mantengo i turni in memoria: {e}")
+                return
+        profile.spill_history(HISTORY_HOT_TURNS)
+        metrics.increment("history_turns_spilled", overflow)
+    
+    def get_full_history(self, session_id: str) -> List[Turn]:
+        """Cronologia completa: turni archiviati seguiti dalla coda in memoria."""
+        profile = self.get_session(session_id)
+        if not profile:
+            return []
+        
+        archived = profile.history_total - len(profile.history_tail)
+        older: List[Turn] = []
+        if archived:
+            if getattr(self.store, "keeps_full_history", False):
+                older = self.store.read_history(session_id, archived)
+            else:
+                older = turn_archive.read(session_id, before_seq=archived)
+        return older + list(profile.history_tail)
+    
+    def _schedule_expiry(self, session_id: str, profile: StudentProfile) -> None:
+        """Aggiorna la scadenza della sessione; nel heap entra solo se anticipata o nuova."""
+        deadline = profile.last_updated.timestamp() + self.session_ttl
+        previous = self._deadlines.get(session_id)
+        if previous is None or deadline < previous:
+            heapq.heappush(self._expiry_heap, (deadline, session_id))
+        self._deadlines[session_id] = deadline
+    
+    def _evict(self, session_id: str) -> None:
+        """Rimuove una sessione dalla memoria (la voce nel heap diventa obsoleta)."""
+        profile = self.sessions.pop(session_id, None)
+        self._deadlines.pop(session_id, None)
+        hibernated = self.tiers.discard(session_id)
+        if profile is None:
+            # Sessione ibernata: il profilo non è in memoria, l'archivio va pulito comunque
+            if hibernated and not self.store:
+                try:
+                    turn_archive.delete(session_id)
+                except sqlite3.Error as e:
+                    print(f"⚠️  Errore pulizia archivio cronologia: {e}")
+            return
+        if not self.store and profile.history_total > len(profile.history_tail):
+            try:
+                turn_archive.delete(session_id)
+            except sqlite3.Error as e:
+                print(f"⚠️  Errore pulizia archivio cronologia: {e}")
+    
+    def sweep_expired(self, max_items: Optional[int] = None) -> int:
+        """
+        Elimina al più max_items sessioni scadute, partendo dalla scadenza più vicina.
+        Ogni chiamata costa O(max_items log n); restituisce il numero di sessioni rimosse.
+        """
+        max_items = max_items or self.sweep_slice
+        now = time.time()
+        examined = 0
+        evicted = 0
+        
+        while self._expiry_heap and examined < max_items:
+            deadline, session_id = self._expiry_heap[0]
+            if deadline > now:
+                break
+            heapq.heappop(self._expiry_heap)
+            examined += 1
             
-            for session_id, profile in self.sessions.items():
-                session_age = current_time - profile.created_at
-                if session_age > timedelta(hours=max_age_hours):
-                    expired_sessions.append(session_id)
+            current = self._deadlines.get(session_id)
+            if current is None:
+                continue  # già eliminata o espulsa dall'LRU
+            if current > now:
+                heapq.heappush(self._expiry_heap, (current, session_id))
+                continue
+            if session_id in self._turn_pending:
+                # Turno in corso: riprova più tardi
+                heapq.heappush(self._expiry_heap, (now + self.turn_timeout, session_id))
+                continue
             
-            for session_id in expired_sessions:
-                del self.sessions[session_id]
+            self._evict(session_id)
+            evicted += 1
+        
+        if evicted:
+            metrics.increment("sessions_expired", evicted)
+            metrics.set_gauge("sessions_hot", len(self.sessions))
+        return evicted
+    
+    async def run_sweeper(self) -> None:
+        """Ciclo in background: elimina le scadute e iberna le inattive, a piccoli blocchi."""
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            # Un blocco alla volta, cedendo l'event loop tra un blocco e l'altro
+            while self.sweep_expired() == self.sweep_slice:
+                await asyncio.sleep(0)
+            if self.store:
+                continue
+            while self.hibernate_idle() == self.sweep_slice:
+                await asyncio.sleep(0)
+    
+    def cleanup_old_sessions(self, max_age_hours: Optional[int] = None) -> int:
+        """
+        Compatibilità: elimina subito tutte le sessioni scadute (solo memoria in-RAM).
+        La scadenza è governata da SESSION_TTL_SECONDS; max_age_hours è ignorato.
+        """
+        removed = 0
+        while True:
+            evicted = self.sweep_expired()
+            removed += evicted
+            if evicted < self.sweep_slice:
+                return removed
     
     def session_exists(self, session_id: str) -> bool:
         """Verifica se una sessione esiste."""
-        if self.use_redis and self.redis_client:
+        if self.store:
             try:
-                return self.redis_client.exists(f"session:{session_id}") == 1
+                return self.store.exists(session_id)
             except Exception:
                 return session_id in self.sessions
         
-        return session_id in self.sessions
+        return session_id in self.sessions or session_id in self.tiers or self._snapshot_alive(session_id)
     
     def delete_session(self, session_id: str) -> bool:
         """Elimina una sessione."""
         try:
-            if self.use_redis and self.redis_client:
+            if self.store:
                 try:
-                    self.redis_client.delete(f"session:{session_id}")
+                    self.store.delete(session_id)
+                    if not getattr(self.store, "keeps_full_history", False):
+                        turn_archive.delete(session_id)
                 except Exception:
                     # Fallback
-                    if session_id in self.sessions:
-                        del self.sessions[session_id]
-            elif session_id in self.sessions:
-                del self.sessions[session_id]
+                    self._evict(session_id)
+            else:
+                self._evict(session_id)
+                if self.snapshot:
+                    self.snapshot.discard(session_id)
             
             return True
         except Exception:
             return False
+    
+    def close(self) -> None:
+        """Chiude l'archivio persistente scrivendo eventuali dati in coda."""
+        if self.store and hasattr(self.store, "close"):
+            self.store.close()
+    
+    # === Snapshot per il riavvio (solo backend in memoria) ===
+    
+    def load_snapshot(self) -> None:
+        """Mappa lo snapshot dell'ultimo spegnimento; le sessioni si decodificano su richiesta."""
+        if self.store:
+            return
+        self.snapshot = SessionSnapshot.open(self.snapshot_path)
+        if self.snapshot:
+            print(f"✅ Snapshot sessioni caricato: {self.snapshot.count} sessioni ripristinabili")
+    
+    def _snapshot_alive(self, session_id: str) -> bool:
+        """True se la sessione è nello snapshot e non ancora scaduta."""
+        if not self.snapshot:
+            return False
+        last_updated = self.snapshot.last_updated(session_id)
+        return last_updated is not None and last_updated + self.session_ttl > time.time()
+    
+    def _restore_from_snapshot(self, session_id: str) -> Optional[StudentProfile]:
+        """Riporta in memoria una sessione dallo snapshot, se presente e non scaduta."""
+        if not self._snapshot_alive(session_id):
+            return None
+        try:
+            profile = self.snapshot.take(session_id)
+        except Exception as e:
+            print(f"⚠️  Sessione {session_id[:8]} non ripristinabile dallo snapshot: {e}")
+            self.snapshot.discard(session_id)
+            return None
+        self._store_session(session_id, profile)
+        metrics.increment("sessions_restored")
+        return profile
+    
+    async def drain_turns(self, timeout: Optional[float] = None) -> bool:
+        """Attende che i turni in corso finiscano; False se scade il tempo."""
+        deadline = time.monotonic() + (timeout if timeout is not None else self.drain_timeout)
+        while self._turn_pending:
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+    
+    def save_snapshot(self) -> int:
+        """
+        Scrive in un unico file le sessioni non scadute (attive e ibernate), più quelle
+        dello snapshot precedente non ancora ripristinate. Restituisce il numero di sessioni.
+        """
+        if self.store:
+            return 0
+        now = time.time()
+        
+        def records():
+            for session_id, profile in self.sessions.items():
+                last_updated = profile.last_updated.timestamp()
+                if last_updated + self.session_ttl > now:
+                    yield session_id, last_updated, profile_codec.encode(profile)
+            for session_id, last_updated, blob in self.tiers.records():
+                if last_updated + self.session_ttl > now:
+                    yield session_id, last_updated, blob
+            if self.snapshot:
+                for session_id, last_updated, blob in self.snapshot.remaining():
+                    if session_id not in self._deadlines and last_updated + self.session_ttl > now:
+                        yield session_id, last_updated, blob
+        
+        start = time.perf_counter()
+        written = write_snapshot(self.snapshot_path, records())
+        if self.snapshot:
+            self.snapshot.close()
+            self.snapshot = None
+        metrics.observe("session_snapshot_seconds", time.perf_counter() - start)
+        return written
+    
+    async def shutdown(self) -> None:
+        """Spegnimento ordinato: attende i turni in corso, salva lo snapshot e chiude l'archivio."""
+        if not await self.drain_turns():
+            print(f"⚠️  Turni ancora in corso dopo {self.drain_timeout}s, snapshot comunque")
+        try:
+            written = self.save_snapshot()
+            if written:
+                print(f"💾 Snapshot di {written} sessioni salvato in {self.snapshot_path}")
+        except OSError as e:
+            print(f"⚠️  Errore salvataggio snapshot sessioni: {e}")
+        self.close()
 
 
 # Istanza globale del gestore di stato
-state_manager = StateManager(use_redis=False)  # Per ora senza Redis
+state_manager = StateManager(backend=os.getenv("SESSION_BACKEND", "memory"))
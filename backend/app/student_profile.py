@@ -2,17 +2,39 @@
 Modulo per la gestione del profilo studente.
 Rappresenta lo stato interno dell'agente.
 """
-from typing import Optional, List, Dict, Any
-from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, Any, Callable, Set, Tuple
+from pydantic import BaseModel, Field, PrivateAttr, field_validator, model_validator
 from datetime import datetime
 import uuid
 
+try:
+    from turn_log import Turn
+    import profile_fields
+except ImportError:
+    from .turn_log import Turn
+    from . import profile_fields
+
+# Campi derivati o gestiti a parte: non contano come modifiche del chiamante
+UNTRACKED_FIELDS = frozenset({
+    "version", "history_tail", "history_total", "profile_completeness", "missing_info_priority"
+})
+
+
+class ProfileVersionConflict(Exception):
+    """Il profilo è stato salvato da un altro worker dopo essere stato letto."""
+
+    def __init__(self, session_id: str, latest: Optional["StudentProfile"] = None):
+        super().__init__(session_id)
+        self.session_id = session_id
+        self.latest = latest  # Versione corrente nell'archivio (None se la sessione non c'è più)
+
 
 class StudentProfile(BaseModel):
     """Profilo strutturato dello studente per l'orientamento universitario."""
     
     # === ID e Metadati ===
     session_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    version: int = 0  # Incrementata a ogni salvataggio (compare-and-set tra worker)
     created_at: datetime = Field(default_factory=datetime.now)
     last_updated: datetime = Field(default_factory=datetime.now)
     
@@ -44,10 +66,96 @@ class StudentProfile(BaseModel):
     health_constraints: List[str] = Field(default_factory=list)
     
     # === D. Stato della Conversazione ===
-    conversation_history: List[Dict[str, str]] = Field(default_factory=list)
+    history_tail: List[Turn] = Field(default_factory=list)  # Turni recenti, i più vecchi sono archiviati
+    history_total: int = 0  # Turni totali della conversazione
+    conversation_memory: str = ""  # Riassunto dei turni più vecchi, aggiornato in background
+    memory_turns: int = 0  # Turni (dall'inizio) già riassunti in conversation_memory
     profile_completeness: float = 0.0  # 0.0 a 1.0
     missing_info_priority: List[str] = Field(default_factory=list)
     
+    # Campi modificati dall'ultimo salvataggio e turni totali a quel momento
+    _dirty: Set[str] = PrivateAttr(default_factory=set)
+    _base_history_total: int = PrivateAttr(default=0)
+    
+    # Stato derivato (profile_fields): campi del registro valorizzati, campi da ricontrollare,
+    # revisione incrementata a ogni assegnazione e valori memorizzati per revisione
+    _filled: Set[str] = PrivateAttr(default_factory=set)
+    _stale: Set[str] = PrivateAttr(default_factory=lambda: set(profile_fields.REGISTRY))
+    _revision: int = PrivateAttr(default=0)
+    _memo: Dict[str, Tuple[int, Any]] = PrivateAttr(default_factory=dict)
+    
+    @model_validator(mode="before")
+    @classmethod
+    def _migrate_conversation_history(cls, data: Any) -> Any:
+        """Converte i profili salvati con la vecchia lista conversation_history."""
+        if isinstance(data, dict) and "conversation_history" in data:
+            data = dict(data)
+            turns = [Turn.from_dict(turn) for turn in data.pop("conversation_history")]
+            data.setdefault("history_tail", turns)
+            data.setdefault("history_total", len(turns))
+        return data
+    
+    @field_validator("history_tail")
+    @classmethod
+    def _intern_roles(cls, turns: List[Turn]) -> List[Turn]:
+        """Ruoli internati anche per i turni deserializzati."""
+        return [Turn.create(*turn) for turn in turns]
+    
+    @property
+    def conversation_history(self) -> List[Dict[str, str]]:
+        """Compatibilità: turni in memoria nel vecchio formato dict."""
+        return [turn.as_dict() for turn in self.history_tail]
+    
+    def model_post_init(self, __context: Any) -> None:
+        """Allinea completezza e informazioni mancanti già alla creazione."""
+        self._update_completeness()
+        self._base_history_total = self.history_total
+    
+    def __setattr__(self, name: str, value: Any) -> None:
+        super().__setattr__(name, value)
+        if name in type(self).model_fields and name not in UNTRACKED_FIELDS:
+            self._dirty.add(name)
+            if name in profile_fields.REGISTRY:
+                self._stale.add(name)
+                self._revision += 1
+    
+    @property
+    def dirty_fields(self) -> Set[str]:
+        """Campi assegnati dopo l'ultimo salvataggio riuscito."""
+        return set(self._dirty)
+    
+    def mark_clean(self) -> None:
+        """Chiamato dopo un salvataggio riuscito: le modifiche sono ora nell'archivio."""
+        self._dirty.clear()
+        self._base_history_total = self.history_total
+    
+    def merge_concurrent(self, latest: "StudentProfile") -> None:
+        """
+        Riporta su questo profilo la versione salvata da un altro worker, mantenendo
+        le modifiche locali: i campi assegnati qui vincono (le liste vengono unite),
+        gli altri prendono il valore di latest; i nuovi turni locali seguono quelli di latest.
+        """
+        new_count = self.history_total - self._base_history_total
+        new_turns = self.history_tail[-new_count:] if new_count > 0 else []
+        
+        for name in type(self).model_fields:
+            if name in UNTRACKED_FIELDS:
+                continue
+            theirs = getattr(latest, name)
+            if name not in self._dirty:
+                self.__dict__[name] = theirs
+            elif isinstance(theirs, list):
+                mine = self.__dict__[name]
+                self.__dict__[name] = theirs + [item for item in mine if item not in theirs]
+        
+        self.__dict__["history_tail"] = list(latest.history_tail) + new_turns
+        self.__dict__["history_total"] = latest.history_total + len(new_turns)
+        self.__dict__["version"] = latest.version
+        self._base_history_total = latest.history_total
+        self._stale.update(profile_fields.REGISTRY)
+        self._revision += 1
+        self._update_completeness()
+    
     def update_field(self, field: str, value: Any) -> None:
         """Aggiorna un campo e marca come modificato."""
         setattr(self, field, value)
@@ -56,58 +164,93 @@ class StudentProfile(BaseModel):
     
     def add_conversation_turn(self, role: str, message: str) -> None:
         """Aggiunge un turno alla cronologia della conversazione."""
-        self.conversation_history.append({
-            "role": role,
-            "message": message,
-            "timestamp": datetime.now().isoformat()
-        })
+        now = datetime.now()
+        self.history_tail.append(Turn.create(role, message, now.timestamp()))
+        self.history_total += 1
+        self.last_updated = now
+    
+    def recent_turns(self, limit: int) -> List[Turn]:
+        """Ultimi turni in memoria (al più limit) non ancora riassunti in conversation_memory."""
+        first_seq = self.history_total - len(self.history_tail)
+        start = max(self.memory_turns - first_seq, len(self.history_tail) - limit, 0)
+        return self.history_tail[start:]
+    
+    def spill_history(self, keep: int) -> List[Turn]:
+        """Toglie dalla coda e restituisce i turni più vecchi oltre gli ultimi keep."""
+        overflow = self.history_tail[:-keep] if keep else list(self.history_tail)
+        del self.history_tail[:len(overflow)]
+        return overflow
     
     def _update_completeness(self) -> None:
-        """Calcola quanto è completo il profilo (semplificato)."""
-        critical_fields = [
-            'location', 'school_type', 'favorite_subjects', 
-            'primary_goal', 'institution_preference'
-        ]
-        
-        completed = 0
-        for field in critical_fields:
-            value = getattr(self, field)
-            # Controlla se il campo ha un valore valido
-            if value not in [None, [], ""]:
-                if isinstance(value, list):
-                    if len(value) > 0:  # Lista non vuota
-                        completed += 1
-                else:
-                    completed += 1
+        """Ricalcola completezza e informazioni mancanti ricontrollando solo i campi modificati."""
+        for name in self._stale:
+            if profile_fields.is_filled(name, getattr(self, name)):
+                self._filled.add(name)
+            else:
+                self._filled.discard(name)
+        self._stale.clear()
         
-        self.profile_completeness = completed / len(critical_fields) if critical_fields else 0.0
+        critical = profile_fields.CRITICAL_FIELDS
+        self.profile_completeness = sum(name in self._filled for name in critical) / len(critical)
         self._update_missing_info()
     
     def _update_missing_info(self) -> None:
         """Aggiorna la lista delle informazioni mancanti in ordine di priorità."""
-        self.missing_info_priority = []
-        
-        # Priority 1: Informazioni critiche
-        if not self.location:
-            self.missing_info_priority.append("location")
-        if not self.school_type:
-            self.missing_info_priority.append("school_type")
-        if not self.favorite_subjects:
-            self.missing_info_priority.append("favorite_subjects")
-        
-        # Priority 2: Informazioni importanti
-        if not self.primary_goal:
-            self.missing_info_priority.append("primary_goal")
-        if not self.institution_preference:
-            self.missing_info_priority.append("institution_preference")
-        if self.willing_to_relocate is None:
-            self.missing_info_priority.append("willing_to_relocate")
-        
-        # Priority 3: Informazioni di approfondimento
-        if not self.hobbies:
-            self.missing_info_priority.append("hobbies")
-        if not self.learning_style:
-            self.missing_info_priority.append("learning_style")
+        self.missing_info_priority = [
+            name for name in profile_fields.MISSING_PRIORITY if name not in self._filled
+        ]
+    
+    def _memoized(self, key: str, compute: Callable[[], Any]) -> Any:
+        """Valore derivato calcolato una volta per revisione del profilo."""
+        if self._stale:
+            self._update_completeness()
+        cached = self._memo.get(key)
+        if cached is not None and cached[0] == self._revision:
+            return cached[1]
+        value = compute()
+        self._memo[key] = (self._revision, value)
+        return value
+    
+    def profile_context(self, compact: bool = False, list_limit: Optional[int] = None) -> str:
+        """
+        Blocco di contesto del profilo per i prompt (memorizzato per revisione).
+        compact: solo i campi compilati più una riga con quelli mancanti;
+        list_limit: delle liste si mostrano solo gli ultimi elementi.
+        """
+        def render() -> str:
+            lines = ["=== PROFILO STUDENTE ===", f"Completamento: {self.profile_completeness*100:.1f}%"]
+            missing = []
+            for field in profile_fields.CONTEXT_FIELDS:
+                if compact and field.name not in self._filled:
+                    missing.append(field.label)
+                    continue
+                value = profile_fields.format_value(field, getattr(self, field.name), list_limit)
+                lines.append(f"{field.label}: {value}")
+            if missing:
+                lines.append(f"Mancano: {', '.join(missing)}")
+            return "\n".join(lines)
+        return self._memoized(f"context:{compact}:{list_limit}", render)
+    
+    def search_data(self) -> Dict[str, Any]:
+        """Campi del profilo usati per la ricerca web (copia, le liste sono modificabili)."""
+        data = {}
+        for name in profile_fields.SEARCH_FIELDS:
+            value = getattr(self, name)
+            data[name] = list(value) if isinstance(value, list) else value
+        return data
+    
+    def search_fingerprint(self, fingerprint: Callable[[Dict[str, Any]], Any]) -> Any:
+        """Impronta della ricerca web calcolata da `fingerprint` su search_data, una volta per revisione."""
+        return self._memoized("search_fingerprint", lambda: fingerprint(self.search_data()))
+    
+    def progress_summary(self) -> Dict[str, Any]:
+        """Stato di avanzamento esposto dalle API: completezza, pronto per la ricerca, prossime info."""
+        summary = self._memoized("progress", lambda: {
+            "completeness": self.profile_completeness,
+            "ready_for_search": self.is_sufficient_for_search(),
+            "missing_info": self.missing_info_priority[:3],
+        })
+        return {**summary, "missing_info": list(summary["missing_info"])}
     
     def is_sufficient_for_search(self) -> bool:
         """Determina se il profilo è abbastanza completo per iniziare la ricerca."""
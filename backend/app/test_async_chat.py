@@ -0,0 +1,289 @@
+"""
+Test del percorso di chat asincrono dell'agente, contro lo stand-in Gemini (in-process via ASGI).
+"""
+import asyncio
+import os
+import time
+
+import httpx
+from google import genai
+from google.genai import types
+
+os.environ.setdefault("GEMINI_API_KEY", "standin")
+
+# Import assoluti
+try:
+    from state_manager import state_manager
+    from metrics import metrics
+    from llm_gateway import LLMGateway
+    from agent import gemini_standin
+    from app.gemini_agent import GeminiOrientationAgent, FusedTurnResult  # Import relativo di web_searcher
+    from app.web_searcher import WebSearcher
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from state_manager import state_manager
+    from metrics import metrics
+    from llm_gateway import LLMGateway
+    from agent import gemini_standin
+    from app.gemini_agent import GeminiOrientationAgent, FusedTurnResult
+    from app.web_searcher import WebSearcher
+
+FAST = {"latency_ms": 0, "latency_sigma": 0, "tokens_per_second": 10000, "error_rate": 0, "reply_tokens": 12}
+
+
+def _agent() -> GeminiOrientationAgent:
+    """Agente con tutte le chiamate a Gemini (niente estrattore a regole né politica di dialogo)."""
+    agent = GeminiOrientationAgent()
+    client = genai.Client(api_key="standin", http_options=types.HttpOptions(
+        base_url="http://standin",
+        httpx_async_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=gemini_standin.app)),
+    ))
+    agent.llm = LLMGateway(client=client)
+    agent.llm.retry_base = 0.001
+    agent.fast_extraction = agent.dialogue_policy = agent.speculative_turn = False
+    agent.search_prefetch = False
+    return agent
+
+
+def test_async_turn_does_not_block_loop():
+    """Un turno asincrono salva domanda e risposta senza bloccare l'event loop."""
+    print("🧪 Test 1: Turno asincrono...")
+    gemini_standin.config = gemini_standin.config.model_copy(update={**FAST, "latency_ms": 50})
+    agent = _agent()
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.005)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        _, profile = agent.start_new_conversation()
+        response, profile = await agent.process_message_async(profile.session_id, "Abito a Bologna")
+        task.cancel()
+        return response, profile, ticks
+
+    response, profile, ticks = asyncio.run(run())
+    gemini_standin.config = gemini_standin.config.model_copy(update=FAST)
+    assert response
+    assert [turn.role for turn in profile.history_tail] == ["agent", "user", "agent"]
+    assert state_manager.get_session(profile.session_id).history_total == 3
+    assert ticks >= 5  # Due chiamate da 50 ms: il ticker ha continuato a girare
+    print(f"✅ Risposta salvata, {ticks} tick dell'event loop durante il turno")
+
+
+def test_concurrent_sessions_overlap():
+    """Turni di sessioni diverse procedono in parallelo."""
+    print("\n🧪 Test 2: Sessioni concorrenti...")
+    gemini_standin.config = gemini_standin.config.model_copy(update={**FAST, "latency_ms": 50})
+    agent = _agent()
+
+    async def run():
+        session_ids = [agent.start_new_conversation()[1].session_id for _ in range(5)]
+        started = time.perf_counter()
+        await asyncio.gather(*(agent.process_message_async(sid, "Mi piace la fisica") for sid in session_ids))
+        return time.perf_counter() - started
+
+    elapsed = asyncio.run(run())
+    gemini_standin.config = gemini_standin.config.model_copy(update=FAST)
+    assert elapsed < 5 * 0.1  # In serie servirebbero almeno 5 turni x 2 chiamate x 50 ms
+    print(f"✅ 5 turni in {elapsed * 1000:.0f} ms")
+
+
+def _collect_stream(agent: GeminiOrientationAgent, session_id: str, message: str) -> list:
+    async def run():
+        return [(event, data) async for event, data in agent.process_message_stream(session_id, message)]
+    return asyncio.run(run())
+
+
+def test_stream_event_order():
+    """Lo streaming produce extracting, thinking, i chunk e infine done con la risposta completa."""
+    print("\n🧪 Test 3: Ordine degli eventi in streaming...")
+    gemini_standin.config = gemini_standin.config.model_copy(update=FAST)
+    agent = _agent()
+    _, profile = agent.start_new_conversation()
+
+    events = _collect_stream(agent, profile.session_id, "Abito a Bologna")
+    names = [event for event, _ in events]
+    assert names[:2] == ["extracting", "thinking"] and names[-1] == "done"
+    assert set(names[2:-1]) == {"chunk"} and len(names) > 4  # Risposta in più frammenti
+    response = events[-1][1]["response"]
+    assert response == "".join(data["text"] for event, data in events if event == "chunk").strip()
+    assert state_manager.get_session(profile.session_id).history_tail[-1].message == response
+    print(f"✅ {names.count('chunk')} chunk prima di done")
+
+
+def test_stream_error_mid_generation():
+    """Un errore dopo i primi chunk chiude lo stream con un evento error, senza done."""
+    print("\n🧪 Test 4: Errore durante lo streaming...")
+    agent = _agent()
+    _, profile = agent.start_new_conversation()
+
+    async def broken_stream(*args, **kwargs):
+        yield "Per darti"
+        raise RuntimeError("connessione interrotta")
+
+    agent._generate_stream = broken_stream
+    events = _collect_stream(agent, profile.session_id, "Abito a Bologna")
+    names = [event for event, _ in events]
+    assert names == ["extracting", "thinking", "chunk", "error"]
+    assert state_manager.get_session(profile.session_id).history_tail[-1].role == "user"
+    print("✅ Stream chiuso con error, risposta parziale non salvata")
+
+
+def test_fused_flag_coerced():
+    """Nel fused turn un "no" per un campo sì/no viene salvato come False."""
+    print("\n🧪 Test 5: Campo sì/no dal fused turn...")
+    agent = _agent()
+    _, profile = agent.start_new_conversation()
+
+    result = FusedTurnResult.model_validate({
+        "updates": [{"field_name": "willing_to_relocate", "value": "no", "confidence": "alta"},
+                    {"field_name": "location", "value": "Bari", "confidence": "alta"}],
+        "reply": "Che scuola frequenti?",
+    })
+    updated_fields, _ = agent._apply_fused_result(profile, result)
+    assert updated_fields == ["willing_to_relocate", "location"]
+    assert profile.willing_to_relocate is False
+    assert "Disponibile a trasferirsi: No" in profile.profile_context()
+    print("✅ willing_to_relocate = False")
+
+
+def test_speculative_question_hit_and_miss():
+    """La domanda speculativa si tiene se l'estrazione non tocca il campo cercato, altrimenti si rigenera."""
+    print("\n🧪 Test 6: Domanda speculativa...")
+    gemini_standin.config = gemini_standin.config.model_copy(update=FAST)
+    agent = _agent()
+    agent.speculative_turn = True
+    counters = lambda: metrics.snapshot()["counters"]
+
+    async def extract_location(profile, user_message):
+        profile.update_field("location", "Bologna")
+        return ["location"]
+
+    async def run(message):
+        _, profile = agent.start_new_conversation()
+        before = counters()
+        await agent.process_message_async(profile.session_id, message)
+        after = counters()
+        return {name: after.get(name, 0) - before.get(name, 0)
+                for name in ("agent_speculation_hits", "agent_speculation_misses", "agent_profile_questions")}
+
+    hit = asyncio.run(run("Mi piace leggere"))  # Lo stand-in non estrae nulla
+    agent._extract_profile_info_async = extract_location
+    miss = asyncio.run(run("Abito a Bologna"))
+    # Una sola domanda contata anche quando quella speculativa viene scartata
+    assert hit == {"agent_speculation_hits": 1, "agent_speculation_misses": 0, "agent_profile_questions": 1}
+    assert miss == {"agent_speculation_hits": 0, "agent_speculation_misses": 1, "agent_profile_questions": 1}
+    print("✅ Hit senza aggiornamenti del campo cercato, miss con la località estratta")
+
+
+def test_metrics_endpoint():
+    """/api/metrics restituisce contatori e rapporti del registro."""
+    print("\n🧪 Test 7: Endpoint delle metriche...")
+    from app import main
+
+    async def run():
+        main.metrics.increment("agent_speculation_total")
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/api/metrics")
+
+    response = asyncio.run(run())
+    assert response.status_code == 200
+    body = response.json()
+    assert set(body) == {"counters", "gauges", "timings", "ratios"}
+    assert body["counters"]["agent_speculation_total"] >= 1
+    print(f"✅ {len(body['counters'])} contatori esposti")
+
+
+def test_search_prefetch_fingerprint():
+    """Il prefetch si usa se l'impronta della ricerca non è cambiata, altrimenti si ricerca."""
+    print("\n🧪 Test 8: Prefetch della ricerca web...")
+    agent = _agent()
+    agent.search_prefetch = True
+    agent.web_searcher = WebSearcher()
+    searches = []
+
+    async def fake_search(profile_data):
+        searches.append(list(profile_data["favorite_subjects"]))
+        return {"university_courses": {}, "its_courses": {}, "employment_stats": []}
+
+    agent.web_searcher.search_for_student_profile_async = fake_search
+
+    async def run(initial_subjects, added_subject):
+        _, profile = agent.start_new_conversation()
+        profile.update_field("location", "Bologna")
+        profile.update_field("favorite_subjects", list(initial_subjects))
+        agent._maybe_prefetch_search(profile)
+        await asyncio.sleep(0)  # Il prefetch parte
+        profile.update_field("favorite_subjects", profile.favorite_subjects + [added_subject])
+        before = metrics.snapshot()["counters"].get("agent_search_prefetch_hits", 0)
+        await agent._search_for_profile_async(profile, profile.search_data())
+        return metrics.snapshot()["counters"].get("agent_search_prefetch_hits", 0) - before
+
+    # Seconda materia: cambia le query, il prefetch va scartato
+    assert asyncio.run(run(["fisica"], "chimica")) == 0
+    assert searches == [["fisica"], ["fisica", "chimica"]]
+    # Terza materia: non entra nelle query, il prefetch resta valido
+    searches.clear()
+    assert asyncio.run(run(["fisica", "chimica"], "storia")) == 1
+    assert searches == [["fisica", "chimica"]]
+    print("✅ Miss con una nuova materia nelle query, hit con una materia che non cambia le query")
+
+
+def test_chat_endpoints_reject_busy_session():
+    """Con la coda dei turni piena /api/chat e /api/chat/stream rispondono 429."""
+    print("\n🧪 Test 9: Sessione con troppi turni in attesa...")
+    from app import main
+
+    async def run():
+        manager = main.state_manager
+        session_id = manager.create_session().session_id
+        release = asyncio.Event()
+
+        async def hold():
+            async with manager.session_turn(session_id):
+                await release.wait()
+
+        saved, manager.max_pending_turns = manager.max_pending_turns, 0
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        try:
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                request = {"message": "Abito a Bologna", "session_id": session_id}
+                chat = await client.post("/api/chat", json=request)
+                stream = await client.post("/api/chat/stream", json=request)
+        finally:
+            manager.max_pending_turns = saved
+            release.set()
+            await holder
+        return chat, stream
+
+    chat, stream = asyncio.run(run())
+    assert chat.status_code == 429 and stream.status_code == 429
+    print("✅ 429 su entrambi gli endpoint")
+
+
+if __name__ == "__main__":
+    print("🚀 Test chat asincrona...")
+    print("=" * 50)
+
+    test_async_turn_does_not_block_loop()
+    test_concurrent_sessions_overlap()
+    test_stream_event_order()
+    test_stream_error_mid_generation()
+    test_fused_flag_coerced()
+    test_speculative_question_hit_and_miss()
+    test_metrics_endpoint()
+    test_search_prefetch_fingerprint()
+    test_chat_endpoints_reject_busy_session()
+
+    print("\n" + "=" * 50)
+    print("✅ Tutti i test completati!")
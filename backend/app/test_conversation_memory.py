@@ -0,0 +1,156 @@
+"""
+Test della memoria della conversazione: riassunto in background dei turni più vecchi,
+contro lo stand-in Gemini (in-process via ASGI).
+"""
+import asyncio
+import os
+
+import httpx
+from google import genai
+from google.genai import types
+
+os.environ.setdefault("GEMINI_API_KEY", "standin")
+
+# Import assoluti
+try:
+    from student_profile import StudentProfile
+    from state_manager import state_manager
+    from llm_gateway import LLMGateway
+    from token_budget import estimate_tokens, FULL
+    from agent import gemini_standin
+    from app.gemini_agent import GeminiOrientationAgent  # Import relativo di web_searcher
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from student_profile import StudentProfile
+    from state_manager import state_manager
+    from llm_gateway import LLMGateway
+    from token_budget import estimate_tokens, FULL
+    from agent import gemini_standin
+    from app.gemini_agent import GeminiOrientationAgent
+
+FAST = {"latency_ms": 0, "tokens_per_second": 10000, "error_rate": 0, "reply_tokens": 40}
+
+
+def _agent() -> GeminiOrientationAgent:
+    agent = GeminiOrientationAgent()
+    client = genai.Client(api_key="standin", http_options=types.HttpOptions(
+        base_url="http://standin",
+        httpx_async_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=gemini_standin.app)),
+    ))
+    agent.llm = LLMGateway(client=client)
+    agent.llm.retry_base = 0.001
+    agent.memory_every, agent.memory_recent_turns = 6, 4
+    return agent
+
+
+def _chat(profile: StudentProfile, turns: int) -> None:
+    for i in range(turns):
+        profile.add_conversation_turn("user" if i % 2 else "agent", f"Messaggio numero {i} sulla scelta dell'università")
+
+
+def test_recent_turns_skip_summarized():
+    """recent_turns restituisce al più gli ultimi turni non ancora riassunti."""
+    print("🧪 Test 1: Turni recenti...")
+
+    profile = StudentProfile()
+    _chat(profile, 10)
+    assert profile.recent_turns(3) == profile.history_tail[-3:]
+    profile.memory_turns = 8
+    assert len(profile.recent_turns(3)) == 2
+    profile.memory_turns = 10
+    assert profile.recent_turns(3) == []
+    print("✅ Turni già riassunti esclusi")
+
+
+def test_background_refresh_updates_memory():
+    """Il riassunto in background aggiorna la memoria e lascia in chiaro solo gli ultimi turni."""
+    print("\n🧪 Test 2: Riassunto in background...")
+    gemini_standin.config = gemini_standin.config.model_copy(update=FAST)
+    agent = _agent()
+
+    async def run():
+        profile = state_manager.create_session()
+        _chat(profile, 12)
+        state_manager.update_session(profile.session_id, profile)
+        agent._maybe_refresh_memory(profile)
+        await asyncio.gather(*agent._memory_tasks.values())
+        return state_manager.get_session(profile.session_id)
+
+    profile = asyncio.run(run())
+    assert profile.conversation_memory
+    assert profile.memory_turns == 12 - agent.memory_recent_turns
+    context = agent._build_conversation_context(profile, FULL)
+    assert "=== MEMORIA CONVERSAZIONE ===" in context
+    assert context.count("Messaggio numero") == agent.memory_recent_turns - 1  # Escluso il messaggio in corso
+    print(f"✅ {profile.memory_turns} turni riassunti in {estimate_tokens(profile.conversation_memory)} token")
+
+
+def test_refresh_outside_turn_queue():
+    """Il riassunto non occupa la coda dei turni: un turno in attesa non riceve 429 e nulla va perso."""
+    print("\n🧪 Test 3: Riassunto durante un turno...")
+    gemini_standin.config = gemini_standin.config.model_copy(update=FAST)
+    agent = _agent()
+
+    async def run():
+        profile = state_manager.create_session()
+        session_id = profile.session_id
+        _chat(profile, 12)
+        state_manager.update_session(session_id, profile)
+        saved, state_manager.max_pending_turns = state_manager.max_pending_turns, 1
+
+        async def queued_turn():
+            async with state_manager.session_turn(session_id):
+                pass
+
+        try:
+            async with state_manager.session_turn(session_id):
+                turn = state_manager.get_session(session_id)
+                agent._maybe_refresh_memory(turn)
+                await asyncio.sleep(0.2)  # Riassunto pronto mentre il turno è in corso
+                queued = asyncio.create_task(queued_turn())  # Doppio invio dello studente
+                await asyncio.sleep(0)
+                turn.update_field("location", "Bologna")
+                state_manager.update_session(session_id, turn)
+            await queued
+            await asyncio.gather(*agent._memory_tasks.values())
+        finally:
+            state_manager.max_pending_turns = saved
+        return state_manager.get_session(session_id)
+
+    profile = asyncio.run(run())
+    assert profile.memory_turns == 12 - agent.memory_recent_turns and profile.conversation_memory
+    assert profile.location == "Bologna"
+    print("✅ Turno in coda accettato, memoria e aggiornamenti del turno salvati")
+
+
+def test_prompt_size_bounded():
+    """Con la memoria il prompt della domanda non cresce con la lunghezza della conversazione."""
+    print("\n🧪 Test 4: Prompt di dimensione limitata...")
+    agent = _agent()
+    agent.dialogue_policy = False
+
+    sizes = []
+    for turns in (10, 100):
+        profile = StudentProfile()
+        _chat(profile, turns)
+        profile.conversation_memory = "Lo studente valuta ingegneria a Bologna e chiede delle borse di studio."
+        profile.memory_turns = turns - agent.memory_recent_turns
+        sizes.append(estimate_tokens(agent._build_question_prompt(profile, "E per l'alloggio?")))
+
+    assert abs(sizes[1] - sizes[0]) <= 5
+    print(f"✅ {sizes[0]} token al turno 10, {sizes[1]} al turno 100")
+
+
+if __name__ == "__main__":
+    print("🚀 Test memoria della conversazione...")
+    print("=" * 50)
+
+    test_recent_turns_skip_summarized()
+    test_background_refresh_updates_memory()
+    test_refresh_outside_turn_queue()
+    test_prompt_size_bounded()
+
+    print("\n" + "=" * 50)
+    print("✅ Tutti i test completati!")
@@ -0,0 +1,68 @@
+"""
+Test della politica di dialogo deterministica (domande di profilazione senza LLM).
+"""
+# Import assoluti
+try:
+    import profile_fields
+    from student_profile import StudentProfile
+    from dialogue_policy import DialoguePolicy, QUESTION_BANK
+except ImportError:
+    import sys
+    import os
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    import profile_fields
+    from student_profile import StudentProfile
+    from dialogue_policy import DialoguePolicy, QUESTION_BANK
+
+policy = DialoguePolicy()
+
+# Un valore valido per ogni campo del registro
+SAMPLE_VALUES = {
+    "location": "Bologna", "school_type": "Liceo Scientifico", "favorite_subjects": ["fisica"],
+    "hobbies": ["calcio"], "primary_goal": "passione", "institution_preference": "pubblico",
+    "willing_to_relocate": False, "learning_style": "pratico",
+}
+
+
+def test_question_for_each_missing_field():
+    """Per ogni campo mancante, nell'ordine di priorità, la politica pone una domanda su quel campo."""
+    print("🧪 Test 1: Una domanda per ogni campo mancante...")
+
+    profile = StudentProfile()
+    asked = []
+    for field in profile_fields.MISSING_PRIORITY:
+        assert policy.next_field(profile) == field
+        question = policy.question_for(profile)
+        assert question in QUESTION_BANK[field]
+        assert policy.question_for(profile) == question  # Scelta deterministica
+        asked.append(field)
+        profile.update_field(field, SAMPLE_VALUES[field])
+
+    assert policy.question_for(profile) is None
+    print(f"✅ Domande per {len(asked)} campi: {', '.join(asked)}")
+
+
+def test_compose_and_rewrite():
+    """Riconoscimento + domanda da template; domande e messaggi lunghi passano all'LLM."""
+    print("\n🧪 Test 2: Riconoscimento e riformulazione...")
+
+    profile = StudentProfile()
+    profile.update_field("location", "Bologna")
+    reply = policy.compose(profile, ["location"])
+    assert "Bologna" in reply and reply.endswith(policy.question_for(profile))
+
+    assert not policy.needs_rewrite("Abito a Bologna", ["location"])
+    assert policy.needs_rewrite("Che differenza c'è tra liceo e tecnico?")
+    assert policy.needs_rewrite("boh", [])  # Nessuna informazione estratta
+    print(f"✅ {reply!r}")
+
+
+if __name__ == "__main__":
+    print("🚀 Test politica di dialogo...")
+    print("=" * 50)
+
+    test_question_for_each_missing_field()
+    test_compose_and_rewrite()
+
+    print("\n" + "=" * 50)
+    print("✅ Tutti i test completati!")
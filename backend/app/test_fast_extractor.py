@@ -0,0 +1,93 @@
+"""
+Test dell'estrattore a regole (località, scuola, materie).
+"""
+# Import assoluti
+try:
+    from fast_extractor import FastProfileExtractor
+except ImportError:
+    import sys
+    import os
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from fast_extractor import FastProfileExtractor
+
+extractor = FastProfileExtractor()
+
+
+def _values(updates, field_name):
+    return [u["value"] for u in updates if u["field_name"] == field_name]
+
+
+def test_location():
+    """Località con trigger, senza accenti e con errori di battitura."""
+    print("🧪 Test 1: Località...")
+
+    for message, expected in [
+        ("abito a Bologna", "Bologna"),
+        ("vivo a forli", "Forlì"),
+        ("sono di l'aquila", "L'Aquila"),
+        ("abito a Bolgna", "Bologna"),
+        ("Reggio Emilia", "Reggio Emilia"),
+    ]:
+        updates, confident = extractor.extract(message)
+        print(f"  {message!r} → {_values(updates, 'location')} (sicuro: {confident})")
+        assert confident and _values(updates, "location") == [expected]
+
+
+def test_school_type():
+    """Tipo di scuola con eventuale indirizzo."""
+    print("\n🧪 Test 2: Tipo di scuola...")
+
+    for message, expected in [
+        ("liceo scientifico", "Liceo Scientifico"),
+        ("Frequento il liceo scientifico", "Liceo Scientifico"),
+        ("frequento l'ITIS informatica", "ITIS Informatica"),
+    ]:
+        updates, confident = extractor.extract(message)
+        print(f"  {message!r} → {_values(updates, 'school_type')} (sicuro: {confident})")
+        assert confident and _values(updates, "school_type") == [expected]
+
+
+def test_subjects():
+    """Materie preferite e non gradite."""
+    print("\n🧪 Test 3: Materie...")
+
+    updates, confident = extractor.extract("Mi piacciono matematica e fisica")
+    assert confident and _values(updates, "favorite_subjects") == ["matematica", "fisica"]
+
+    updates, confident = extractor.extract("mi piace la matematca ma odio il latino")
+    assert _values(updates, "favorite_subjects") == ["matematica"]
+    assert _values(updates, "disliked_subjects") == ["latino"]
+    print("✅ Materie riconosciute")
+
+
+def test_defers_to_llm():
+    """I messaggi non banali vanno lasciati all'estrattore LLM."""
+    print("\n🧪 Test 4: Messaggi da passare all'LLM...")
+
+    for message in [
+        "Vorrei trovare un lavoro dopo gli studi",
+        "abito a Bologna e vorrei fare ingegneria gestionale",
+        "sono un tipo tecnico",
+        "vivo in italia",
+        "abito a Bologna ma studio a Milano",
+        "abito a Bologna e vivo a Modena",
+        "vado a Roma",
+        "studio a Padova",
+        "mi piace la fisica, studio a Padova",
+    ]:
+        _, confident = extractor.extract(message)
+        print(f"  {message!r} → sicuro: {confident}")
+        assert not confident
+
+
+if __name__ == "__main__":
+    print("🚀 Test estrattore a regole...")
+    print("=" * 50)
+
+    test_location()
+    test_school_type()
+    test_subjects()
+    test_defers_to_llm()
+
+    print("\n" + "=" * 50)
+    print("✅ Tutti i test completati!")
@@ -0,0 +1,219 @@
+"""
+Test del gateway Gemini (retry, circuit breaker, hedging) con un trasporto httpx simulato.
+"""
+import asyncio
+import time
+
+import httpx
+from google import genai
+from google.genai import types
+
+# Import assoluti
+try:
+    from llm_gateway import LLMGateway, CircuitOpenError
+except ImportError:
+    import sys
+    import os
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from llm_gateway import LLMGateway, CircuitOpenError
+
+
+def _reply(text):
+    return httpx.Response(200, json={
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}]
+    })
+
+
+def _unavailable():
+    return httpx.Response(503, json={"error": {"code": 503, "message": "overloaded", "status": "UNAVAILABLE"}})
+
+
+def _gateway(handler=None, async_handler=None):
+    client = genai.Client(api_key="test", http_options=types.HttpOptions(
+        httpx_client=httpx.Client(transport=httpx.MockTransport(handler or _reply)),
+        httpx_async_client=httpx.AsyncClient(transport=httpx.MockTransport(async_handler or _reply)),
+    ))
+    gateway = LLMGateway(client=client)
+    gateway.retry_base = 0.001
+    return gateway
+
+
+def test_retry_transient_errors():
+    """Gli errori 503 vengono ritentati, i 400 no."""
+    print("🧪 Test 1: Retry sugli errori transitori...")
+
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return _unavailable() if len(calls) <= 2 else _reply("ciao")
+
+    gateway = _gateway(handler)
+    assert gateway.generate("modello", "prompt", 0.1, 10) == "ciao"
+    assert len(calls) == 3
+
+    bad_request = _gateway(lambda request: httpx.Response(400, json={"error": {"code": 400, "message": "no"}}))
+    try:
+        bad_request.generate("modello", "prompt", 0.1, 10)
+        assert False, "attesa eccezione"
+    except CircuitOpenError:
+        assert False, "un 400 non deve aprire il circuito"
+    except Exception:
+        pass
+    assert bad_request.breaker.failures == 0
+    print("✅ Tre tentativi, nessun retry sul 400")
+
+
+def test_circuit_breaker():
+    """Dopo N errori consecutivi le chiamate falliscono subito, poi una prova lo richiude."""
+    print("\n🧪 Test 2: Circuit breaker...")
+
+    healthy = []
+    gateway = _gateway(lambda request: _reply("ok") if healthy else _unavailable())
+    gateway.max_retries = 0
+    gateway.breaker.failure_threshold = 3
+    gateway.breaker.reset_seconds = 0.05
+
+    for _ in range(3):
+        try:
+            gateway.generate("modello", "prompt", 0.1, 10)
+        except CircuitOpenError:
+            assert False, "circuito aperto troppo presto"
+        except Exception:
+            pass
+    try:
+        gateway.generate("modello", "prompt", 0.1, 10)
+        assert False, "attesa CircuitOpenError"
+    except CircuitOpenError:
+        pass
+
+    time.sleep(0.06)
+    healthy.append(True)
+    assert gateway.generate("modello", "prompt", 0.1, 10) == "ok"
+    assert gateway.breaker.state == gateway.breaker.CLOSED
+    print("✅ Circuito aperto e richiuso dalla chiamata di prova")
+
+
+def test_half_open_probe_settles():
+    """Una prova che fallisce con un 400 o viene annullata non lascia il circuito bloccato in half-open."""
+    print("\n🧪 Test 3: Esito della chiamata di prova...")
+
+    async def slow(request):
+        await asyncio.sleep(1)
+        return _reply("tardi")
+
+    responses = []
+    gateway = _gateway(lambda request: responses.pop(0), async_handler=slow)
+    gateway.max_retries = 0
+    gateway.breaker.failure_threshold = 1
+    gateway.breaker.reset_seconds = 0.05
+
+    def trip():
+        responses.append(_unavailable())
+        try:
+            gateway.generate("modello", "prompt", 0.1, 10)
+        except Exception:
+            pass
+        assert gateway.breaker.state == gateway.breaker.OPEN
+        time.sleep(0.06)
+
+    # Prova con un 400: Gemini ha risposto, il circuito si richiude
+    trip()
+    responses.append(httpx.Response(400, json={"error": {"code": 400, "message": "no"}}))
+    try:
+        gateway.generate("modello", "prompt", 0.1, 10)
+        assert False, "attesa eccezione"
+    except CircuitOpenError:
+        assert False, "la prova deve partire"
+    except Exception:
+        pass
+    responses.append(_reply("ok"))
+    assert gateway.generate("modello", "prompt", 0.1, 10) == "ok"
+
+    # Prova annullata: il circuito si riapre e dopo reset_seconds parte una nuova prova
+    trip()
+
+    async def cancelled_probe():
+        task = asyncio.create_task(gateway.generate_async("modello", "prompt", 0.1, 10))
+        await asyncio.sleep(0.02)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(cancelled_probe())
+    assert gateway.breaker.state == gateway.breaker.OPEN
+    time.sleep(0.06)
+    responses.append(_reply("ok"))
+    assert gateway.generate("modello", "prompt", 0.1, 10) == "ok"
+    assert gateway.breaker.state == gateway.breaker.CLOSED
+    print("✅ Circuito richiuso dopo il 400 e riaperto dopo la prova annullata")
+
+
+def test_hedged_request():
+    """Se la prima richiesta tarda, la seconda risponde al suo posto."""
+    print("\n🧪 Test 4: Richiesta hedged...")
+
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            await asyncio.sleep(1)
+            return _reply("lenta")
+        return _reply("veloce")
+
+    async def run():
+        gateway = _gateway(async_handler=handler)
+        gateway.hedge_after = 0.05
+        start = time.perf_counter()
+        text = await gateway.generate_async("modello", "prompt", 0.1, 10, hedge=True)
+        return text, time.perf_counter() - start
+
+    text, elapsed = asyncio.run(run())
+    assert text == "veloce" and elapsed < 0.5
+    print(f"✅ Risposta dalla seconda richiesta in {elapsed * 1000:.0f} ms")
+
+
+def test_stream_retries_respect_deadline():
+    """Lo streaming smette di ritentare quando la pausa supererebbe la scadenza."""
+    print("\n🧪 Test 5: Retry dello streaming entro la scadenza...")
+
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        return _unavailable()
+
+    async def run():
+        gateway = _gateway(async_handler=handler)
+        gateway._backoff = lambda attempt: 5.0
+        start = time.perf_counter()
+        try:
+            async for _ in gateway.generate_stream("modello", "prompt", 0.1, 10, deadline=0.5):
+                pass
+            assert False, "attesa eccezione"
+        except AssertionError:
+            raise
+        except Exception:
+            pass
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(run())
+    assert elapsed < 0.5 and len(calls) == 1
+    print(f"✅ Nessun retry oltre la scadenza ({elapsed * 1000:.0f} ms)")
+
+
+if __name__ == "__main__":
+    print("🚀 Test gateway Gemini...")
+    print("=" * 50)
+
+    test_retry_transient_errors()
+    test_circuit_breaker()
+    test_half_open_probe_settles()
+    test_hedged_request()
+    test_stream_retries_respect_deadline()
+
+    print("\n" + "=" * 50)
+    print("✅ Tutti i test completati!")
@@ -0,0 +1,166 @@
+"""
+Test dei provider offline: stand-in Gemini (in-process via ASGI) e cassetta record/replay.
+"""
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+
+import httpx
+from google import genai
+from google.genai import types
+
+# Import assoluti
+try:
+    from metrics import metrics
+    from llm_gateway import LLMGateway
+    from prompt_cache import PromptParts
+    from agent import gemini_standin
+    from agent.llm_providers import CassetteProvider, CassetteMissError
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from metrics import metrics
+    from llm_gateway import LLMGateway
+    from prompt_cache import PromptParts
+    from agent import gemini_standin
+    from agent.llm_providers import CassetteProvider, CassetteMissError
+
+FAST = {"latency_ms": 0, "tokens_per_second": 10000, "error_rate": 0, "reply_tokens": 12}
+
+
+def _standin_gateway() -> LLMGateway:
+    client = genai.Client(api_key="standin", http_options=types.HttpOptions(
+        base_url="http://standin",
+        httpx_async_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=gemini_standin.app)),
+    ))
+    gateway = LLMGateway(client=client)
+    gateway.retry_base = 0.001
+    return gateway
+
+
+def test_standin_generate_and_errors():
+    """Lo stand-in risponde nel formato Gemini (anche in streaming) e inietta errori."""
+    print("🧪 Test 1: Stand-in Gemini...")
+
+    async def run():
+        gateway = _standin_gateway()
+        gemini_standin.config = gemini_standin.config.model_copy(update=FAST)
+        text = await gateway.generate_async("modello", "Ciao", 0.5, 100)
+        chunks = [chunk async for chunk in gateway.generate_stream("modello", "Ciao", 0.5, 100)]
+
+        gemini_standin.config = gemini_standin.config.model_copy(update={"error_rate": 1.0, "error_codes": [503]})
+        gateway.max_retries = 1
+        try:
+            await gateway.generate_async("modello", "Ciao", 0.5, 100)
+            failed = False
+        except Exception:
+            failed = True
+        gemini_standin.config = gemini_standin.config.model_copy(update=FAST)
+        return text, chunks, failed
+
+    text, chunks, failed = asyncio.run(run())
+    assert len(text.split()) == 12
+    assert len(chunks) > 1 and "".join(chunks) == text
+    assert failed
+    print(f"✅ Risposta di {len(text.split())} parole, {len(chunks)} frammenti, errore 503 iniettato")
+
+
+def test_cassette_record_replay():
+    """Le risposte registrate vengono riprodotte identiche senza upstream."""
+    print("\n🧪 Test 2: Cassetta record/replay...")
+
+    path = os.path.join(tempfile.mkdtemp(), "gemini.json")
+    gemini_standin.config = gemini_standin.config.model_copy(update=FAST)
+
+    async def call(provider, prompt):
+        gateway = LLMGateway(api_key="test", provider=provider)
+        try:
+            return await gateway.generate_async("modello", prompt, 0.1, 50)
+        finally:
+            await gateway.aclose()
+
+    recorder = CassetteProvider("record", path, upstream=(None, httpx.ASGITransport(app=gemini_standin.app)))
+    recorded = asyncio.run(call(recorder, "Abito a Bologna"))
+    assert os.path.exists(path)
+
+    replayed = asyncio.run(call(CassetteProvider("replay", path), "Abito a Bologna"))
+    assert replayed == recorded
+    try:
+        asyncio.run(call(CassetteProvider("replay", path), "Prompt mai registrato"))
+        assert False, "attesa CassetteMissError"
+    except CassetteMissError:
+        pass
+    print("✅ Risposta riprodotta dalla cassetta")
+
+
+def test_cassette_record_compressed_upstream():
+    """In registrazione una risposta gzip arriva decodificata al client e alla cassetta."""
+    print("\n🧪 Test 3: Registrazione con upstream compresso...")
+
+    path = os.path.join(tempfile.mkdtemp(), "gemini.json")
+    body = json.dumps({
+        "candidates": [{"content": {"role": "model", "parts": [{"text": "compresso"}]}, "finishReason": "STOP"}]
+    }).encode("utf-8")
+
+    def gzipped(request):
+        return httpx.Response(200, content=gzip.compress(body), headers={
+            "content-type": "application/json", "content-encoding": "gzip",
+        })
+
+    async def agzipped(request):
+        return gzipped(request)
+
+    recorder = CassetteProvider("record", path, upstream=(httpx.MockTransport(gzipped), httpx.MockTransport(agzipped)))
+    gateway = LLMGateway(api_key="test", provider=recorder)
+
+    async def run():
+        try:
+            return await gateway.generate_async("modello", "Ciao", 0.1, 50)
+        finally:
+            await gateway.aclose()
+
+    assert gateway.generate("modello", "Buongiorno", 0.1, 50) == "compresso"
+    assert asyncio.run(run()) == "compresso"
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    assert len(entries) == 2 and all(json.loads(entry["body"]) == json.loads(body) for entry in entries.values())
+    print("✅ Risposte gzip decodificate una sola volta e registrate in chiaro")
+
+
+def test_implicit_cache_reported():
+    """Un prefisso di sistema ripetuto, sopra il minimo, risulta in cache e il risparmio viene contato."""
+    print("\n🧪 Test 4: Cache implicita del prefisso...")
+    minimum = gemini_standin.config.cache_min_tokens
+    gemini_standin.config = gemini_standin.config.model_copy(update={**FAST, "cache_min_tokens": 100})
+    prompt = PromptParts("Sei un orientatore universitario. " * 20, "Abito a Bologna")
+    short = PromptParts("Sei un orientatore.", "Abito a Bologna")
+    saved = lambda: metrics.snapshot()["counters"].get("llm_cached_input_tokens_question", 0)
+
+    async def run():
+        gateway = _standin_gateway()
+        before = saved()
+        for parts in (prompt, prompt, short, short):
+            await gateway.generate_async("modello", parts, 0.5, 50, call_type="question")
+        return saved() - before
+
+    hits = gemini_standin.stats["cache_hits"]
+    cached = asyncio.run(run())
+    gemini_standin.config = gemini_standin.config.model_copy(update={"cache_min_tokens": minimum})
+    assert gemini_standin.stats["cache_hits"] == hits + 1  # Solo il secondo uso del prefisso lungo
+    assert cached == len(prompt.system) // 4
+    print(f"✅ {cached} token del prefisso serviti dalla cache")
+
+
+if __name__ == "__main__":
+    print("🚀 Test provider offline...")
+    print("=" * 50)
+
+    test_standin_generate_and_errors()
+    test_cassette_record_replay()
+    test_cassette_record_compressed_upstream()
+    test_implicit_cache_reported()
+
+    print("\n" + "=" * 50)
+    print("✅ Tutti i test completati!")
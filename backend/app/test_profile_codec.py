@@ -0,0 +1,82 @@
+"""
+Test del codec versionato per StudentProfile.
+"""
+import json
+
+# Import assoluti
+try:
+    import profile_codec
+    from student_profile import StudentProfile
+except ImportError:
+    import sys
+    import os
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    import profile_codec
+    from student_profile import StudentProfile
+
+
+def _profile():
+    profile = StudentProfile()
+    profile.update_field("location", "Bologna")
+    profile.update_field("school_type", "Liceo Scientifico")
+    profile.update_field("favorite_subjects", ["matematica", "fisica"])
+    profile.update_field("willing_to_relocate", False)
+    profile.add_conversation_turn("user", "abito a Bologna, è così")
+    profile.add_conversation_turn("agent", "Che scuola frequenti?")
+    return profile
+
+
+def test_roundtrip():
+    """Percorso fidato e validato ricostruiscono lo stesso profilo."""
+    print("🧪 Test 1: Codifica e decodifica...")
+
+    profile = _profile()
+    blob = profile_codec.encode(profile)
+    assert blob[0] == profile_codec.SCHEMA_VERSION
+
+    for trusted in (True, False):
+        restored = profile_codec.decode(blob, trusted=trusted)
+        assert restored.model_dump() == profile.model_dump()
+    print(f"✅ {len(blob)} byte contro {len(profile.model_dump_json())} del JSON pydantic")
+
+
+def test_legacy_json():
+    """Gli snapshot JSON senza versione restano leggibili."""
+    print("\n🧪 Test 2: Snapshot JSON precedenti...")
+
+    profile = _profile()
+    assert profile_codec.decode(profile.model_dump_json()).model_dump() == profile.model_dump()
+    print("✅ JSON pydantic decodificato")
+
+
+def test_migrations():
+    """I profili con schema precedente passano dalle migrazioni; quelli futuri sono rifiutati."""
+    print("\n🧪 Test 3: Migrazioni...")
+
+    old_version = profile_codec.SCHEMA_VERSION - 1
+    payload = json.dumps({"session_id": "abc", "citta": "Roma"}).encode("utf-8")
+    profile_codec.MIGRATIONS[old_version] = lambda data: {"location": data.pop("citta"), **data}
+    try:
+        restored = profile_codec.decode(bytes((old_version,)) + payload)
+    finally:
+        del profile_codec.MIGRATIONS[old_version]
+    assert restored.location == "Roma" and restored.session_id == "abc"
+
+    try:
+        profile_codec.decode(bytes((profile_codec.SCHEMA_VERSION + 1,)) + payload)
+        assert False, "versione futura accettata"
+    except ValueError:
+        pass
+    print("✅ Migrazione applicata")
+
+
+if __name__ == "__main__":
+    print("🚀 Test codec profilo...")
+    print("=" * 50)
+
+    test_roundtrip()
+    test_legacy_json()
+    test_migrations()
+
+    print("\n" + "=" * 50)
+    print("✅ Tutti i test completati!")
@@ -0,0 +1,91 @@
+"""
+Test dello stato derivato del profilo (registro profile_fields).
+"""
+
+# Import assoluti
+try:
+    import profile_fields
+    from student_profile import StudentProfile
+except ImportError:
+    import sys
+    import os
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    import profile_fields
+    from student_profile import StudentProfile
+
+
+def test_incremental_completeness():
+    """Completezza e informazioni mancanti seguono il registro, anche dopo assegnazioni dirette."""
+    print("🧪 Test 1: Completezza incrementale...")
+
+    profile = StudentProfile()
+    assert profile.profile_completeness == 0.0
+    assert profile.missing_info_priority == list(profile_fields.MISSING_PRIORITY)
+
+    profile.update_field("location", "Bologna")
+    profile.update_field("willing_to_relocate", False)
+    assert profile.profile_completeness == 1 / len(profile_fields.CRITICAL_FIELDS)
+    assert "location" not in profile.missing_info_priority
+    assert "willing_to_relocate" not in profile.missing_info_priority
+
+    # Assegnazione senza update_field: ricalcolata alla prima lettura dello stato derivato
+    profile.favorite_subjects = ["fisica"]
+    assert profile.progress_summary()["missing_info"][0] == "school_type"
+    assert profile.profile_completeness == 2 / len(profile_fields.CRITICAL_FIELDS)
+    print("✅ Stato derivato aggiornato")
+
+
+def test_memoized_per_revision():
+    """Contesto e impronta di ricerca vengono ricalcolati solo dopo una modifica."""
+    print("\n🧪 Test 2: Memorizzazione per revisione...")
+
+    calls = []
+
+    def fingerprint(data):
+        calls.append(data)
+        return (tuple(data["favorite_subjects"]), data["location"])
+
+    profile = StudentProfile()
+    profile.update_field("location", "Torino")
+    context = profile.profile_context()
+    assert "Località: Torino" in context and "Disponibile a trasferirsi: Non specificato" in context
+    assert profile.profile_context() is context
+
+    assert profile.search_fingerprint(fingerprint) == ((), "Torino")
+    profile.add_conversation_turn("user", "ciao")  # non cambia i campi del registro
+    profile.search_fingerprint(fingerprint)
+    assert len(calls) == 1
+
+    profile.update_field("favorite_subjects", ["storia"])
+    assert profile.search_fingerprint(fingerprint) == (("storia",), "Torino")
+    assert len(calls) == 2
+    assert "Materie preferite: storia" in profile.profile_context()
+    print("✅ Valori riusati finché il profilo non cambia")
+
+
+def test_parse_flag():
+    """Le risposte sì/no estratte come testo diventano booleani."""
+    print("\n🧪 Test 3: Campi sì/no...")
+
+    assert profile_fields.parse_flag("Sì") is True
+    assert profile_fields.parse_flag("no") is False
+    assert profile_fields.parse_flag("non disponibile") is False
+    assert profile_fields.parse_flag(False) is False
+    assert profile_fields.parse_flag("forse") is None
+
+    profile = StudentProfile()
+    profile.update_field("willing_to_relocate", profile_fields.parse_flag("no"))
+    assert "Disponibile a trasferirsi: No" in profile.profile_context()
+    print("✅ \"no\" registrato come False")
+
+
+if __name__ == "__main__":
+    print("🚀 Test stato derivato del profilo...")
+    print("=" * 50)
+
+    test_incremental_completeness()
+    test_memoized_per_revision()
+    test_parse_flag()
+
+    print("\n" + "=" * 50)
+    print("✅ Tutti i test completati!")
@@ -0,0 +1,148 @@
+"""
+Test del compare-and-set sulla versione del profilo (aggiornamenti concorrenti tra worker).
+"""
+import time
+
+import pytest
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+# Import assoluti
+try:
+    from state_manager import StateManager
+    from redis_store import RedisSessionStore
+    from metrics import metrics
+    import profile_codec
+except ImportError:
+    import sys
+    import os
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from state_manager import StateManager
+    from redis_store import RedisSessionStore
+    from metrics import metrics
+    import profile_codec
+
+
+def _conflicts() -> int:
+    return metrics.snapshot()["counters"].get("session_version_conflicts", 0)
+
+
+def test_memory_conflict_merge():
+    """Una copia superata viene unita alla versione corrente invece di sovrascriverla."""
+    print("🧪 Test 1: Conflitto in memoria...")
+
+    manager = StateManager()
+    current = manager.create_session()
+    stale = profile_codec.decode(profile_codec.encode(current))
+
+    current.update_field("location", "Roma")
+    current.add_conversation_turn("user", "abito a Roma")
+    assert manager.update_session(current.session_id, current)
+    assert current.version == 1
+
+    conflicts = _conflicts()
+    stale.update_field("hobbies", ["calcio"])
+    stale.add_conversation_turn("user", "gioco a calcio")
+    assert manager.update_session(stale.session_id, stale)
+
+    stored = manager.get_session(stale.session_id)
+    assert stored is stale and stored.version == 2
+    assert stored.location == "Roma" and stored.hobbies == ["calcio"]
+    assert [turn.message for turn in stored.history_tail] == ["abito a Roma", "gioco a calcio"]
+    assert stored.history_total == 2
+    assert _conflicts() == conflicts + 1
+    print("✅ Modifiche di entrambe le copie conservate")
+
+
+def test_redis_workers_merge():
+    """Due worker su Redis: il secondo salvataggio non cancella le modifiche del primo."""
+    print("\n🧪 Test 2: Conflitto tra worker su Redis...")
+    pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # Script Lua del salvataggio
+
+    server = fakeredis.FakeServer()
+    workers = []
+    for _ in range(2):
+        manager = StateManager()
+        manager.backend = "redis"
+        manager.store = RedisSessionStore(
+            client=fakeredis.FakeRedis(server=server, decode_responses=True),
+            ttl_seconds=60, near_cache_size=100
+        )
+        workers.append(manager)
+    worker_a, worker_b = workers
+    time.sleep(0.1)  # sottoscrizioni attive
+
+    profile_a = worker_a.create_session()
+    profile_b = worker_b.get_session(profile_a.session_id)
+    assert profile_b is not None and profile_b.version == profile_a.version == 1
+
+    profile_a.update_field("location", "Torino")
+    profile_a.update_field("favorite_subjects", ["storia"])
+    profile_a.add_conversation_turn("user", "abito a Torino")
+    assert worker_a.update_session(profile_a.session_id, profile_a)
+
+    profile_b.update_field("favorite_subjects", ["fisica"])
+    profile_b.add_conversation_turn("user", "mi piace la fisica")
+    assert worker_b.update_session(profile_b.session_id, profile_b)
+    assert profile_b.version == 3
+
+    fresh = RedisSessionStore(client=fakeredis.FakeRedis(server=server, decode_responses=True),
+                              ttl_seconds=60, near_cache_size=0)
+    merged = fresh.load(profile_a.session_id)
+    assert merged.version == 3
+    assert merged.location == "Torino"
+    assert merged.favorite_subjects == ["storia", "fisica"]
+    assert [turn.message for turn in fresh.read_history(merged.session_id, 10)] == \
+        ["abito a Torino", "mi piace la fisica"]
+
+    for manager in workers:
+        manager.store.close()
+    print("✅ Conflitto rilevato e modifiche unite")
+
+
+def test_redis_version_survives_rewrite():
+    """Dopo una riscrittura completa dell'hash la versione continua a crescere."""
+    print("\n🧪 Test 3: Versione monotona dopo la riscrittura...")
+    pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # Script Lua del salvataggio
+
+    store = RedisSessionStore(client=fakeredis.FakeRedis(decode_responses=True), ttl_seconds=60, near_cache_size=0)
+    manager = StateManager()
+    manager.backend = "redis"
+    manager.store = store
+
+    profile = manager.create_session()
+    stale = store.load(profile.session_id)  # Copia letta alla versione 1
+    profile.update_field("location", "Torino")
+    assert manager.update_session(profile.session_id, profile) and profile.version == 2
+
+    store._written.clear()  # Stato remoto dimenticato (espulso dall'LRU): hash riscritto
+    profile.update_field("school_type", "Liceo Classico")
+    assert manager.update_session(profile.session_id, profile) and profile.version == 3
+
+    # La copia vecchia non può più passare il CAS e sovrascrivere i dati
+    conflicts = _conflicts()
+    stale.update_field("hobbies", ["calcio"])
+    assert manager.update_session(stale.session_id, stale)
+    assert _conflicts() == conflicts + 1
+    stored = store.load(profile.session_id)
+    assert stored.version == 4
+    assert (stored.location, stored.school_type, stored.hobbies) == ("Torino", "Liceo Classico", ["calcio"])
+    store.close()
+    print("✅ Versione 3 dopo la riscrittura, copia vecchia unita invece che sovrascritta")
+
+
+if __name__ == "__main__":
+    print("🚀 Test versioni del profilo...")
+    print("=" * 50)
+
+    test_memory_conflict_merge()
+    test_redis_workers_merge()
+    test_redis_version_survives_rewrite()
+
+    print("\n" + "=" * 50)
+    print("✅ Tutti i test completati!")
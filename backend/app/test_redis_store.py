@@ -0,0 +1,164 @@
+"""
+Test del backend Redis per le sessioni (usa fakeredis al posto di un server reale).
+"""
+import json
+import time
+
+import pytest
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+# Import assoluti
+try:
+    from redis_store import RedisSessionStore
+    from student_profile import StudentProfile
+except ImportError:
+    import sys
+    import os
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from redis_store import RedisSessionStore
+    from student_profile import StudentProfile
+
+
+def _new_store(near_cache_size=0, server=None, ttl_seconds=60):
+    client = fakeredis.FakeRedis(server=server, decode_responses=True)
+    return RedisSessionStore(client=client, ttl_seconds=ttl_seconds, near_cache_size=near_cache_size), client
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_roundtrip():
+    """Profilo e cronologia tornano identici dopo salvataggio e lettura."""
+    print("🧪 Test 1: Salvataggio e lettura...")
+    pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # Script Lua del salvataggio
+
+    store, client = _new_store()
+    profile = StudentProfile()
+    profile.update_field("location", "Bologna")
+    profile.update_field("favorite_subjects", ["matematica", "fisica"])
+    profile.add_conversation_turn("user", "abito a Bologna")
+    profile.add_conversation_turn("assistant", "Perfetto, Bologna!")
+    store.save(profile)
+
+    loaded = store.load(profile.session_id)
+    assert loaded.model_dump() == profile.model_dump()
+    assert client.llen(f"session:{profile.session_id}:history") == 2
+    assert 0 < client.ttl(f"session:{profile.session_id}") <= 60
+    assert store.load("inesistente") is None
+    print("✅ Profilo ricaricato correttamente")
+
+
+def test_delta_writes():
+    """Solo i campi cambiati e i nuovi turni vengono riscritti."""
+    print("\n🧪 Test 2: Scritture differenziali...")
+    pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # Script Lua del salvataggio
+
+    store, client = _new_store()
+    profile = StudentProfile()
+    profile.add_conversation_turn("user", "ciao")
+    store.save(profile)
+
+    # Un campo non toccato dal profilo locale non deve essere sovrascritto
+    client.hset(f"session:{profile.session_id}", "hobbies", json.dumps(["calcio"]))
+    profile.update_field("location", "Milano")
+    profile.add_conversation_turn("assistant", "Che scuola frequenti?")
+    commands = []
+    execute = client.execute_command
+    client.execute_command = lambda *args, **kwargs: commands.append(args[0]) or execute(*args, **kwargs)
+    store.save(profile)
+    assert commands == ["EVALSHA"]  # Controllo della versione e scritture in un solo round-trip
+
+    raw = client.hgetall(f"session:{profile.session_id}")
+    assert json.loads(raw["location"]) == "Milano"
+    assert json.loads(raw["hobbies"]) == ["calcio"]
+    history = client.lrange(f"session:{profile.session_id}:history", 0, -1)
+    assert [json.loads(turn)[1] for turn in history] == ["ciao", "Che scuola frequenti?"]
+    print("✅ Solo le differenze sono state scritte")
+
+
+def test_delete():
+    """La cancellazione rimuove hash e cronologia."""
+    print("\n🧪 Test 3: Cancellazione...")
+    pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # Script Lua del salvataggio
+
+    store, client = _new_store()
+    profile = StudentProfile()
+    profile.add_conversation_turn("user", "ciao")
+    store.save(profile)
+    assert store.exists(profile.session_id)
+
+    store.delete(profile.session_id)
+    assert not store.exists(profile.session_id)
+    assert client.llen(f"session:{profile.session_id}:history") == 0
+    print("✅ Sessione eliminata")
+
+
+def test_near_cache_invalidation():
+    """Due worker: le letture ripetute non toccano Redis, le scritture altrui invalidano."""
+    print("\n🧪 Test 4: Near-cache con invalidazione pub/sub...")
+    pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # Script Lua del salvataggio
+
+    server = fakeredis.FakeServer()
+    worker_a, _ = _new_store(near_cache_size=100, server=server)
+    worker_b, _ = _new_store(near_cache_size=100, server=server)
+    time.sleep(0.1)  # sottoscrizioni attive
+
+    profile = StudentProfile()
+    worker_a.save(profile)
+    assert _wait_for(lambda: worker_b._generation == 1)  # invalidazione della prima scrittura
+    cached = worker_b.load(profile.session_id)
+    assert worker_b.load(profile.session_id) is cached
+
+    profile.update_field("location", "Torino")
+    worker_a.save(profile)
+    assert _wait_for(lambda: profile.session_id not in worker_b._near)
+    assert worker_b.load(profile.session_id).location == "Torino"
+
+    worker_a.close()
+    worker_b.close()
+    print("✅ Voce invalidata dopo la scrittura dell'altro worker")
+
+
+def test_near_cache_respects_expiry():
+    """Una sessione scaduta in Redis non viene riportata in vita dalla near-cache."""
+    print("\n🧪 Test 5: Near-cache e scadenza della chiave...")
+    pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # Script Lua del salvataggio
+
+    store, client = _new_store(near_cache_size=100, ttl_seconds=1)
+    profile = StudentProfile()
+    store.save(profile)
+    assert store.exists(profile.session_id)
+
+    time.sleep(1.1)
+    assert not client.exists(f"session:{profile.session_id}")
+    assert not store.exists(profile.session_id)
+    assert store.load(profile.session_id) is None
+    store.close()
+    print("✅ Voce scartata alla scadenza della chiave")
+
+
+if __name__ == "__main__":
+    print("🚀 Test backend Redis...")
+    print("=" * 50)
+
+    test_roundtrip()
+    test_delta_writes()
+    test_delete()
+    test_near_cache_invalidation()
+    test_near_cache_respects_expiry()
+
+    print("\n" + "=" * 50)
+    print("✅ Tutti i test completati!")
@@ -0,0 +1,86 @@
+"""
+Test della cache delle ricerche web (memoria + SQLite).
+"""
+import os
+import time
+import tempfile
+
+# Import assoluti
+try:
+    from search_cache import SearchCache
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from search_cache import SearchCache
+
+
+def _new_cache(db_path=None, **kwargs):
+    db_path = db_path or os.path.join(tempfile.mkdtemp(), 'search_cache.sqlite3')
+    return SearchCache(db_path=db_path, **kwargs), db_path
+
+
+def test_normalized_key():
+    """Query con maiuscole/spazi diversi condividono la voce; max_results no."""
+    print("🧪 Test 1: Chiave normalizzata...")
+
+    cache, _ = _new_cache(ttl_seconds=60)
+    cache.set("Corso di laurea  Informatica Milano", "it-it", 10, [{"title": "Informatica"}])
+
+    assert cache.get("corso di laurea informatica milano", "it-it", 10) == [{"title": "Informatica"}]
+    assert cache.get("corso di laurea informatica milano", "it-it", 5) is None
+    assert cache.get("corso di laurea informatica milano", "us-en", 10) is None
+    print("✅ Chiavi corrette")
+
+
+def test_survives_restart():
+    """Le voci su disco sono visibili da una nuova istanza."""
+    print("\n🧪 Test 2: Persistenza su disco...")
+
+    cache, db_path = _new_cache(ttl_seconds=60)
+    cache.set("ITS corso meccatronica", "it-it", 8, [{"title": "ITS Meccatronica"}])
+
+    reopened, _ = _new_cache(db_path=db_path, ttl_seconds=60)
+    assert reopened.get("ITS corso meccatronica", "it-it", 8) == [{"title": "ITS Meccatronica"}]
+    print("✅ Cache ricaricata dopo il riavvio")
+
+
+def test_expiry_and_lru():
+    """Le voci scadono dopo il TTL e la memoria rispetta il limite."""
+    print("\n🧪 Test 3: Scadenza e limite LRU...")
+
+    cache, _ = _new_cache(ttl_seconds=0.2, memory_items=2)
+    for i in range(3):
+        cache.set(f"query {i}", "it-it", 8, [{"title": str(i)}])
+    assert len(cache._memory) == 2
+
+    time.sleep(0.3)
+    assert cache.get("query 2", "it-it", 8) is None
+    print("✅ Scadenza e LRU rispettati")
+
+
+def test_lazy_open_and_no_memory_tier():
+    """Il database si apre al primo utilizzo; memory_items=0 lascia solo il livello su disco."""
+    print("\n🧪 Test 4: Apertura pigra e livello in memoria disattivato...")
+
+    cache, db_path = _new_cache(ttl_seconds=60, memory_items=0)
+    assert not os.path.exists(db_path)
+
+    cache.set("Corso di laurea Fisica Padova", "it-it", 8, [{"title": "Fisica"}])
+    assert os.path.exists(db_path)
+    assert len(cache._memory) == 0
+    assert cache.get("corso di laurea fisica padova", "it-it", 8) == [{"title": "Fisica"}]
+    assert len(cache._memory) == 0
+    print("✅ Database creato alla prima scrittura, nessuna voce in memoria")
+
+
+if __name__ == "__main__":
+    print("🚀 Test cache ricerche web...")
+    print("=" * 50)
+
+    test_normalized_key()
+    test_survives_restart()
+    test_expiry_and_lru()
+    test_lazy_open_and_no_memory_tier()
+
+    print("\n" + "=" * 50)
+    print("✅ Tutti i test completati!")
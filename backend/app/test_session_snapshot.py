@@ -0,0 +1,91 @@
+"""
+Test dello snapshot delle sessioni per il riavvio a caldo.
+"""
+import os
+import asyncio
+import tempfile
+from datetime import datetime, timedelta
+
+# Import assoluti
+try:
+    import profile_codec
+    from state_manager import StateManager
+    from session_snapshot import SessionSnapshot, write_snapshot
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    import profile_codec
+    from state_manager import StateManager
+    from session_snapshot import SessionSnapshot, write_snapshot
+
+
+def _manager(path):
+    manager = StateManager()
+    manager.snapshot_path = path
+    return manager
+
+
+def test_index_lookup():
+    """Ricerca binaria sull'indice e ripristino una sola volta."""
+    print("🧪 Test 1: Indice dello snapshot...")
+
+    path = os.path.join(tempfile.mkdtemp(), 'sessions.snap')
+    manager = _manager(path)
+    profiles = [manager.create_session() for _ in range(50)]
+    records = [(p.session_id, p.last_updated.timestamp(), profile_codec.encode(p)) for p in profiles]
+    assert write_snapshot(path, records) == 50
+
+    snapshot = SessionSnapshot.open(path)
+    for profile in profiles:
+        assert profile.session_id in snapshot
+    assert "inesistente" not in snapshot
+
+    restored = snapshot.take(profiles[7].session_id)
+    assert restored.model_dump() == profiles[7].model_dump()
+    assert snapshot.take(profiles[7].session_id) is None
+    assert len(list(snapshot.remaining())) == 49
+    snapshot.close()
+    print("✅ 50 sessioni indicizzate")
+
+
+def test_warm_restart():
+    """Le sessioni sopravvivono a due riavvii; quelle scadute no."""
+    print("\n🧪 Test 2: Riavvio a caldo...")
+
+    path = os.path.join(tempfile.mkdtemp(), 'sessions.snap')
+    before = _manager(path)
+    active = before.create_session()
+    active.update_field("location", "Bologna")
+    active.add_conversation_turn("user", "abito a Bologna")
+    idle = before.create_session()
+    idle.last_updated = datetime.now() - timedelta(days=2)
+    before.update_session(idle.session_id, idle)
+    untouched = before.create_session()
+    asyncio.run(before.shutdown())
+
+    # Primo riavvio: viene ripresa solo una sessione
+    after = _manager(path)
+    after.load_snapshot()
+    assert after.session_exists(active.session_id)
+    assert not after.session_exists(idle.session_id)
+    profile = after.get_session(active.session_id)
+    assert profile.location == "Bologna" and profile.history_total == 1
+    asyncio.run(after.shutdown())
+
+    # Secondo riavvio: la sessione mai ripresa è ancora nello snapshot
+    again = _manager(path)
+    again.load_snapshot()
+    assert again.get_session(untouched.session_id) is not None
+    assert again.get_session(active.session_id).location == "Bologna"
+    print("✅ Conversazioni riprese dopo il riavvio")
+
+
+if __name__ == "__main__":
+    print("🚀 Test snapshot sessioni...")
+    print("=" * 50)
+
+    test_index_lookup()
+    test_warm_restart()
+
+    print("\n" + "=" * 50)
+    print("✅ Tutti i test completati!")
@@ -0,0 +1,124 @@
+"""
+Test dei livelli hot/warm/cold delle sessioni.
+"""
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+# Import assoluti
+try:
+    from state_manager import StateManager
+    from session_tiers import SessionTiers
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from state_manager import StateManager
+    from session_tiers import SessionTiers
+
+
+def _manager(warm_max_bytes=1024 * 1024):
+    manager = StateManager()
+    manager.tiers = SessionTiers(
+        db_path=os.path.join(tempfile.mkdtemp(), 'hibernated.sqlite3'),
+        warm_max_bytes=warm_max_bytes
+    )
+    return manager
+
+
+def _idle_session(manager, minutes=30, location="Bologna"):
+    profile = manager.create_session()
+    profile.update_field("location", location)
+    profile.add_conversation_turn("user", f"abito a {location}")
+    profile.last_updated = datetime.now() - timedelta(minutes=minutes)
+    manager.update_session(profile.session_id, profile)
+    return profile
+
+
+def test_idle_hibernation():
+    """Le sessioni inattive vengono ibernate e risvegliate in modo trasparente."""
+    print("🧪 Test 1: Ibernazione delle sessioni inattive...")
+
+    manager = _manager()
+    idle = _idle_session(manager)
+    active = manager.create_session()
+
+    assert manager.hibernate_idle() == 1
+    assert list(manager.sessions) == [active.session_id]
+    assert manager.session_exists(idle.session_id)
+
+    restored = manager.get_session(idle.session_id)
+    assert restored.model_dump() == idle.model_dump()
+    assert idle.session_id in manager.sessions and idle.session_id not in manager.tiers
+    print("✅ Sessione ibernata e risvegliata")
+
+
+def test_warm_budget_spills_to_cold():
+    """Oltre il budget in RAM le sessioni ibernate finiscono su disco."""
+    print("\n🧪 Test 2: Budget del livello warm...")
+
+    manager = _manager(warm_max_bytes=600)
+    profiles = [_idle_session(manager, location=city) for city in ("Roma", "Milano", "Napoli", "Torino", "Bari")]
+    manager.hibernate_idle()
+
+    tiers = manager.tiers
+    assert tiers.warm_bytes <= 600 and tiers.cold_count > 0
+    assert len(tiers) == len(profiles)
+    assert manager.get_session(profiles[0].session_id).location == "Roma"
+    assert tiers.cold_count == len(profiles) - len(tiers._warm) - 1
+    print(f"✅ {len(tiers._warm)} sessioni in RAM, {tiers.cold_count} su disco")
+
+
+def test_expiry_reaches_hibernated():
+    """Le sessioni ibernate scadono come quelle attive."""
+    print("\n🧪 Test 3: Scadenza delle sessioni ibernate...")
+
+    manager = _manager()
+    manager.session_ttl = 60
+    profile = _idle_session(manager)
+    manager.hibernate_idle()
+    assert profile.session_id in manager.tiers
+
+    assert manager.sweep_expired() == 1
+    assert not manager.session_exists(profile.session_id)
+    print("✅ Sessione ibernata scaduta")
+
+
+def test_no_stale_hibernated_copy():
+    """Una sessione tornata hot non lascia copie ibernate; l'LRU non iberna turni in corso."""
+    print("\n🧪 Test 4: Nessuna copia ibernata superata...")
+
+    manager = _manager()
+    manager.session_ttl = 60
+    held = _idle_session(manager, minutes=0)
+    manager._hibernate(held.session_id)  # Ibernata mentre il turno teneva il profilo
+    held.add_conversation_turn("agent", "Che scuola frequenti?")
+    held.last_updated = datetime.now() - timedelta(minutes=5)
+    manager.update_session(held.session_id, held)
+    assert held.session_id in manager.sessions and held.session_id not in manager.tiers
+
+    assert manager.sweep_expired() == 1
+    assert manager.get_session(held.session_id) is None
+    assert not manager.session_exists(held.session_id)
+
+    # Overflow LRU: la sessione con un turno in corso resta hot
+    manager.max_sessions = 2
+    busy = manager.create_session()
+    manager._turn_pending[busy.session_id] = 1
+    idle = manager.create_session()
+    manager.create_session()
+    assert busy.session_id in manager.sessions and idle.session_id in manager.tiers
+    del manager._turn_pending[busy.session_id]
+    print("✅ Copia ibernata scartata, sessione in uso non ibernata")
+
+
+if __name__ == "__main__":
+    print("🚀 Test livelli delle sessioni...")
+    print("=" * 50)
+
+    test_idle_hibernation()
+    test_warm_budget_spills_to_cold()
+    test_expiry_reaches_hibernated()
+    test_no_stale_hibernated_copy()
+
+    print("\n" + "=" * 50)
+    print("✅ Tutti i test completati!")
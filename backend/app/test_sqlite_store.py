@@ -0,0 +1,125 @@
+"""
+Test del backend SQLite per le sessioni (scrittura differita e working set).
+"""
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+# Import assoluti
+try:
+    from sqlite_store import SQLiteSessionStore
+    from student_profile import StudentProfile
+    from turn_log import TurnArchive, Turn
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from sqlite_store import SQLiteSessionStore
+    from student_profile import StudentProfile
+    from turn_log import TurnArchive, Turn
+
+
+def _new_store(db_path=None, **kwargs):
+    db_path = db_path or os.path.join(tempfile.mkdtemp(), 'sessions.sqlite3')
+    kwargs.setdefault("flush_interval_ms", 60000)  # flush solo esplicito nei test
+    kwargs.setdefault("archive", TurnArchive(os.path.join(os.path.dirname(db_path), 'history.sqlite3')))
+    return SQLiteSessionStore(db_path=db_path, **kwargs), db_path
+
+
+def _profile(location="Bologna"):
+    profile = StudentProfile()
+    profile.update_field("location", location)
+    profile.add_conversation_turn("user", f"abito a {location}")
+    return profile
+
+
+def test_write_behind():
+    """Il salvataggio non tocca il disco finché la coda non viene svuotata."""
+    print("🧪 Test 1: Scrittura differita...")
+
+    store, db_path = _new_store()
+    profile = _profile()
+    store.save(profile)
+    assert store.load(profile.session_id) is profile
+
+    reader, _ = _new_store(db_path=db_path)
+    assert reader.load(profile.session_id) is None
+
+    assert store.flush() == 1
+    loaded = reader.load(profile.session_id)
+    assert loaded.model_dump() == profile.model_dump()
+    store.close()
+    reader.close()
+    print("✅ Profilo scritto al flush")
+
+
+def test_survives_restart():
+    """close() scrive la coda: una nuova istanza ritrova le sessioni."""
+    print("\n🧪 Test 2: Persistenza dopo il riavvio...")
+
+    store, db_path = _new_store()
+    profiles = [_profile(city) for city in ("Milano", "Torino", "Napoli")]
+    for profile in profiles:
+        store.save(profile)
+    store.delete(profiles[2].session_id)
+    store.close()
+
+    reopened, _ = _new_store(db_path=db_path)
+    assert reopened.load(profiles[0].session_id).location == "Milano"
+    assert reopened.exists(profiles[1].session_id)
+    assert not reopened.exists(profiles[2].session_id)
+    reopened.close()
+    print("✅ Sessioni ritrovate")
+
+
+def test_working_set_limit():
+    """Il working set resta limitato; i profili usciti vengono riletti."""
+    print("\n🧪 Test 3: Working set limitato...")
+
+    store, _ = _new_store(working_set_size=2)
+    profiles = [_profile(city) for city in ("Roma", "Bari", "Pisa")]
+    for profile in profiles:
+        store.save(profile)
+    assert len(store._working_set) == 2
+
+    # Ancora in coda: letto dallo snapshot non scritto
+    assert store.load(profiles[0].session_id).location == "Roma"
+    store.flush()
+    store._working_set.clear()
+    assert store.load(profiles[1].session_id).location == "Bari"
+    store.close()
+    print("✅ Working set rispettato")
+
+
+def test_expired_sessions_removed():
+    """Al flush le sessioni inattive oltre il TTL spariscono, con i turni archiviati."""
+    print("\n🧪 Test 4: Scadenza delle sessioni...")
+
+    store, db_path = _new_store(ttl_seconds=3600)
+    stale, fresh = _profile("Lecce"), _profile("Siena")
+    stale.last_updated = datetime.now() - timedelta(hours=2)
+    store.save(stale)
+    store.save(fresh)
+    store.archive.append(stale.session_id, 0, [Turn.create("user", "messaggio vecchio", 0.0)])
+    store.flush()
+
+    assert not store.exists(stale.session_id)
+    assert store.load(fresh.session_id).location == "Siena"
+    assert store.archive.read(stale.session_id) == []
+    with store._db_lock:
+        rows = store._db.execute("SELECT session_id, last_updated FROM sessions").fetchall()
+    assert rows == [(fresh.session_id, fresh.last_updated.timestamp())]
+    store.close()
+    print("✅ Sessione scaduta eliminata dal database e dall'archivio")
+
+
+if __name__ == "__main__":
+    print("🚀 Test backend SQLite...")
+    print("=" * 50)
+
+    test_write_behind()
+    test_survives_restart()
+    test_working_set_limit()
+    test_expired_sessions_removed()
+
+    print("\n" + "=" * 50)
+    print("✅ Tutti i test completati!")
@@ -0,0 +1,145 @@
+"""
+Test della scadenza delle sessioni in memoria (min-heap + limite LRU) e dei turni per sessione.
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+# Import assoluti
+try:
+    from state_manager import StateManager, SessionBusyError
+except ImportError:
+    import sys
+    import os
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from state_manager import StateManager, SessionBusyError
+
+
+def _manager(**settings):
+    manager = StateManager()
+    for name, value in settings.items():
+        setattr(manager, name, value)
+    return manager
+
+
+def test_expiry_uses_last_updated():
+    """Scadono le sessioni inattive, non quelle create da tempo ma ancora attive."""
+    print("🧪 Test 1: Scadenza per inattività...")
+
+    manager = _manager(session_ttl=60)
+    idle = manager.create_session()
+    active = manager.create_session()
+
+    long_ago = datetime.now() - timedelta(minutes=5)
+    idle.last_updated = long_ago
+    manager.update_session(idle.session_id, idle)
+    active.created_at = long_ago
+    active.add_conversation_turn("user", "ciao")
+    manager.update_session(active.session_id, active)
+
+    assert manager.sweep_expired() == 1
+    assert not manager.session_exists(idle.session_id)
+    assert manager.session_exists(active.session_id)
+    print("✅ Solo la sessione inattiva è scaduta")
+
+
+def test_sweep_in_slices():
+    """Lo sweeper elimina al più sweep_slice sessioni per chiamata."""
+    print("\n🧪 Test 2: Eliminazione a blocchi...")
+
+    manager = _manager(session_ttl=0.05, sweep_slice=3)
+    for _ in range(7):
+        manager.create_session()
+    time.sleep(0.1)
+
+    assert [manager.sweep_expired() for _ in range(4)] == [3, 3, 1, 0]
+    assert not manager.sessions and not manager._expiry_heap
+    print("✅ Sessioni eliminate in blocchi da 3")
+
+
+def test_lru_cap():
+    """Oltre max_sessions la sessione usata meno di recente esce dal livello hot."""
+    print("\n🧪 Test 3: Limite LRU...")
+
+    manager = _manager(max_sessions=2)
+    first = manager.create_session()
+    second = manager.create_session()
+    manager.get_session(first.session_id)  # first diventa la più recente
+    third = manager.create_session()
+
+    assert list(manager.sessions) == [first.session_id, third.session_id]
+    assert second.session_id in manager.tiers
+    assert manager.session_exists(second.session_id)
+    print("✅ Ibernata la sessione meno recente")
+
+
+def test_turns_run_in_order():
+    """I turni della stessa sessione non si sovrappongono e seguono l'ordine di arrivo."""
+    print("\n🧪 Test 4: Turni in ordine...")
+
+    manager = _manager(max_pending_turns=5)
+    session_id = manager.create_session().session_id
+    log = []
+
+    async def turn(n):
+        async with manager.session_turn(session_id):
+            log.append(f"inizio {n}")
+            await asyncio.sleep(0.01 * (3 - n))  # Il primo turno è il più lento
+            log.append(f"fine {n}")
+
+    async def run():
+        await asyncio.gather(*(turn(n) for n in range(3)))
+
+    asyncio.run(run())
+    assert log == ["inizio 0", "fine 0", "inizio 1", "fine 1", "inizio 2", "fine 2"]
+    assert not manager._turn_pending and not manager._turn_locks
+    print("✅ Tre turni eseguiti uno alla volta")
+
+
+def test_turn_queue_full():
+    """Oltre max_pending_turns in attesa il turno viene rifiutato; le altre sessioni non aspettano."""
+    print("\n🧪 Test 5: Coda dei turni piena...")
+
+    manager = _manager(max_pending_turns=1)
+    busy = manager.create_session().session_id
+    other = manager.create_session().session_id
+
+    async def run():
+        release = asyncio.Event()
+
+        async def hold():
+            async with manager.session_turn(busy):
+                await release.wait()
+
+        tasks = [asyncio.create_task(hold()) for _ in range(2)]  # Uno in corso, uno in attesa
+        await asyncio.sleep(0)
+        assert manager.turn_queue_full(busy)
+        try:
+            async with manager.session_turn(busy):
+                rejected = False
+        except SessionBusyError:
+            rejected = True
+        async with manager.session_turn(other):
+            other_ran = True
+        release.set()
+        await asyncio.gather(*tasks)
+        return rejected, other_ran
+
+    rejected, other_ran = asyncio.run(run())
+    assert rejected and other_ran
+    assert not manager.turn_queue_full(busy)
+    print("✅ Terzo turno rifiutato, altra sessione servita subito")
+
+
+if __name__ == "__main__":
+    print("🚀 Test scadenza sessioni...")
+    print("=" * 50)
+
+    test_expiry_uses_last_updated()
+    test_sweep_in_slices()
+    test_lru_cap()
+    test_turns_run_in_order()
+    test_turn_queue_full()
+
+    print("\n" + "=" * 50)
+    print("✅ Tutti i test completati!")
@@ -0,0 +1,125 @@
+"""
+Test della contabilità dei token e della compattazione dei prompt entro il budget.
+"""
+import os
+
+import httpx
+from google import genai
+from google.genai import types
+
+os.environ.setdefault("GEMINI_API_KEY", "test")
+
+# Import assoluti
+try:
+    from metrics import metrics
+    from student_profile import StudentProfile
+    from llm_gateway import LLMGateway
+    from token_budget import TokenBudget, estimate_tokens, truncate, FULL, SUMMARIZED
+    from app.gemini_agent import GeminiOrientationAgent  # Import relativo di web_searcher
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from metrics import metrics
+    from student_profile import StudentProfile
+    from llm_gateway import LLMGateway
+    from token_budget import TokenBudget, estimate_tokens, truncate, FULL, SUMMARIZED
+    from app.gemini_agent import GeminiOrientationAgent
+
+
+def test_estimate_and_truncate():
+    """La stima cresce con il testo e truncate resta entro il limite."""
+    print("🧪 Test 1: Stima dei token...")
+
+    short = estimate_tokens("Abito a Bologna")
+    long = estimate_tokens("Abito a Bologna e frequento il liceo scientifico, mi piacciono matematica e fisica.")
+    assert 3 <= short < long
+    assert estimate_tokens(truncate("parola " * 200, 20)) <= 21  # +1 per i puntini
+    assert truncate("breve", 20) == "breve"
+    print(f"✅ {short} e {long} token stimati")
+
+
+def test_compact_profile_context():
+    """Il contesto compatto omette i campi vuoti e accorcia le liste."""
+    print("\n🧪 Test 2: Contesto del profilo compatto...")
+
+    profile = StudentProfile()
+    profile.location = "Bologna"
+    profile.hobbies = ["calcio", "chitarra", "lettura", "scacchi"]
+
+    full = profile.profile_context()
+    compact = profile.profile_context(compact=True, list_limit=2)
+    assert "Tipo scuola: Non specificato" in full
+    assert "Tipo scuola:" not in compact and "Mancano: Tipo scuola" in compact
+    assert "Hobby: lettura, scacchi (+2 altri)" in compact
+    assert estimate_tokens(compact) < estimate_tokens(full)
+    print(f"✅ {estimate_tokens(full)} → {estimate_tokens(compact)} token")
+
+
+def test_fit_within_budget():
+    """fit sceglie il primo livello che rientra nel budget."""
+    print("\n🧪 Test 3: Compattazione entro il budget...")
+
+    budget = TokenBudget()
+    budget.budgets["question"] = 10
+    prompts = {level: "parola " * (40 - level * 10) for level in range(SUMMARIZED + 1)}
+    before = metrics.snapshot()["counters"].get("prompt_compactions_question", 0)
+
+    assert budget.fit("question", lambda level: prompts[level]) == prompts[SUMMARIZED]
+    budget.budgets["question"] = 1000
+    assert budget.fit("question", lambda level: prompts[level]) == prompts[FULL]
+    assert metrics.snapshot()["counters"]["prompt_compactions_question"] == before + 1
+    print("✅ Livello scelto in base al budget")
+
+
+def test_fresh_profile_full_prompts():
+    """Al primo turno, con il profilo vuoto, i prompt restano al livello FULL."""
+    print("\n🧪 Test 4: Prompt completi con il profilo vuoto...")
+
+    agent = GeminiOrientationAgent()
+    agent.dialogue_policy = False
+    _, profile = agent.start_new_conversation()
+    message = "Ciao! Abito a Bologna e frequento il quarto anno del liceo scientifico, mi piace la fisica."
+
+    assert agent._build_extraction_prompt(profile, message) == agent._render_extraction_prompt(profile, message, FULL)
+    assert agent._build_question_prompt(profile, message) == agent._render_question_prompt(profile, message, FULL)
+    assert agent._build_fused_prompt(profile, message) == agent._render_fused_prompt(profile, message, FULL)
+    tokens = estimate_tokens(agent._build_extraction_prompt(profile, message))
+    print(f"✅ Estrazione al livello FULL con {tokens} token")
+
+
+def test_gateway_records_usage():
+    """Il gateway registra i token per tipo di chiamata usando usage_metadata."""
+    print("\n🧪 Test 5: Token per tipo di chiamata...")
+
+    def reply(request):
+        return httpx.Response(200, json={
+            "candidates": [{"content": {"role": "model", "parts": [{"text": "ciao"}]}, "finishReason": "STOP"}],
+            "usageMetadata": {"promptTokenCount": 42, "candidatesTokenCount": 3, "totalTokenCount": 45},
+        })
+
+    client = genai.Client(api_key="test", http_options=types.HttpOptions(
+        httpx_client=httpx.Client(transport=httpx.MockTransport(reply)),
+    ))
+    counters = lambda: metrics.snapshot()["counters"]
+    before_in = counters().get("llm_input_tokens_extraction", 0)
+    before_out = counters().get("llm_output_tokens_extraction", 0)
+
+    LLMGateway(client=client).generate("modello", "Abito a Bologna", 0.1, 10, call_type="extraction")
+    assert counters()["llm_input_tokens_extraction"] == before_in + 42
+    assert counters()["llm_output_tokens_extraction"] == before_out + 3
+    print("✅ 42 token in ingresso e 3 in uscita registrati")
+
+
+if __name__ == "__main__":
+    print("🚀 Test budget dei token...")
+    print("=" * 50)
+
+    test_estimate_and_truncate()
+    test_compact_profile_context()
+    test_fit_within_budget()
+    test_fresh_profile_full_prompts()
+    test_gateway_records_usage()
+
+    print("\n" + "=" * 50)
+    print("✅ Tutti i test completati!")
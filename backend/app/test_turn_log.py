@@ -0,0 +1,74 @@
+"""
+Test del registro compatto dei turni (coda in memoria + archivio su disco).
+"""
+import os
+import tempfile
+
+# Import assoluti
+try:
+    import state_manager as state_module
+    from state_manager import StateManager
+    from student_profile import StudentProfile
+    from turn_log import Turn, TurnArchive, HISTORY_HOT_TURNS, HISTORY_SPILL_BATCH
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    import state_manager as state_module
+    from state_manager import StateManager
+    from student_profile import StudentProfile
+    from turn_log import Turn, TurnArchive, HISTORY_HOT_TURNS, HISTORY_SPILL_BATCH
+
+
+def _use_temp_archive():
+    state_module.turn_archive = TurnArchive(os.path.join(tempfile.mkdtemp(), 'history.sqlite3'))
+
+
+def test_compact_turns():
+    """Turni come tuple con ruoli internati; il vecchio formato viene convertito."""
+    print("🧪 Test 1: Turni compatti...")
+
+    profile = StudentProfile()
+    profile.add_conversation_turn("user", "ciao")
+    restored = StudentProfile.model_validate_json(profile.model_dump_json())
+    assert isinstance(restored.history_tail[0], Turn)
+    assert restored.history_tail[0].role is profile.history_tail[0].role
+
+    legacy = StudentProfile(conversation_history=[
+        {"role": "user", "message": "abito a Bologna", "timestamp": "2024-05-01T10:00:00"}
+    ])
+    assert legacy.history_total == 1
+    assert legacy.conversation_history[0]["message"] == "abito a Bologna"
+    print("✅ Formato compatto e compatibilità")
+
+
+def test_spill_keeps_tail_bounded():
+    """La coda in memoria resta limitata e la cronologia completa è ricostruibile."""
+    print("\n🧪 Test 2: Spostamento su disco...")
+    _use_temp_archive()
+
+    manager = StateManager()
+    profile = manager.create_session()
+    turns = 3 * (HISTORY_HOT_TURNS + HISTORY_SPILL_BATCH)
+    for i in range(turns):
+        profile.add_conversation_turn("user" if i % 2 == 0 else "agent", f"messaggio {i}")
+        manager.update_session(profile.session_id, profile)
+        assert len(profile.history_tail) <= HISTORY_HOT_TURNS + HISTORY_SPILL_BATCH
+
+    history = manager.get_full_history(profile.session_id)
+    assert profile.history_total == turns
+    assert [turn.message for turn in history] == [f"messaggio {i}" for i in range(turns)]
+
+    manager.delete_session(profile.session_id)
+    assert state_module.turn_archive.read(profile.session_id) == []
+    print(f"✅ {turns} turni, {len(profile.history_tail)} in memoria")
+
+
+if __name__ == "__main__":
+    print("🚀 Test registro turni...")
+    print("=" * 50)
+
+    test_compact_turns()
+    test_spill_keeps_tail_bounded()
+
+    print("\n" + "=" * 50)
+    print("✅ Tutti i test completati!")
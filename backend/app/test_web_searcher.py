@@ -0,0 +1,103 @@
+"""
+Test del fan-out parallelo delle ricerche web del profilo (senza rete: ricerca simulata).
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Import dal pacchetto app (backend/web_searcher.py è una copia più vecchia)
+try:
+    from app.web_searcher import WebSearcher
+except ImportError:
+    import sys
+    import os
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from app.web_searcher import WebSearcher
+
+PROFILE = {"favorite_subjects": ["fisica", "matematica"], "location": "Bologna", "school_type": "Liceo Scientifico"}
+RESULT = {"title": "Fisica - Corso di laurea", "url": "https://www.unibo.it/fisica", "snippet": "corso di laurea triennale"}
+
+
+def _searcher(delay_for) -> WebSearcher:
+    """WebSearcher con ricerca simulata: delay_for(query) secondi, poi un risultato."""
+    searcher = WebSearcher()
+
+    def fake_search(query, max_results=8, region="it-it"):
+        time.sleep(delay_for(query))
+        return [RESULT]
+
+    searcher.search_duckduckgo = fake_search
+    return searcher
+
+
+def test_queries_run_in_parallel():
+    """Le query indipendenti partono insieme: il tempo totale è quello della più lenta."""
+    print("🧪 Test 1: Query in parallelo...")
+
+    searcher = _searcher(lambda query: 0.1)
+    started = time.perf_counter()
+    results = searcher.search_for_student_profile(PROFILE, deadline=5)
+    elapsed = time.perf_counter() - started
+
+    assert not results["partial"] and results["timed_out"] == []
+    assert results["university_courses"]["total_results"] == 1
+    assert elapsed < 0.3  # 5 query da 100 ms in serie ne richiederebbero almeno 500
+    print(f"✅ 5 query in {elapsed * 1000:.0f} ms")
+
+
+def test_partial_results_after_deadline():
+    """Allo scadere della deadline si restituisce ciò che è arrivato, con le query mancanti."""
+    print("\n🧪 Test 2: Risultati parziali alla deadline...")
+
+    slow = lambda query: 0.5 if "Almalaurea" in query or "statistiche" in query else 0
+    searcher = _searcher(slow)
+    started = time.perf_counter()
+    results = searcher.search_for_student_profile(PROFILE, deadline=0.2)
+    elapsed = time.perf_counter() - started
+
+    assert results["partial"]
+    assert len(results["timed_out"]) == 4 and all("Bologna" in query for query in results["timed_out"])
+    assert results["university_courses"]["total_results"] == 1
+    assert results["employment_stats"] == []
+    assert elapsed < 0.4
+    print(f"✅ {len(results['timed_out'])} query oltre la deadline, risposta in {elapsed * 1000:.0f} ms")
+
+
+class _NoDefaultExecutor(ThreadPoolExecutor):
+    """Pool di default che rifiuta i lavori: la versione asincrona non deve usarlo."""
+
+    def submit(self, *args, **kwargs):
+        raise AssertionError("thread del pool di default occupato in attesa")
+
+
+def test_async_search_awaits_pool():
+    """La versione asincrona attende i future del pool condiviso, con la stessa deadline."""
+    print("\n🧪 Test 3: Ricerca asincrona sul pool condiviso...")
+
+    slow = lambda query: 0.5 if "Almalaurea" in query or "statistiche" in query else 0
+
+    async def run():
+        asyncio.get_running_loop().set_default_executor(_NoDefaultExecutor())
+        return await _searcher(slow).search_for_student_profile_async(PROFILE, deadline=0.2)
+
+    started = time.perf_counter()
+    results = asyncio.run(run())
+    elapsed = time.perf_counter() - started
+
+    assert results["partial"] and len(results["timed_out"]) == 4
+    assert results["university_courses"]["total_results"] == 1
+    assert elapsed < 0.4
+    print(f"✅ Risposta parziale in {elapsed * 1000:.0f} ms senza thread in attesa")
+
+
+if __name__ == "__main__":
+    print("🚀 Test ricerca web del profilo...")
+    print("=" * 50)
+
+    test_queries_run_in_parallel()
+    test_partial_results_after_deadline()
+    test_async_search_awaits_pool()
+
+    print("\n" + "=" * 50)
+    print("✅ Tutti i test completati!")
@@ -0,0 +1,114 @@
+"""
+Contabilità dei token e budget dei prompt.
+- Stima locale dei token (nessuna chiamata a count_tokens): parole e punteggiatura,
+  con le parole lunghe che valgono più token, tarata sull'italiano dei prompt.
+- Registro per tipo di chiamata (extraction, question, fused, recommendation) dei
+  token in ingresso e in uscita; se la risposta riporta usage_metadata si usano
+  i conteggi reali e si misura lo scarto della stima.
+- Budget per tipo di chiamata (PROMPT_BUDGET_*): il prompt viene ricostruito a livelli
+  di compattazione crescenti finché non ci sta, così la dimensione del prompt (e la
+  latenza per turno) resta piatta mentre il profilo si riempie.
+"""
+import os
+import re
+from typing import Any, Callable, Dict, Optional
+
+try:
+    from metrics import metrics
+except ImportError:
+    from .metrics import metrics
+
+# Livelli di compattazione, dal prompt completo al più corto
+FULL = 0  # Prompt originale
+COMPACT_PROFILE = 1  # Contesto del profilo senza i campi vuoti
+SHORT_INSTRUCTIONS = 2  # Istruzioni ridotte, senza esempi
+SUMMARIZED = 3  # Liste e testi lunghi riassunti (ultimi elementi, testo troncato)
+LEVELS = (FULL, COMPACT_PROFILE, SHORT_INSTRUCTIONS, SUMMARIZED)
+
+# question, fused e recommendation includono memoria e ultimi turni della conversazione;
+# extraction ha le istruzioni più lunghe (circa 570 token al livello FULL con il profilo vuoto)
+DEFAULT_BUDGETS = {"extraction": 700, "question": 450, "fused": 450, "recommendation": 640}
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+CHARS_PER_TOKEN = 4  # Frammento medio di una parola lunga
+
+
+def estimate_tokens(text: Any) -> int:
+    """Stima approssimata dei token di un testo (una parola breve o un simbolo = 1 token)."""
+    if isinstance(text, (list, tuple)):
+        return sum(estimate_tokens(part) for part in text)  # Es. prefisso di sistema + suffisso
+    if not isinstance(text, str):
+        text = str(text)
+    return sum(1 + (len(piece) - 1) // CHARS_PER_TOKEN for piece in _PIECE_RE.findall(text))
+
+
+def truncate(text: str, max_tokens: int) -> str:
+    """Accorcia il testo a circa max_tokens token, tagliando tra una parola e l'altra."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    kept, used = [], 0
+    for word in text.split():
+        used += estimate_tokens(word)
+        if used > max_tokens:
+            break
+        kept.append(word)
+    return " ".join(kept) + "…"
+
+
+class TokenBudget:
+    """Budget dei prompt e contabilità dei token per tipo di chiamata."""
+
+    def __init__(self):
+        self.budgets: Dict[str, int] = {
+            call_type: int(os.getenv(f"PROMPT_BUDGET_{call_type.upper()}", default))
+            for call_type, default in DEFAULT_BUDGETS.items()
+        }
+        self.enabled = os.getenv("PROMPT_BUDGET_ENABLED", "true").lower() == "true"
+
+    def fit(self, call_type: str, build: Callable[[int], Any]) -> Any:
+        """
+        Costruisce il prompt con build(livello) partendo dal livello FULL e compattando
+        finché non rientra nel budget; se nemmeno l'ultimo livello ci sta lo usa comunque.
+        """
+        budget = self.budgets.get(call_type)
+        level = FULL
+        prompt = build(level)
+        if not self.enabled or budget is None:
+            return prompt
+
+        tokens = estimate_tokens(prompt)
+        while tokens > budget and level < LEVELS[-1]:
+            level += 1
+            prompt = build(level)
+            tokens = estimate_tokens(prompt)
+
+        if level > FULL:
+            metrics.increment(f"prompt_compactions_{call_type}")
+        if tokens > budget:
+            metrics.increment(f"prompt_budget_overruns_{call_type}")
+        return prompt
+
+    def record(self, call_type: str, prompt: Any, output_text: str, usage: Optional[Any] = None) -> None:
+        """Registra i token di una chiamata riuscita (conteggi reali se presenti, altrimenti stimati)."""
+        estimated = estimate_tokens(prompt)
+        input_tokens = getattr(usage, "prompt_token_count", None)
+        output_tokens = getattr(usage, "candidates_token_count", None)
+        cached_tokens = getattr(usage, "cached_content_token_count", None) or 0
+        if input_tokens:
+            # Rapporto stima/reale: serve a tarare CHARS_PER_TOKEN e i budget
+            metrics.observe("llm_token_estimate_ratio", estimated / input_tokens)
+        else:
+            input_tokens = estimated
+        if output_tokens is None:
+            output_tokens = estimate_tokens(output_text)
+
+        metrics.increment(f"llm_input_tokens_{call_type}", input_tokens)
+        metrics.increment(f"llm_output_tokens_{call_type}", output_tokens)
+        if cached_tokens:
+            # Token del prefisso serviti dalla cache (esplicita o implicita): il risparmio sull'input
+            metrics.increment(f"llm_cached_input_tokens_{call_type}", cached_tokens)
+        metrics.observe(f"llm_prompt_tokens_{call_type}", input_tokens)
+
+
+# Istanza globale
+token_budget = TokenBudget()
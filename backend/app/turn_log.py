@@ -0,0 +1,98 @@
+"""
+Registro compatto dei turni di conversazione.
+Ogni turno è una tupla (ruolo, messaggio, timestamp epoch) con ruoli internati;
+il profilo tiene in memoria solo la coda più recente, i turni più vecchi vengono
+spostati in un archivio SQLite append-only (data/sqlite).
+"""
+import os
+import sys
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'data')
+
+# Turni tenuti nel profilo; oltre hot + spill_batch i più vecchi vanno su disco
+HISTORY_HOT_TURNS = int(os.getenv("HISTORY_HOT_TURNS", 20))
+HISTORY_SPILL_BATCH = int(os.getenv("HISTORY_SPILL_BATCH", 10))
+
+
+class Turn(NamedTuple):
+    """Un turno di conversazione (serializzato come [ruolo, messaggio, ts])."""
+    role: str
+    message: str
+    ts: float
+
+    @classmethod
+    def create(cls, role: str, message: str, ts: float) -> "Turn":
+        return cls(sys.intern(role), message, ts)
+
+    @classmethod
+    def from_dict(cls, turn: Dict[str, str]) -> "Turn":
+        """Converte un turno nel vecchio formato dict (con timestamp ISO)."""
+        timestamp = turn.get("timestamp")
+        ts = datetime.fromisoformat(timestamp).timestamp() if timestamp else 0.0
+        return cls.create(turn.get("role", ""), turn.get("message", ""), ts)
+
+    def as_dict(self) -> Dict[str, str]:
+        """Formato dict storico: role, message, timestamp ISO."""
+        return {
+            "role": self.role,
+            "message": self.message,
+            "timestamp": datetime.fromtimestamp(self.ts).isoformat()
+        }
+
+
+class TurnArchive:
+    """Archivio append-only dei turni usciti dalla coda in memoria."""
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or os.getenv("HISTORY_DB_PATH", os.path.join(DATA_DIR, 'sqlite', 'history.sqlite3'))
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """Apre il database alla prima scrittura/lettura (da chiamare col lock)."""
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS turns ("
+                " session_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL,"
+                " message TEXT NOT NULL, ts REAL NOT NULL, PRIMARY KEY (session_id, seq)) WITHOUT ROWID"
+            )
+            self._db.commit()
+        return self._db
+
+    def append(self, session_id: str, first_seq: int, turns: List[Turn]) -> None:
+        """Aggiunge i turni con numeri di sequenza consecutivi a partire da first_seq."""
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO turns (session_id, seq, role, message, ts) VALUES (?, ?, ?, ?, ?)",
+                    [(session_id, first_seq + i, *turn) for i, turn in enumerate(turns)]
+                )
+
+    def read(self, session_id: str, before_seq: Optional[int] = None) -> List[Turn]:
+        """Turni archiviati della sessione in ordine (solo quelli con seq < before_seq, se dato)."""
+        before_seq = before_seq if before_seq is not None else 2 ** 62
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT role, message, ts FROM turns WHERE session_id = ? AND seq < ? ORDER BY seq",
+                (session_id, before_seq)
+            ).fetchall()
+        return [Turn.create(*row) for row in rows]
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+
+
+# Istanza globale
+turn_archive = TurnArchive()
@@ -1,12 +1,27 @@
 """
 Modulo per la ricerca web di informazioni su corsi universitari, ITS e statistiche occupazionali.
 """
+import os
+import asyncio
 import requests
 from typing import Dict, List, Any, Optional
 import json
 from duckduckgo_search import DDGS
 import re
 from urllib.parse import quote_plus
+from concurrent.futures import ThreadPoolExecutor, wait
+
+try:
+    from search_cache import search_cache
+except ImportError:
+    from .search_cache import search_cache
+
+# Pool condiviso per le ricerche in parallelo (limita le connessioni verso DuckDuckGo)
+SEARCH_MAX_WORKERS = int(os.getenv("WEB_SEARCH_MAX_WORKERS", 6))
+SEARCH_DEADLINE_SECONDS = float(os.getenv("WEB_SEARCH_DEADLINE_SECONDS", 8))
+_search_executor = ThreadPoolExecutor(max_workers=SEARCH_MAX_WORKERS, thread_name_prefix="web-search")
+# Materie usate nelle query (e quindi nell'impronta della ricerca)
+QUERY_INTERESTS = 2
 
 
 class WebSearcher:
@@ -21,30 +36,51 @@ class WebSearcher:
         
         self.its_keywords = ['ITS', 'Istituto Tecnico Superiore', 'tecnico superiore']
         
-    def search_duckduckgo(self, query: str, max_results: int = 8) -> List[Dict[str, str]]:
-        """Cerca su DuckDuckGo."""
+    def search_duckduckgo(self, query: str, max_results: int = 8, region: str = 'it-it') -> List[Dict[str, str]]:
+        """Cerca su DuckDuckGo, passando prima dalla cache delle ricerche."""
+        cached = search_cache.get(query, region, max_results)
+        if cached is not None:
+            return cached
+        
         try:
             with DDGS() as ddgs:
                 results = []
-                for r in ddgs.text(query, region='it-it', max_results=max_results):
+                for r in ddgs.text(query, region=region, max_results=max_results):
                     results.append({
                         'title': r.get('title', ''),
                         'url': r.get('href', ''),
                         'snippet': r.get('body', '')[:200],
                         'source': 'duckduckgo'
                     })
-                return results
         except Exception as e:
             print(f"⚠️  Errore ricerca DuckDuckGo: {e}")
             return []
+        
+        # Non mettiamo in cache i risultati vuoti (spesso dovuti a rate limit)
+        if results:
+            search_cache.set(query, region, max_results, results)
+        return results
+    
+    async def search_duckduckgo_async(self, query: str, max_results: int = 8, region: str = 'it-it') -> List[Dict[str, str]]:
+        """Versione asincrona di search_duckduckgo (il client DDGS è sincrono, gira in un thread)."""
+        return await asyncio.to_thread(self.search_duckduckgo, query, max_results, region)
     
     def search_university_courses(self, interests: List[str], location: str = None) -> Dict[str, Any]:
         """Cerca corsi universitari basati su interessi e località."""
-        # Costruisci query
+        query = self._university_query(interests, location)
+        
+        print(f"🔍 Ricerca corsi: {query}")
+        
+        # Cerca
+        results = self.search_duckduckgo(query, max_results=10)
+        return self._summarize_university_results(query, results, interests, location)
+    
+    def _university_query(self, interests: List[str], location: str = None) -> str:
+        """Costruisce la query per i corsi universitari."""
         query_terms = []
         
         if interests:
-            query_terms.extend(interests[:2])  # Prendi i primi 2 interessi
+            query_terms.extend(interests[:QUERY_INTERESTS])  # Prendi i primi 2 interessi
         
         query = "corso di laurea " + " ".join(query_terms)
         
@@ -52,12 +88,11 @@ class WebSearcher:
             query += f" {location}"
         
         query += " università sito ufficiale"
-        
-        print(f"🔍 Ricerca corsi: {query}")
-        
-        # Cerca
-        results = self.search_duckduckgo(query, max_results=10)
-        
+        return query
+    
+    def _summarize_university_results(self, query: str, results: List[Dict], interests: List[str],
+                                      location: str = None) -> Dict[str, Any]:
+        """Filtra e struttura i risultati della ricerca universitaria."""
         # Filtra risultati universitari
         university_results = []
         for result in results:
@@ -78,20 +113,29 @@ class WebSearcher:
     
     def search_its_courses(self, interests: List[str], location: str = None) -> Dict[str, Any]:
         """Cerca corsi ITS."""
+        query = self._its_query(interests, location)
+        
+        print(f"🔍 Ricerca ITS: {query}")
+        
+        results = self.search_duckduckgo(query, max_results=8)
+        return self._summarize_its_results(query, results, interests, location)
+    
+    def _its_query(self, interests: List[str], location: str = None) -> str:
+        """Costruisce la query per i corsi ITS."""
         query = "ITS corso"
         
         if interests:
-            query += f" {' '.join(interests[:2])}"
+            query += f" {' '.join(interests[:QUERY_INTERESTS])}"
         
         if location:
             query += f" {location}"
         
         query += " istituto tecnico superiore"
-        
-        print(f"🔍 Ricerca ITS: {query}")
-        
-        results = self.search_duckduckgo(query, max_results=8)
-        
+        return query
+    
+    def _summarize_its_results(self, query: str, results: List[Dict], interests: List[str],
+                               location: str = None) -> Dict[str, Any]:
+        """Filtra e struttura i risultati della ricerca ITS."""
         # Filtra per ITS
         its_results = []
         for result in results:
@@ -114,6 +158,17 @@ class WebSearcher:
     
     def search_employment_stats(self, field: str, location: str = None) -> Dict[str, Any]:
         """Cerca statistiche occupazionali."""
+        queries = self._employment_queries(field, location)
+        
+        all_results = []
+        for query in queries:
+            results = self.search_duckduckgo(query, max_results=5)
+            all_results.extend(results)
+        
+        return self._summarize_employment_results(field, queries, all_results)
+    
+    def _employment_queries(self, field: str, location: str = None) -> List[str]:
+        """Query per le statistiche occupazionali (solo le prime 2)."""
         # Query per Almalaurea/Excelsior
         queries = [
             f"occupazione {field} Almalaurea",
@@ -124,11 +179,11 @@ class WebSearcher:
         if location:
             queries = [f"{q} {location}" for q in queries]
         
-        all_results = []
-        for query in queries[:2]:  # Solo prime 2 query
-            results = self.search_duckduckgo(query, max_results=5)
-            all_results.extend(results)
-        
+        return queries[:2]
+    
+    def _summarize_employment_results(self, field: str, queries: List[str],
+                                      all_results: List[Dict]) -> Dict[str, Any]:
+        """Filtra le fonti attendibili tra i risultati occupazionali."""
         # Filtra fonti attendibili
         reliable_sources = []
         for result in all_results:
@@ -143,7 +198,7 @@ class WebSearcher:
         
         return {
             'field': field,
-            'queries': queries[:2],
+            'queries': queries,
             'total_results': len(all_results),
             'reliable_sources': len(reliable_sources),
             'sources': reliable_sources[:3]
@@ -274,46 +329,150 @@ class WebSearcher:
         
         return relevance
     
-    def search_for_student_profile(self, profile_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Ricerca informazioni basate sul profilo studente."""
+    def search_for_student_profile(self, profile_data: Dict[str, Any],
+                                   deadline: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Ricerca informazioni basate sul profilo studente.
+        Le query indipendenti (università, ITS, statistiche occupazionali) partono in
+        parallelo sul pool condiviso; allo scadere della deadline si restituisce ciò che
+        è arrivato, con 'partial' = True e l'elenco delle ricerche mancanti.
+        """
         print(f"🎯 Ricerca per profilo studente...")
+        deadline = SEARCH_DEADLINE_SECONDS if deadline is None else deadline
         
+        # Fan-out sul pool condiviso con deadline complessiva
+        futures = {
+            _search_executor.submit(self.search_duckduckgo, query, max_results): (section, key, query)
+            for section, key, query, max_results in self._plan_searches(profile_data)
+        }
+        done, not_done = wait(futures, timeout=deadline) if futures else (set(), set())
+        return self._assemble_results(profile_data, futures, done, not_done)
+    
+    def _plan_searches(self, profile_data: Dict[str, Any]) -> List[tuple]:
+        """Ricerche da lanciare per il profilo, ciascuna come (sezione, chiave, query, max_results)."""
         interests = profile_data.get('favorite_subjects', [])
         location = profile_data.get('location')
         school_type = profile_data.get('school_type', '')
-        
-        results = {
-            'university_courses': [],
-            'its_courses': [],
-            'employment_stats': [],
-            'recommendations': []
-        }
+        searches = []
         
         # 1. Cerca corsi universitari se interessi accademici
         if interests and len(interests) > 0:
-            results['university_courses'] = self.search_university_courses(interests, location)
+            query = self._university_query(interests, location)
+            print(f"🔍 Ricerca corsi: {query}")
+            searches.append(('university_courses', None, query, 10))
         
         # 2. Cerca ITS se profilo più tecnico/pratico
-        if school_type and ('ITIS' in school_type or 'Tecnico' in school_type):
-            results['its_courses'] = self.search_its_courses(interests, location)
-        elif interests:
-            # Prova comunque ITS se ci sono interessi tecnici
-            technical_keywords = ['informatica', 'elettronica', 'meccanica', 'automazione']
-            if any(keyword in ' '.join(interests).lower() for keyword in technical_keywords):
-                results['its_courses'] = self.search_its_courses(interests, location)
+        if self._should_search_its(interests, school_type):
+            query = self._its_query(interests, location)
+            print(f"🔍 Ricerca ITS: {query}")
+            searches.append(('its_courses', None, query, 8))
         
         # 3. Cerca statistiche occupazionali per i primi 2 interessi
         if interests:
-            for interest in interests[:2]:
-                stats = self.search_employment_stats(interest, location)
-                if stats['reliable_sources'] > 0:
-                    results['employment_stats'].append(stats)
+            for interest in interests[:QUERY_INTERESTS]:
+                for query in self._employment_queries(interest, location):
+                    searches.append(('employment_stats', interest, query, 5))
+        
+        return searches
+    
+    def _assemble_results(self, profile_data: Dict[str, Any], futures: Dict[Any, tuple],
+                          done: set, not_done: set) -> Dict[str, Any]:
+        """Ricompone nelle sezioni i risultati delle ricerche concluse entro la deadline."""
+        interests = profile_data.get('favorite_subjects', [])
+        location = profile_data.get('location')
+        
+        results = {
+            'university_courses': {},
+            'its_courses': {},
+            'employment_stats': [],
+            'recommendations': [],
+            'partial': False,
+            'timed_out': []
+        }
         
-        # 4. Genera raccomandazioni basate sui risultati
+        finished = {}
+        for future in done:
+            try:
+                finished[futures[future]] = future.result()
+            except Exception as e:
+                print(f"⚠️  Errore ricerca: {e}")
+                finished[futures[future]] = []
+        
+        for future in not_done:
+            # Le ricerche già avviate finiscono in background e popolano la cache
+            future.cancel()
+            results['timed_out'].append(futures[future][2])
+        
+        if not_done:
+            results['partial'] = True
+            results['timed_out'].sort()
+            print(f"⏱️  Ricerca parziale: {len(not_done)}/{len(futures)} query oltre la deadline")
+        
+        employment_results: Dict[str, Dict[str, List[Dict]]] = {}
+        for (section, key, query), section_results in finished.items():
+            if section == 'university_courses':
+                results['university_courses'] = self._summarize_university_results(
+                    query, section_results, interests, location)
+            elif section == 'its_courses':
+                results['its_courses'] = self._summarize_its_results(
+                    query, section_results, interests, location)
+            else:
+                employment_results.setdefault(key, {})[query] = section_results
+        
+        for interest in interests[:QUERY_INTERESTS]:
+            if interest not in employment_results:
+                continue
+            queries = [q for q in self._employment_queries(interest, location) if q in employment_results[interest]]
+            all_results = [r for q in queries for r in employment_results[interest][q]]
+            stats = self._summarize_employment_results(interest, queries, all_results)
+            if stats['reliable_sources'] > 0:
+                results['employment_stats'].append(stats)
+        
+        # Genera raccomandazioni basate sui risultati
         results['recommendations'] = self._generate_recommendations(results, profile_data)
         
         return results
     
+    def _should_search_its(self, interests: List[str], school_type: str) -> bool:
+        """Decide se cercare anche corsi ITS."""
+        if school_type and ('ITIS' in school_type or 'Tecnico' in school_type):
+            return True
+        elif interests:
+            # Prova comunque ITS se ci sono interessi tecnici
+            technical_keywords = ['informatica', 'elettronica', 'meccanica', 'automazione']
+            if any(keyword in ' '.join(interests).lower() for keyword in technical_keywords):
+                return True
+        return False
+    
+    def search_fingerprint(self, profile_data: Dict[str, Any]) -> tuple:
+        """
+        Impronta degli input che determinano le ricerche di search_for_student_profile:
+        due profili con la stessa impronta producono le stesse query.
+        """
+        interests = profile_data.get('favorite_subjects') or []
+        return (
+            tuple(interests[:QUERY_INTERESTS]),
+            profile_data.get('location'),
+            self._should_search_its(interests, profile_data.get('school_type') or ''),
+        )
+    
+    async def search_for_student_profile_async(self, profile_data: Dict[str, Any],
+                                               deadline: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Versione asincrona di search_for_student_profile: le query vanno direttamente sul
+        pool condiviso e l'event loop ne attende i future, senza occupare un thread in attesa.
+        """
+        print(f"🎯 Ricerca per profilo studente...")
+        deadline = SEARCH_DEADLINE_SECONDS if deadline is None else deadline
+        
+        futures = {
+            asyncio.wrap_future(_search_executor.submit(self.search_duckduckgo, query, max_results)):
+                (section, key, query)
+            for section, key, query, max_results in self._plan_searches(profile_data)
+        }
+        done, not_done = await asyncio.wait(futures, timeout=deadline) if futures else (set(), set())
+        return self._assemble_results(profile_data, futures, done, not_done)
+    
     def _generate_recommendations(self, search_results: Dict, profile_data: Dict) -> List[str]:
         """Genera raccomandazioni basate sui risultati di ricerca."""
         recommendations = []
@@ -25,6 +25,13 @@ export interface ChatMessageResponse {
   conversation_history: any[];
 }
 
+export interface ChatStreamHandlers {
+  onStatus?: (event: string, data: any) => void; // "extracting", "thinking"
+  onChunk?: (text: string) => void;
+  onDone?: (response: ChatMessageResponse) => void;
+  onError?: (detail: string) => void;
+}
+
 // Funzioni API
 export const chatAPI = {
   // Invia un messaggio all'agente
@@ -45,6 +52,57 @@ export const chatAPI = {
     }
   },
 
+  // Invia un messaggio e ricevi la risposta in streaming (Server-Sent Events)
+  streamMessage: async (
+    message: string,
+    sessionId: string | undefined,
+    handlers: ChatStreamHandlers,
+  ): Promise<ChatMessageResponse | undefined> => {
+    const response = await fetch(`${API_BASE_URL}/api/chat/stream`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ message, session_id: sessionId }),
+    });
+    if (!response.ok || !response.body) {
+      throw new Error(`Streaming non disponibile (${response.status})`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let final: ChatMessageResponse | undefined;
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      // Gli eventi SSE sono separati da una riga vuota
+      let boundary = buffer.indexOf('\n\n');
+      while (boundary !== -1) {
+        const raw = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        boundary = buffer.indexOf('\n\n');
+
+        let event = 'message';
+        let data = '';
+        for (const line of raw.split('\n')) {
+          if (line.startsWith('event: ')) event = line.slice(7);
+          else if (line.startsWith('data: ')) data += line.slice(6);
+        }
+        const payload = data ? JSON.parse(data) : {};
+
+        if (event === 'chunk') handlers.onChunk?.(payload.text);
+        else if (event === 'done') {
+          final = payload;
+          handlers.onDone?.(payload);
+        } else if (event === 'error') handlers.onError?.(payload.detail);
+        else handlers.onStatus?.(event, payload);
+      }
+    }
+    return final;
+  },
+
   // Ottieni raccomandazioni
   getRecommendations: async (data: {
     interests: string[];